@@ -0,0 +1,128 @@
+"""Reorder-point alerts per (product, location).
+
+A reorder point is stored per pair in ``reorder_thresholds``; a pair whose
+balance is at or below it is in ``stock_alerts``, the "below threshold" set
+the dashboard and ``/api/alerts`` read. The set is maintained incrementally:
+every balance write calls ``refresh_alerts`` with the pairs it touched, in
+the same transaction, which re-checks just those pairs against their
+thresholds. The cost of a write is therefore proportional to the pairs it
+changed, never to the ledger or the number of thresholds. ``rebuild_alerts``
+recomputes the whole set, for use after the balance table is rebuilt.
+"""
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, literal, select, tuple_
+
+from models import db, Location, Product, ReorderThreshold, StockAlert, StockBalance
+from writes import LOOKUP_CHUNK, replace, upsert
+
+thresholds_table = ReorderThreshold.__table__
+alerts_table = StockAlert.__table__
+balances_table = StockBalance.__table__
+
+Pair = Tuple[str, str]
+
+
+def _threshold_balances():
+    """Thresholds with the current balance of their pair (0 if it has none)"""
+    t, b = thresholds_table, balances_table
+    return select(t.c.product_id, t.c.location_id, t.c.reorder_point, func.coalesce(b.c.qty, 0).label('qty'))\
+        .select_from(t.outerjoin(b, and_(b.c.product_id == t.c.product_id, b.c.location_id == t.c.location_id)))
+
+
+def _clear_alerts(pairs: List[Pair]) -> None:
+    a = alerts_table
+    db.session.execute(a.delete().where(tuple_(a.c.product_id, a.c.location_id).in_(pairs)))
+
+
+def refresh_alerts(pairs: Iterable[Pair]) -> None:
+    """Re-evaluate the alerts of the given pairs against their current balances.
+    Runs in the caller's transaction, after the balance writes.
+    """
+    pairs = sorted(set(pairs))
+    t = thresholds_table
+    now = datetime.utcnow()
+    for i in range(0, len(pairs), LOOKUP_CHUNK):
+        rows = db.session.execute(
+            _threshold_balances().where(tuple_(t.c.product_id, t.c.location_id).in_(pairs[i:i + LOOKUP_CHUNK]))
+        ).all()
+        # Pairs without a threshold have no alert (removing a threshold clears its alert)
+        low = [{'product_id': row.product_id, 'location_id': row.location_id, 'qty': int(row.qty),
+                'reorder_point': row.reorder_point, 'raised_at': now}
+               for row in rows if row.qty <= row.reorder_point]
+        cleared = [(row.product_id, row.location_id) for row in rows if row.qty > row.reorder_point]
+        if low:
+            # raised_at is kept for alerts that were already raised
+            upsert(alerts_table, ['product_id', 'location_id'], {'qty': replace, 'reorder_point': replace}, low)
+        if cleared:
+            _clear_alerts(cleared)
+
+
+def rebuild_alerts() -> int:
+    """Recompute the whole alert set from the thresholds. Returns the number of alerts."""
+    db.session.execute(alerts_table.delete())
+    source = _threshold_balances().subquery()
+    db.session.execute(alerts_table.insert().from_select(
+        ['product_id', 'location_id', 'qty', 'reorder_point', 'raised_at'],
+        select(source.c.product_id, source.c.location_id, source.c.qty, source.c.reorder_point,
+               literal(datetime.utcnow(), db.DateTime)).where(source.c.qty <= source.c.reorder_point),
+    ))
+    return db.session.query(func.count()).select_from(alerts_table).scalar()
+
+
+def set_reorder_point(product_id: str, location_id: str, reorder_point: Optional[int]) -> None:
+    """Set (or with None, remove) the reorder point of a pair and re-evaluate its alert"""
+    threshold = db.session.get(ReorderThreshold, (product_id, location_id))
+    if reorder_point is None:
+        if threshold is not None:
+            db.session.delete(threshold)
+        db.session.flush()
+        _clear_alerts([(product_id, location_id)])
+        return
+    if threshold is None:
+        db.session.add(ReorderThreshold(product_id=product_id, location_id=location_id,
+                                        reorder_point=reorder_point))
+    else:
+        threshold.reorder_point = reorder_point
+    db.session.flush()
+    refresh_alerts([(product_id, location_id)])
+
+
+def remove_reorder_points(product_id: Optional[str] = None, location_id: Optional[str] = None) -> None:
+    """Drop the thresholds and alerts of a product or location that is being deleted"""
+    for table in (thresholds_table, alerts_table):
+        column = table.c.product_id if product_id else table.c.location_id
+        db.session.execute(table.delete().where(column == (product_id or location_id)))
+
+
+def alerts_query(product_id: Optional[str] = None, location_id: Optional[str] = None):
+    """Current alerts with product and location names, largest shortfall first"""
+    query = db.session.query(
+        StockAlert.product_id, Product.name.label('product_name'),
+        StockAlert.location_id, Location.name.label('location_name'),
+        StockAlert.qty, StockAlert.reorder_point,
+        (StockAlert.reorder_point - StockAlert.qty).label('shortfall'),
+        StockAlert.raised_at,
+    ).join(Product, Product.product_id == StockAlert.product_id)\
+     .join(Location, Location.location_id == StockAlert.location_id)
+    if product_id:
+        query = query.filter(StockAlert.product_id == product_id)
+    if location_id:
+        query = query.filter(StockAlert.location_id == location_id)
+    return query.order_by((StockAlert.reorder_point - StockAlert.qty).desc(),
+                          StockAlert.product_id, StockAlert.location_id)
+
+
+def alert_dict(row) -> dict:
+    """Plain-data form of an alerts_query row, for JSON and the cache"""
+    return {
+        'product_id': row.product_id,
+        'product_name': row.product_name,
+        'location_id': row.location_id,
+        'location_name': row.location_name,
+        'qty': row.qty,
+        'reorder_point': row.reorder_point,
+        'shortfall': row.shortfall,
+        'raised_at': row.raised_at,
+    }
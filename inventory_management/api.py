@@ -0,0 +1,205 @@
+"""Versioned JSON API for integrations, mounted at /api/v1.
+
+    GET /api/v1/<resource>              products, locations, movements, balances
+    GET /api/v1/<resource>/<id>         products, locations, movements
+
+Lists are paged by cursor (``?cursor=`` from the previous page's
+``paging.next_cursor``, ``?limit=`` up to MAX_LIMIT, ``?count=none|approx|exact``)
+in the same order and with the same indexes as the HTML lists, so a sync job
+can walk a whole table in constant time per page. ``?fields=a,b`` returns only
+those fields. Only the needed columns are selected and rows go straight from
+the cursor to JSON, without building ORM objects. The movements list covers
+the live ledger only: its ``archived_before`` gives the end of the latest
+archived period (null if none), before which movements are in the archive
+and only their opening balances (``OB-`` IDs) are listed.
+
+Responses carry a weak ETag and answer ``If-None-Match`` with 304, and bodies
+over MIN_COMPRESS_BYTES are compressed with brotli (if the ``brotli`` package
+is installed) or gzip, per the request's Accept-Encoding.
+"""
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+from flask import Blueprint, abort, current_app, jsonify, request
+from sqlalchemy import or_
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+
+from balances import closed_until
+from models import db, Location, Product, ProductMovement, StockBalance
+from pagination import COUNT_MODES, InvalidCursor, keyset_paginate
+from snapshots import parse_as_of, parse_datetime
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Smaller bodies gain little from compression
+MIN_COMPRESS_BYTES = 1024
+
+# Table, fields in output order, keyset order columns (unique, ending with the key), ID field of
+# single-item lookups
+RESOURCES = {
+    'products': (Product.__table__, ['product_id', 'name', 'description', 'unit_price', 'created_at'],
+                 ['created_at', 'product_id'], 'product_id'),
+    'locations': (Location.__table__, ['location_id', 'name', 'address', 'manager', 'created_at'],
+                  ['created_at', 'location_id'], 'location_id'),
+    'movements': (ProductMovement.__table__, ['movement_id', 'timestamp', 'product_id', 'from_location',
+                                              'to_location', 'qty', 'notes'],
+                  ['timestamp', 'movement_id'], 'movement_id'),
+    'balances': (StockBalance.__table__, ['product_id', 'location_id', 'qty'],
+                 ['product_id', 'location_id'], None),
+}
+
+
+def api_error(status: int, message: str):
+    response = jsonify({'error': message})
+    response.status_code = status
+    abort(response)
+
+
+def resource_or_404(resource: str):
+    if resource not in RESOURCES:
+        api_error(404, f'Unknown resource {resource}')
+    return RESOURCES[resource]
+
+
+def requested_fields(fields: list) -> list:
+    """The ?fields= subset of fields, in the order requested (all fields if absent)"""
+    value = request.args.get('fields', '').strip()
+    if not value:
+        return fields
+    selected = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in fields]
+    if unknown:
+        api_error(400, f"Unknown field(s) {', '.join(unknown)}; available: {', '.join(fields)}")
+    return list(dict.fromkeys(selected))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def json_body(payload) -> bytes:
+    """Compact JSON encoding of plain rows and dicts"""
+    return json.dumps(payload, separators=(',', ':'), default=_json_default).encode()
+
+
+def apply_filters(resource: str, table, query):
+    """Narrow a list query by the resource's filter parameters"""
+    args = request.args
+    c = table.c
+    if resource in ('movements', 'balances') and args.get('product_id'):
+        query = query.filter(c.product_id == args['product_id'])
+    if resource == 'balances' and args.get('location_id'):
+        query = query.filter(c.location_id == args['location_id'])
+    if resource == 'movements':
+        if args.get('location_id'):
+            query = query.filter(or_(c.from_location == args['location_id'], c.to_location == args['location_id']))
+        try:
+            if args.get('since'):
+                query = query.filter(c.timestamp >= parse_datetime(args['since']))
+            if args.get('until'):
+                query = query.filter(c.timestamp < parse_as_of(args['until']))
+        except ValueError:
+            api_error(400, 'since and until must be ISO dates or date/times')
+    return query
+
+
+def json_response(payload, status: int = 200):
+    """Compact JSON response with a weak ETag; 304 if the client already has it"""
+    body = json_body(payload)
+    etag = hashlib.sha1(body).hexdigest()
+    if status == 200 and not is_resource_modified(request.environ, etag=etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, status=status, mimetype='application/json')
+    # Weak, so the same validator holds for every content coding of the body
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
+
+
+@api.route('/<resource>')
+def list_resource(resource):
+    """One page of a resource, in descending order of its keyset columns"""
+    table, fields, order, _ = resource_or_404(resource)
+    selected = requested_fields(fields)
+    limit = max(1, min(request.args.get('limit', type=int, default=DEFAULT_LIMIT), MAX_LIMIT))
+    count = request.args.get('count', 'none')
+    if count not in COUNT_MODES:
+        api_error(400, f"count must be one of {', '.join(COUNT_MODES)}")
+
+    # The order columns are always selected: the next cursor is built from them
+    columns = [table.c[name] for name in dict.fromkeys(selected + order)]
+    query = apply_filters(resource, table, db.session.query(*columns))
+    try:
+        page = keyset_paginate(query, [table.c[name] for name in order], cursor=request.args.get('cursor'),
+                               per_page=limit, count=count)
+    except InvalidCursor:
+        api_error(400, 'Invalid cursor')
+    data = [{name: getattr(row, name) for name in selected} for row in page.items]
+    payload = {'data': data, 'paging': page.as_dict()}
+    if resource == 'movements':
+        # Movements before it were moved to the archive and aren't listed
+        payload['archived_before'] = closed_until()
+    return json_response(payload)
+
+
+@api.route('/<resource>/<item_id>')
+def get_resource(resource, item_id):
+    """A single product, location or movement"""
+    table, fields, _, key = resource_or_404(resource)
+    if key is None:
+        api_error(404, f'{resource} has no single-item lookup; filter the list instead')
+    selected = requested_fields(fields)
+    row = db.session.execute(
+        db.select(*[table.c[name] for name in selected]).where(table.c[key] == item_id)
+    ).first()
+    if row is None:
+        api_error(404, f'{resource[:-1].capitalize()} {item_id} not found')
+    return json_response({'data': dict(zip(selected, row))})
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    """JSON instead of HTML error pages under /api/v1"""
+    if error.response is not None:
+        return error.response
+    return jsonify({'error': error.description}), error.code
+
+
+def negotiated_encoding():
+    """'br' or 'gzip' if the client accepts it, else None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+@api.after_request
+def compress(response):
+    """Compress sizeable JSON bodies in the best coding the client accepts"""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.content_length is None or response.content_length < MIN_COMPRESS_BYTES):
+        return response
+    encoding = negotiated_encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    response.set_data(brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    return response
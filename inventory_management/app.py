@@ -1,67 +1,200 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from models import db, Product, Location, ProductMovement
-from datetime import datetime
-import uuid
-from sqlalchemy import func
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, send_file, session
+from database import configure_database, init_database
+from models import (db, generate_id, ArchivedMovement, Job, Product, Location, ProductDailyFlow, ProductMovement,
+                    ReorderThreshold, StockBalance)
+from balances import (MAX_QTY, REPORT_COLUMNS, InsufficientStock, MovementChanged, apply_deltas, apply_movement,
+                      balance_report_query, balance_report_summary, claim_movement, closed_until, get_balance,
+                      movement_deltas, rebuild_balances, recorded_movements, verify_balances)
+from exports import EXPORT_MIMETYPES, export_response, iter_csv, iter_ndjson
+from migrations import migrate, pending_migrations
+from instrumentation import init_metrics, init_query_counter
+from cache import (LOCATION_CHOICES, LOCATION_COUNT, MOVEMENT_COUNT, PRODUCT_CHOICES, PRODUCT_COUNT,
+                   RECENT_MOVEMENTS, STOCK_ALERTS, cached, get_cache, init_cache, invalidate)
+from api import api
+from history import BUCKETS, apply_flows, location_history, movement_flows, parse_bucket, product_history, rebuild_history
+from ledgercheck import check_ledger
+from jobs import JobError, expire_job_results, init_jobs, job_dict, prune_jobs, submit_job, task
+from alerts import alert_dict, alerts_query, remove_reorder_points, set_reorder_point
+from bulk import BulkFormatError, ingest_movements, load_records
+from catalog import CATALOGS, IMPORT_MODES, catalog_rows, import_catalog, iter_catalog_records
+from lookup import location_index, lookup_limit, product_index
+from pagination import COUNT_MODES, InvalidCursor, keyset_paginate
+from search import init_search, install_search_index, rebuild_search_index, search_filter, search_rank
+from archive import archive_movements, archive_preview, is_closed
+from snapshots import (balances_as_of_select, invalidate_snapshots, parse_as_of, parse_datetime, stock_as_of,
+                       take_daily_snapshots, take_snapshot)
+from datetime import datetime, timedelta
+import hashlib
+import io
+import json
+import time
+import click
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import configure_mappers, joinedload
 from typing import Optional
+from werkzeug.http import is_resource_modified
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQL statements allowed per request; see instrumentation.py
+app.config['QUERY_BUDGET'] = None
+app.config['QUERY_BUDGETS'] = {
+    'index': 5,
+    # The lists and detail pages each add one primary key lookup of the archive cutoff
+    'movements': 3,
+    'view_movement': 2,
+    'view_product': 4,
+    'view_location': 5,
+}
 
+configure_database(app)
 db.init_app(app)
+app.register_blueprint(api)
+init_database(app, db)
+init_search(app, db)
+init_query_counter(app, db)
+init_metrics(app, db)
+init_cache(app)
+init_jobs(app)
 
-def generate_id():
-    """Generate a unique ID"""
-    return str(uuid.uuid4())[:8].upper()
+def movement_load_options():
+    """Load each movement's product and locations in the same SELECT instead of one query per row"""
+    configure_mappers()  # the relationships below are backrefs created at mapper configuration
+    return (
+        joinedload(ProductMovement.product),
+        joinedload(ProductMovement.from_location_obj),
+        joinedload(ProductMovement.to_location_obj),
+    )
 
-def get_stock(product_id: str, location_id: str, exclude_movement_id: Optional[str] = None) -> int:
-    """Compute current stock for a product at a location.
-    Optionally exclude a movement (useful when editing).
+def cursor_paging_requested():
+    """True if the list should be paged by cursor (?paging=cursor or a ?cursor= token)"""
+    return request.args.get('paging') == 'cursor' or bool(request.args.get('cursor'))
+
+def apply_search(query, model, q):
+    """Filter a list query to rows matching q, best matches first.
+    Cursor paging needs a stable key order, so results aren't ranked in that mode.
+    """
+    query = query.filter(search_filter(model, q))
+    rank = search_rank(model, q)
+    if rank is not None and not cursor_paging_requested():
+        query = query.order_by(rank)
+    return query
+
+def paginate_list(query, order_columns, per_page):
+    """Page a list query by page number (default) or by cursor.
+    Cursor mode is used with ?paging=cursor or when a ?cursor= token is given;
+    ?count=none|approx|exact controls how the total is reported in that mode.
     """
-    q = ProductMovement.query.filter_by(product_id=product_id)
-    if exclude_movement_id:
-        q = q.filter(ProductMovement.movement_id != exclude_movement_id)
+    if cursor_paging_requested():
+        count = request.args.get('count', 'none')
+        if count not in COUNT_MODES:
+            abort(400)
+        try:
+            return keyset_paginate(query, order_columns, cursor=request.args.get('cursor'),
+                                   per_page=per_page, count=count)
+        except InvalidCursor:
+            abort(400)
+    page = request.args.get('page', type=int, default=1)
+    return query.order_by(*[c.desc() for c in order_columns]).paginate(page=page, per_page=per_page, error_out=False)
+
+def get_stock(product_id: str, location_id: str, as_of: Optional[datetime] = None) -> int:
+    """Return current stock for a product at a location from the balance table,
+    or the stock as of a past instant from the nearest balance snapshot.
+    """
+    if as_of is not None:
+        return stock_as_of(product_id, location_id, as_of)
+    return get_balance(product_id, location_id)
+
+def recent_movements_summary():
+    """The five newest movements as plain rows the dashboard can cache"""
+    movements = ProductMovement.query.options(*movement_load_options()).order_by(ProductMovement.timestamp.desc()).limit(5).all()
+    return [{
+        'movement_id': m.movement_id,
+        'product_name': m.product.name if m.product else m.product_id,
+        'movement_type': m.movement_type,
+        'from_name': m.from_location_obj.name if m.from_location_obj else None,
+        'to_name': m.to_location_obj.name if m.to_location_obj else None,
+        'qty': m.qty,
+        'timestamp': m.timestamp,
+    } for m in movements]
 
-    stock_in = q.filter(ProductMovement.to_location == location_id)\
-                .with_entities(func.coalesce(func.sum(ProductMovement.qty), 0)).scalar() or 0
-    stock_out = q.filter(ProductMovement.from_location == location_id)\
-                .with_entities(func.coalesce(func.sum(ProductMovement.qty), 0)).scalar() or 0
-    return int(stock_in) - int(stock_out)
+def low_stock_summary():
+    """Number of reorder alerts and the five largest shortfalls, as plain data"""
+    rows = alerts_query().add_columns(func.count().over().label('total')).limit(5).all()
+    return {
+        'count': rows[0].total if rows else 0,
+        'alerts': [alert_dict(row) for row in rows],
+    }
+
+def dashboard_data() -> dict:
+    """Dashboard counters, recent movements and low-stock alerts, served from the cache"""
+    return {
+        'total_products': cached(PRODUCT_COUNT, lambda: Product.query.count()),
+        'total_locations': cached(LOCATION_COUNT, lambda: Location.query.count()),
+        'total_movements': cached(MOVEMENT_COUNT, lambda: ProductMovement.query.count()),
+        'recent_movements': cached(RECENT_MOVEMENTS, recent_movements_summary),
+        'low_stock': cached(STOCK_ALERTS, low_stock_summary),
+    }
+
+def dashboard_validators(data: dict):
+    """ETag and Last-Modified of the dashboard data"""
+    etag = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    last_modified = get_cache().last_modified(PRODUCT_COUNT, LOCATION_COUNT, MOVEMENT_COUNT, RECENT_MOVEMENTS,
+                                              STOCK_ALERTS)
+    return etag, last_modified
+
+def conditional_response(response, etag: str, last_modified: Optional[datetime]):
+    """Attach validators so clients revalidate instead of re-downloading"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag: str, last_modified: Optional[datetime]):
+    """A 304 response if the client already has this version, else None.
+    Never 304 while flash messages are pending, or they would not be shown.
+    """
+    if '_flashes' in session:
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return conditional_response(app.response_class(status=304), etag, last_modified)
 
 @app.route('/')
 def index():
     """Dashboard with overview statistics"""
-    total_products = Product.query.count()
-    total_locations = Location.query.count()
-    total_movements = ProductMovement.query.count()
-    
-    # Recent movements
-    recent_movements = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).limit(5).all()
-    
-    return render_template('index.html', 
-                         total_products=total_products,
-                         total_locations=total_locations,
-                         total_movements=total_movements,
-                         recent_movements=recent_movements)
+    data = dashboard_data()
+    etag, last_modified = dashboard_validators(data)
+    response = not_modified(etag, last_modified)
+    if response is None:
+        response = conditional_response(app.make_response(render_template('index.html', etag=etag, **data)),
+                                        etag, last_modified)
+    return response
+
+@app.route('/api/dashboard')
+def dashboard_api():
+    """Dashboard data as JSON for polling clients; answers 304 while unchanged"""
+    data = dashboard_data()
+    etag, last_modified = dashboard_validators(data)
+    response = not_modified(etag, last_modified)
+    if response is None:
+        response = conditional_response(jsonify(data), etag, last_modified)
+    return response
 
 # Product Routes
 @app.route('/products')
 def products():
     """List all products with search and pagination"""
     q = request.args.get('q', '').strip()
-    page = request.args.get('page', type=int, default=1)
     per_page = request.args.get('per_page', type=int, default=10)
 
     query = Product.query
     if q:
-        like = f"%{q}%"
-        query = query.filter(
-            (Product.product_id.ilike(like)) | (Product.name.ilike(like)) | (Product.description.ilike(like))
-        )
+        query = apply_search(query, Product, q)
 
-    pagination = query.order_by(Product.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = paginate_list(query, (Product.created_at, Product.product_id), per_page)
     return render_template('products/list.html', products=pagination.items, pagination=pagination, q=q)
 
 @app.route('/products/add', methods=['GET', 'POST'])
@@ -87,6 +220,7 @@ def add_product():
         
         db.session.add(product)
         db.session.commit()
+        invalidate(PRODUCT_COUNT, PRODUCT_CHOICES)
         flash('Product added successfully!', 'success')
         return redirect(url_for('products'))
     
@@ -101,8 +235,10 @@ def edit_product(product_id):
         product.name = request.form['name']
         product.description = request.form.get('description', '')
         product.unit_price = float(request.form.get('unit_price', 0))
-        
+        # Balance exports and summaries show names and prices
+        expire_job_results()
         db.session.commit()
+        invalidate(PRODUCT_CHOICES, RECENT_MOVEMENTS, STOCK_ALERTS)
         flash('Product updated successfully!', 'success')
         return redirect(url_for('products'))
     
@@ -112,38 +248,61 @@ def edit_product(product_id):
 def delete_product(product_id):
     """Delete a product if it has no movements"""
     product = Product.query.get_or_404(product_id)
-    has_movements = ProductMovement.query.filter_by(product_id=product_id).first() is not None
+    has_movements = (ProductMovement.query.filter_by(product_id=product_id).first() is not None
+                     or ArchivedMovement.query.filter_by(product_id=product_id).first() is not None)
     if has_movements:
         flash('Cannot delete product with existing movements.', 'error')
         return redirect(url_for('products'))
+    remove_reorder_points(product_id=product_id)
     db.session.delete(product)
     db.session.commit()
+    invalidate(PRODUCT_COUNT, PRODUCT_CHOICES, STOCK_ALERTS)
     flash('Product deleted successfully!', 'success')
     return redirect(url_for('products'))
 
+def history_args():
+    """?bucket= and ?periods= of a history page or series; 400 if invalid"""
+    try:
+        return parse_bucket(request.args.get('bucket'), request.args.get('periods', type=int))
+    except ValueError as e:
+        abort(400, str(e))
+
+def movement_page(query, cursor_arg='cursor', per_page=20):
+    """One cursor page of a detail page's raw movements, newest first"""
+    try:
+        return keyset_paginate(query.options(*movement_load_options()),
+                               (ProductMovement.timestamp, ProductMovement.movement_id),
+                               cursor=request.args.get(cursor_arg), per_page=per_page)
+    except InvalidCursor:
+        abort(400)
+
 @app.route('/products/view/<product_id>')
 def view_product(product_id):
-    """View product details"""
+    """View product details with its bucketed movement history and a page of raw movements"""
     product = Product.query.get_or_404(product_id)
-    movements = ProductMovement.query.filter_by(product_id=product_id).order_by(ProductMovement.timestamp.desc()).all()
-    return render_template('products/view.html', product=product, movements=movements)
+    history = product_history(product_id, *history_args())
+    movements = movement_page(ProductMovement.query.filter_by(product_id=product_id))
+    return render_template('products/view.html', product=product, history=history, movements=movements,
+                           buckets=BUCKETS, archived_before=closed_until())
+
+@app.route('/api/products/<product_id>/history')
+def product_history_api(product_id):
+    """In/out/net series of a product per ?bucket=day|week|month, in total and per location"""
+    Product.query.get_or_404(product_id)
+    return jsonify(product_history(product_id, *history_args()))
 
 # Location Routes
 @app.route('/locations')
 def locations():
     """List all locations with search and pagination"""
     q = request.args.get('q', '').strip()
-    page = request.args.get('page', type=int, default=1)
     per_page = request.args.get('per_page', type=int, default=10)
 
     query = Location.query
     if q:
-        like = f"%{q}%"
-        query = query.filter(
-            (Location.location_id.ilike(like)) | (Location.name.ilike(like)) | (Location.address.ilike(like))
-        )
+        query = apply_search(query, Location, q)
 
-    pagination = query.order_by(Location.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = paginate_list(query, (Location.created_at, Location.location_id), per_page)
     return render_template('locations/list.html', locations=pagination.items, pagination=pagination, q=q)
 
 @app.route('/locations/add', methods=['GET', 'POST'])
@@ -169,6 +328,7 @@ def add_location():
         
         db.session.add(location)
         db.session.commit()
+        invalidate(LOCATION_COUNT, LOCATION_CHOICES)
         flash('Location added successfully!', 'success')
         return redirect(url_for('locations'))
     
@@ -183,8 +343,9 @@ def edit_location(location_id):
         location.name = request.form['name']
         location.address = request.form.get('address', '')
         location.manager = request.form.get('manager', '')
-        
+        expire_job_results()
         db.session.commit()
+        invalidate(LOCATION_CHOICES, RECENT_MOVEMENTS, STOCK_ALERTS)
         flash('Location updated successfully!', 'success')
         return redirect(url_for('locations'))
     
@@ -194,46 +355,129 @@ def edit_location(location_id):
 def delete_location(location_id):
     """Delete a location if it has no related movements (as from/to)"""
     location = Location.query.get_or_404(location_id)
-    has_movements = ProductMovement.query.filter(
-        (ProductMovement.from_location == location_id) | (ProductMovement.to_location == location_id)
-    ).first() is not None
+    has_movements = any(
+        model.query.filter((model.from_location == location_id) | (model.to_location == location_id)).first() is not None
+        for model in (ProductMovement, ArchivedMovement)
+    )
     if has_movements:
         flash('Cannot delete location with existing movements.', 'error')
         return redirect(url_for('locations'))
+    remove_reorder_points(location_id=location_id)
     db.session.delete(location)
     db.session.commit()
+    invalidate(LOCATION_COUNT, LOCATION_CHOICES, STOCK_ALERTS)
     flash('Location deleted successfully!', 'success')
     return redirect(url_for('locations'))
 
 @app.route('/locations/view/<location_id>')
 def view_location(location_id):
-    """View location details"""
+    """View location details with its bucketed movement history and pages of raw movements"""
     location = Location.query.get_or_404(location_id)
-    movements_from = ProductMovement.query.filter_by(from_location=location_id).order_by(ProductMovement.timestamp.desc()).all()
-    movements_to = ProductMovement.query.filter_by(to_location=location_id).order_by(ProductMovement.timestamp.desc()).all()
-    return render_template('locations/view.html', location=location, movements_from=movements_from, movements_to=movements_to)
+    history = location_history(location_id, *history_args())
+    movements_to = movement_page(ProductMovement.query.filter_by(to_location=location_id), 'in_cursor')
+    movements_from = movement_page(ProductMovement.query.filter_by(from_location=location_id), 'out_cursor')
+    return render_template('locations/view.html', location=location, history=history, buckets=BUCKETS,
+                           movements_from=movements_from, movements_to=movements_to,
+                           archived_before=closed_until())
+
+@app.route('/api/locations/<location_id>/history')
+def location_history_api(location_id):
+    """In/out/net series of a location per ?bucket=day|week|month"""
+    Location.query.get_or_404(location_id)
+    return jsonify(location_history(location_id, *history_args()))
 
 # Movement Routes
 @app.route('/movements')
 def movements():
     """List all movements with search and pagination"""
     q = request.args.get('q', '').strip()
-    page = request.args.get('page', type=int, default=1)
     per_page = request.args.get('per_page', type=int, default=10)
 
-    query = ProductMovement.query
+    query = ProductMovement.query.options(*movement_load_options())
     if q:
-        like = f"%{q}%"
-        # Join products for filtering by product name
-        query = query.join(Product, Product.product_id == ProductMovement.product_id)
-        query = query.filter(
-            (ProductMovement.movement_id.ilike(like)) |
-            (ProductMovement.product_id.ilike(like)) |
-            (Product.name.ilike(like))
-        )
+        # Match the movement itself or its product; newest first rather than ranked
+        matching_products = select(Product.product_id).where(search_filter(Product, q))
+        query = query.filter(or_(
+            search_filter(ProductMovement, q),
+            ProductMovement.product_id.in_(matching_products),
+        ))
+
+    pagination = paginate_list(query, (ProductMovement.timestamp, ProductMovement.movement_id), per_page)
+    return render_template('movements/list.html', movements=pagination.items, pagination=pagination, q=q,
+                           archived_before=closed_until())
+
+def insufficient_stock_message(error: InsufficientStock, movement: ProductMovement) -> str:
+    """Explain a failed debit to the user, relative to the movement being saved"""
+    if (error.product_id, error.location_id) == (movement.product_id, movement.from_location):
+        return (f'Insufficient stock at source location. '
+                f'Available: {movement.qty - error.shortfall}, Requested: {movement.qty}')
+    return (f'Stock of {error.product_id} at {error.location_id} would become negative '
+            f'(short by {error.shortfall}); it has already been moved out.')
+
+# Shown when a concurrent edit or delete of the same movement won the race
+CHANGED_MESSAGE = 'The movement was changed by someone else in the meantime; nothing was saved. Please try again.'
+
+def unknown_reference(product_id: str, from_location: Optional[str], to_location: Optional[str]) -> Optional[str]:
+    """Error message if a submitted movement names a product or location that doesn't exist.
+    The pickers accept free text, so this is checked against the database, not the cached index.
+    """
+    with db.session.no_autoflush:
+        if db.session.execute(select(Product.product_id).where(Product.product_id == product_id)).first() is None:
+            return f'Unknown product {product_id}'
+        location_ids = [loc for loc in (from_location, to_location) if loc]
+        found = set(db.session.execute(
+            select(Location.location_id).where(Location.location_id.in_(location_ids))
+        ).scalars())
+    for location_id in location_ids:
+        if location_id not in found:
+            return f'Unknown location {location_id}'
+    return None
 
-    pagination = query.order_by(ProductMovement.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    return render_template('movements/list.html', movements=pagination.items, pagination=pagination, q=q)
+def invalid_movement(from_location: Optional[str], to_location: Optional[str], qty: Optional[int]) -> Optional[str]:
+    """Error message if a submitted movement's locations or quantity are invalid (as bulk ingestion checks)"""
+    if not from_location and not to_location:
+        return 'Either from_location or to_location must be specified!'
+    if from_location == to_location:
+        return 'From and to locations must be different!'
+    if qty is None or qty <= 0:
+        return 'Quantity must be a positive whole number!'
+    if qty > MAX_QTY:
+        return 'Quantity is too large!'
+    return None
+
+def picker_labels(movement: Optional[ProductMovement]) -> dict:
+    """Names shown next to the pickers' current values, keyed by field"""
+    if movement is None:
+        return {}
+    with db.session.no_autoflush:
+        product_name = db.session.execute(
+            select(Product.name).where(Product.product_id == movement.product_id)
+        ).scalar()
+        location_ids = [loc for loc in (movement.from_location, movement.to_location) if loc]
+        location_names = dict(db.session.execute(
+            select(Location.location_id, Location.name).where(Location.location_id.in_(location_ids))
+        ).all())
+    return {
+        'product_id': product_name or '',
+        'from_location': location_names.get(movement.from_location, ''),
+        'to_location': location_names.get(movement.to_location, ''),
+    }
+
+def render_movement_form(movement: Optional[ProductMovement] = None):
+    """Render the add/edit movement form; its pickers load options from the lookup endpoints"""
+    return render_template('movements/form.html', movement=movement, labels=picker_labels(movement))
+
+@app.route('/api/products/lookup')
+def product_lookup():
+    """Products whose ID or name words start with ?q= (for the typeahead pickers)"""
+    limit = lookup_limit(request.args.get('limit', type=int))
+    return jsonify(product_index().search(request.args.get('q', ''), limit))
+
+@app.route('/api/locations/lookup')
+def location_lookup():
+    """Locations whose ID or name words start with ?q= (for the typeahead pickers)"""
+    limit = lookup_limit(request.args.get('limit', type=int))
+    return jsonify(location_index().search(request.args.get('q', ''), limit))
 
 @app.route('/movements/add', methods=['GET', 'POST'])
 def add_movement():
@@ -243,24 +487,15 @@ def add_movement():
         product_id = request.form['product_id']
         from_location = request.form.get('from_location') or None
         to_location = request.form.get('to_location') or None
-        qty = int(request.form['qty'])
+        qty = request.form.get('qty', type=int)
         notes = request.form.get('notes', '')
         
         # Validation
-        if not from_location and not to_location:
-            flash('Either from_location or to_location must be specified!', 'error')
-            products = Product.query.all()
-            locations = Location.query.all()
-            return render_template('movements/form.html', products=products, locations=locations)
-        
-        # Stock validation: from_location must have enough stock
-        if from_location:
-            available = get_stock(product_id, from_location)
-            if qty > available:
-                flash(f'Insufficient stock at source location. Available: {available}, Requested: {qty}', 'error')
-                products = Product.query.all()
-                locations = Location.query.all()
-                return render_template('movements/form.html', products=products, locations=locations)
+        error = invalid_movement(from_location, to_location, qty) \
+            or unknown_reference(product_id, from_location, to_location)
+        if error:
+            flash(error, 'error')
+            return render_movement_form()
 
         movement = ProductMovement(
             movement_id=movement_id,
@@ -271,115 +506,382 @@ def add_movement():
             notes=notes
         )
         
+        # Stock validation: the source balance is debited atomically, and only if it covers qty
+        try:
+            apply_movement(movement)
+        except InsufficientStock as e:
+            db.session.rollback()
+            flash(insufficient_stock_message(e, movement), 'error')
+            return render_movement_form()
+
         db.session.add(movement)
         db.session.commit()
+        invalidate(MOVEMENT_COUNT, RECENT_MOVEMENTS, STOCK_ALERTS)
         flash('Movement added successfully!', 'success')
         return redirect(url_for('movements'))
     
-    products = Product.query.all()
-    locations = Location.query.all()
-    return render_template('movements/form.html', products=products, locations=locations)
+    return render_movement_form()
 
 @app.route('/movements/edit/<movement_id>', methods=['GET', 'POST'])
 def edit_movement(movement_id):
     """Edit an existing movement"""
-    movement = ProductMovement.query.get_or_404(movement_id)
+    query = ProductMovement.query
+    if request.method == 'POST':
+        # Lock the row where the database supports it; claim_movement also covers SQLite
+        query = query.with_for_update()
+    movement = query.get_or_404(movement_id)
+    if is_closed(movement.timestamp):
+        flash('Movements in an archived period cannot be edited.', 'error')
+        return redirect(url_for('view_movement', movement_id=movement_id))
     
     if request.method == 'POST':
-        movement.product_id = request.form['product_id']
-        movement.from_location = request.form.get('from_location') or None
-        movement.to_location = request.form.get('to_location') or None
-        movement.qty = int(request.form['qty'])
-        movement.notes = request.form.get('notes', '')
+        # Claim and reverse the stored movement before the instance is modified
+        original = (movement.product_id, movement.from_location, movement.to_location, movement.qty)
+        try:
+            claim_movement(movement_id, *original)
+        except MovementChanged:
+            db.session.rollback()
+            flash(CHANGED_MESSAGE, 'error')
+            return redirect(url_for('movements'))
+        original_deltas = movement_deltas(*original, sign=-1)
+        original_flows = movement_flows(movement.product_id, movement.from_location,
+                                        movement.to_location, movement.qty, movement.timestamp, sign=-1)
+        submitted = {
+            'product_id': request.form['product_id'],
+            'from_location': request.form.get('from_location') or None,
+            'to_location': request.form.get('to_location') or None,
+            'qty': request.form.get('qty', type=int),
+            'notes': request.form.get('notes', ''),
+        }
+        for field, value in submitted.items():
+            setattr(movement, field, value)
         
         # Validation
-        if not movement.from_location and not movement.to_location:
-            flash('Either from_location or to_location must be specified!', 'error')
-            products = Product.query.all()
-            locations = Location.query.all()
-            return render_template('movements/form.html', movement=movement, products=products, locations=locations)
-
-        # Stock validation for edits: consider excluding current movement when computing available
-        if movement.from_location:
-            available = get_stock(movement.product_id, movement.from_location, exclude_movement_id=movement.movement_id)
-            if movement.qty > available:
-                flash(f'Insufficient stock at source location. Available: {available}, Requested: {movement.qty}', 'error')
-                products = Product.query.all()
-                locations = Location.query.all()
-                return render_template('movements/form.html', movement=movement, products=products, locations=locations)
+        error = invalid_movement(movement.from_location, movement.to_location, movement.qty) \
+            or unknown_reference(movement.product_id, movement.from_location, movement.to_location)
+        if error:
+            flash(error, 'error')
+            return render_movement_form(movement)
+
+        # Stock validation: net the old and new movement per balance, then debit atomically
+        new_deltas = movement_deltas(movement.product_id, movement.from_location,
+                                     movement.to_location, movement.qty)
+        try:
+            apply_deltas(original_deltas + new_deltas)
+        except InsufficientStock as e:
+            db.session.rollback()
+            # Rolling back expired the instance; show the submitted values again
+            for field, value in submitted.items():
+                setattr(movement, field, value)
+            flash(insufficient_stock_message(e, movement), 'error')
+            return render_movement_form(movement)
+        apply_flows(original_flows + movement_flows(movement.product_id, movement.from_location,
+                                                    movement.to_location, movement.qty, movement.timestamp))
         
+        invalidate_snapshots(movement.timestamp)
         db.session.commit()
+        invalidate(RECENT_MOVEMENTS, STOCK_ALERTS)
         flash('Movement updated successfully!', 'success')
         return redirect(url_for('movements'))
     
-    products = Product.query.all()
-    locations = Location.query.all()
-    return render_template('movements/form.html', movement=movement, products=products, locations=locations)
+    return render_movement_form(movement)
 
 @app.route('/movements/view/<movement_id>')
 def view_movement(movement_id):
-    """View movement details"""
-    movement = ProductMovement.query.get_or_404(movement_id)
-    return render_template('movements/view.html', movement=movement)
+    """View movement details, including movements moved to the archive"""
+    movement = ProductMovement.query.options(*movement_load_options()).get(movement_id)
+    if movement is None:
+        archived = ArchivedMovement.query.options(
+            joinedload(ArchivedMovement.product),
+            joinedload(ArchivedMovement.from_location_obj),
+            joinedload(ArchivedMovement.to_location_obj),
+        ).get_or_404(movement_id)
+        return render_template('movements/view.html', movement=archived, archived=True)
+    return render_template('movements/view.html', movement=movement, archived=is_closed(movement.timestamp))
 
 @app.route('/movements/delete/<movement_id>', methods=['POST'])
 def delete_movement(movement_id):
     """Delete a movement"""
-    movement = ProductMovement.query.get_or_404(movement_id)
+    movement = ProductMovement.query.with_for_update().get_or_404(movement_id)
+    if is_closed(movement.timestamp):
+        flash('Movements in an archived period cannot be deleted.', 'error')
+        return redirect(url_for('movements'))
+    try:
+        claim_movement(movement_id, movement.product_id, movement.from_location, movement.to_location, movement.qty)
+        apply_movement(movement, sign=-1)
+    except MovementChanged:
+        db.session.rollback()
+        flash(CHANGED_MESSAGE, 'error')
+        return redirect(url_for('movements'))
+    except InsufficientStock as e:
+        db.session.rollback()
+        flash(f'Cannot delete movement: {insufficient_stock_message(e, movement)}', 'error')
+        return redirect(url_for('movements'))
+    invalidate_snapshots(movement.timestamp)
     db.session.delete(movement)
     db.session.commit()
+    invalidate(MOVEMENT_COUNT, RECENT_MOVEMENTS, STOCK_ALERTS)
     flash('Movement deleted successfully!', 'success')
     return redirect(url_for('movements'))
 
+@app.route('/api/movements/bulk', methods=['POST'])
+def bulk_movements():
+    """Ingest a batch of movements posted as a JSON array or NDJSON.
+    Pass ?atomic=1 to reject the whole batch if any row fails validation.
+    """
+    try:
+        records = load_records(request.get_data(as_text=True))
+    except BulkFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    atomic = request.args.get('atomic', '').lower() in ('1', 'true', 'yes')
+    result = ingest_movements(records, atomic=atomic)
+    if result['inserted']:
+        invalidate(MOVEMENT_COUNT, RECENT_MOVEMENTS, STOCK_ALERTS)
+    if result.get('conflict'):
+        status = 409
+    elif atomic and result['failed']:
+        status = 422
+    else:
+        status = 200
+    return jsonify(result), status
+
+# Reorder alerts
+@app.route('/alerts')
+def stock_alerts():
+    """Stock at or below its reorder point, and the reorder points themselves"""
+    page = request.args.get('page', type=int, default=1)
+    thresholds_page = request.args.get('thresholds_page', type=int, default=1)
+    alerts = alerts_query().paginate(page=page, per_page=50, error_out=False)
+    thresholds = ReorderThreshold.query.options(
+        joinedload(ReorderThreshold.product), joinedload(ReorderThreshold.location)
+    ).order_by(ReorderThreshold.product_id, ReorderThreshold.location_id)\
+     .paginate(page=thresholds_page, per_page=50, error_out=False)
+    return render_template('alerts/index.html', alerts=alerts, thresholds=thresholds)
+
+@app.route('/alerts/thresholds', methods=['POST'])
+def set_threshold():
+    """Set the reorder point of a product at a location; a blank value removes it"""
+    product_id = request.form.get('product_id', '').strip()
+    location_id = request.form.get('location_id', '').strip()
+    value = request.form.get('reorder_point', '').strip()
+    # unknown_reference skips blank locations, so both IDs are required first
+    if not product_id or not location_id:
+        flash('Both a product and a location are required.', 'error')
+        return redirect(url_for('stock_alerts'))
+    if value and not value.isdigit():
+        flash('Reorder point must be a whole number of at least 0.', 'error')
+        return redirect(url_for('stock_alerts'))
+    reorder_point = int(value) if value else None
+    error = unknown_reference(product_id, location_id, None)
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('stock_alerts'))
+    set_reorder_point(product_id, location_id, reorder_point)
+    db.session.commit()
+    invalidate(STOCK_ALERTS)
+    flash('Reorder point saved!' if reorder_point is not None else 'Reorder point removed!', 'success')
+    return redirect(url_for('stock_alerts'))
+
+@app.route('/alerts/thresholds/delete', methods=['POST'])
+def delete_threshold():
+    """Remove the reorder point of a product at a location"""
+    set_reorder_point(request.form['product_id'], request.form['location_id'], None)
+    db.session.commit()
+    invalidate(STOCK_ALERTS)
+    flash('Reorder point removed!', 'success')
+    return redirect(url_for('stock_alerts'))
+
+@app.route('/api/alerts')
+def alerts_api():
+    """Current reorder alerts as JSON, optionally for one ?product_id= or ?location_id="""
+    limit = max(1, min(request.args.get('limit', type=int, default=100), 1000))
+    query = alerts_query(request.args.get('product_id'), request.args.get('location_id'))
+    rows = query.add_columns(func.count().over().label('total')).limit(limit).all()
+    return jsonify({
+        'count': rows[0].total if rows else 0,
+        'alerts': [alert_dict(row) for row in rows],
+    })
+
+# Catalog import/export
+def invalidate_catalog(kind: str) -> None:
+    """Drop the cached data a catalog import may have changed, including the names in the alert list"""
+    if kind == 'products':
+        invalidate(PRODUCT_COUNT, PRODUCT_CHOICES, RECENT_MOVEMENTS, STOCK_ALERTS)
+    else:
+        invalidate(LOCATION_COUNT, LOCATION_CHOICES, RECENT_MOVEMENTS, STOCK_ALERTS)
+
+@app.route('/api/<kind>/import', methods=['POST'])
+def import_catalog_api(kind):
+    """Stream a CSV or NDJSON catalog into products or locations.
+    The format comes from ?format= or the Content-Type; ?mode=insert rejects existing IDs.
+    """
+    if kind not in CATALOGS:
+        abort(404)
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    mode = request.args.get('mode', 'upsert')
+    if fmt not in EXPORT_MIMETYPES or mode not in IMPORT_MODES:
+        return jsonify({'error': 'format must be csv or ndjson and mode upsert or insert'}), 400
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = import_catalog(kind, iter_catalog_records(stream, fmt), mode)
+    except UnicodeDecodeError as e:
+        db.session.rollback()
+        # Chunks before the undecodable bytes are already committed
+        invalidate_catalog(kind)
+        return jsonify({'error': f'The body is not valid UTF-8: {e}'}), 400
+    if result['inserted'] or result['updated']:
+        invalidate_catalog(kind)
+    return jsonify(result)
+
+@app.route('/products.<fmt>', defaults={'kind': 'products'})
+@app.route('/locations.<fmt>', defaults={'kind': 'locations'})
+def export_catalog(kind, fmt):
+    """Stream every product or location as CSV or NDJSON"""
+    if fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    _, columns = CATALOGS[kind]
+    return export_response(fmt, columns, catalog_rows(kind), kind)
+
 # Reports
+def requested_as_of() -> Optional[datetime]:
+    """The ?as_of= date or date/time of a report request, if any"""
+    value = request.args.get('as_of', '').strip()
+    if not value:
+        return None
+    try:
+        return parse_as_of(value)
+    except ValueError:
+        abort(400)
+
+def report_source(as_of: Optional[datetime]):
+    """Balances to report on: current ones, or as of a past instant"""
+    return balances_as_of_select(as_of).subquery() if as_of else None
+
 @app.route('/reports/balance')
 def balance_report():
-    """Generate balance report showing current inventory levels"""
-    # Calculate balance for each product-location combination
-    balances = {}
-    
-    # Get all movements
-    movements = ProductMovement.query.all()
-    
-    for movement in movements:
-        product_id = movement.product_id
-        qty = movement.qty
-        
-        # Initialize product in balances if not exists
-        if product_id not in balances:
-            balances[product_id] = {}
-        
-        # Handle stock in (to_location)
-        if movement.to_location:
-            if movement.to_location not in balances[product_id]:
-                balances[product_id][movement.to_location] = 0
-            balances[product_id][movement.to_location] += qty
-        
-        # Handle stock out (from_location)
-        if movement.from_location:
-            if movement.from_location not in balances[product_id]:
-                balances[product_id][movement.from_location] = 0
-            balances[product_id][movement.from_location] -= qty
-    
-    # Convert to list format for template
-    balance_data = []
-    products = {p.product_id: p for p in Product.query.all()}
-    locations = {l.location_id: l for l in Location.query.all()}
-    
-    for product_id, location_balances in balances.items():
-        for location_id, qty in location_balances.items():
-            if qty != 0:  # Only show non-zero balances
-                balance_data.append({
-                    'product': products.get(product_id),
-                    'location': locations.get(location_id),
-                    'qty': qty
-                })
-    
-    # Sort by product name, then location name
-    balance_data.sort(key=lambda x: (x['product'].name if x['product'] else '', 
-                                   x['location'].name if x['location'] else ''))
-    
-    return render_template('reports/balance.html', balance_data=balance_data)
+    """Balance report showing current (or ?as_of=) inventory levels, paginated in the database"""
+    page = request.args.get('page', type=int, default=1)
+    per_page = request.args.get('per_page', type=int, default=50)
+    as_of = requested_as_of()
+
+    query = balance_report_query(report_source(as_of))
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    summary = balance_report_summary(query)
+    return render_template('reports/balance.html', balance_data=pagination.items,
+                           pagination=pagination, summary=summary,
+                           as_of=request.args.get('as_of', '').strip())
+
+@app.route('/reports/balance.<fmt>')
+def export_balance_report(fmt):
+    """Stream the full balance report as CSV or NDJSON"""
+    if fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    rows = balance_report_query(report_source(requested_as_of())).yield_per(1000)
+    return export_response(fmt, REPORT_COLUMNS, rows, 'balance_report')
+
+# Background jobs
+def export_format(value: str) -> None:
+    if value not in EXPORT_MIMETYPES:
+        raise ValueError(f"must be one of {', '.join(EXPORT_MIMETYPES)}")
+
+@task('balance_export', {'fmt': export_format, 'as_of': parse_as_of})
+def balance_export_job(job, fmt='csv', as_of=None):
+    """Write the full (or ?as_of=) balance report to a CSV or NDJSON file"""
+    query = balance_report_query(report_source(parse_as_of(as_of) if as_of else None))
+    total = query.order_by(None).count()
+
+    def rows():
+        for number, row in enumerate(query.yield_per(1000), 1):
+            if number % 1000 == 0:
+                job.progress(number / total, f'{number:,} of {total:,} rows')
+            yield row
+
+    generate = iter_csv if fmt == 'csv' else iter_ndjson
+    with open(job.result_file(fmt), 'w', newline='') as f:
+        for chunk in generate(REPORT_COLUMNS, rows()):
+            f.write(chunk)
+    suffix = f'_{as_of[:10]}' if as_of else ''
+    return {'rows': total, 'filename': f'balance_report{suffix}.{fmt}'}
+
+@task('balance_summary', {'as_of': parse_as_of})
+def balance_summary_job(job, as_of=None):
+    """Totals of the full (or ?as_of=) balance report"""
+    return balance_report_summary(balance_report_query(report_source(parse_as_of(as_of) if as_of else None)))
+
+@task('verify_balances')
+def verify_balances_job(job):
+    """Compare the balance table with the ledger"""
+    mismatches = verify_balances()
+    return {'mismatches': len(mismatches), 'sample': mismatches[:100]}
+
+@task('rebuild_balances')
+def rebuild_balances_job(job):
+    """Recompute the balance table from the ledger"""
+    rows = rebuild_balances()
+    # The rebuild recomputes the alerts too
+    invalidate(STOCK_ALERTS)
+    return {'rows': rows}
+
+def job_params(source) -> dict:
+    """Job parameters from a form or JSON object, without the control fields"""
+    return {name: value for name, value in source.items() if name != 'force'}
+
+@app.route('/jobs')
+def jobs():
+    """Recent background jobs"""
+    recent = Job.query.order_by(Job.created_at.desc()).limit(50).all()
+    return render_template('jobs/list.html', jobs=recent)
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def start_job(kind):
+    """Start a background job from a form, or reuse an identical one"""
+    try:
+        job, created = submit_job(kind, job_params(request.form), force=bool(request.form.get('force')))
+    except JobError as e:
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('jobs'))
+    if not created:
+        flash('An identical job is already running or has an up-to-date result; showing that one.', 'success')
+    return redirect(url_for('view_job', job_id=job.job_id))
+
+@app.route('/jobs/view/<job_id>')
+def view_job(job_id):
+    """Status, progress and result of a job"""
+    job = Job.query.get_or_404(job_id)
+    return render_template('jobs/view.html', job=job, info=job_dict(job))
+
+@app.route('/jobs/result/<job_id>')
+def job_result(job_id):
+    """Download a finished job's file, or its result as JSON"""
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'done':
+        abort(404)
+    result = job_dict(job)['result']
+    if job.result_path:
+        return send_file(job.result_path, as_attachment=True, download_name=result.get('filename'))
+    return jsonify(result)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job_api():
+    """Start a job from JSON ({"kind": ..., "params": {...}, "force": false}).
+    Answers 202 for a new job and 200 for a reused one.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        job, created = submit_job(str(data.get('kind', '')), data.get('params') or {}, force=bool(data.get('force')))
+    except JobError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(job_dict(job))
+    response.status_code = 202 if created else 200
+    response.headers['Location'] = url_for('job_status_api', job_id=job.job_id)
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def job_status_api(job_id):
+    """Job status and progress for polling"""
+    return jsonify(job_dict(Job.query.get_or_404(job_id)))
 
 def create_sample_data():
     """Create sample data for testing"""
@@ -452,12 +954,188 @@ def create_sample_data():
         
         for movement in movements:
             db.session.add(movement)
+            apply_movement(movement)
         
         db.session.commit()
 
+def init_db():
+    """Create or upgrade the schema and backfill derived data for databases created before it existed"""
+    migrate(db.engine)
+    install_search_index(db.engine)
+    if StockBalance.query.first() is None and ProductMovement.query.first() is not None:
+        rebuild_balances()
+    elif ProductDailyFlow.query.first() is None and ProductMovement.query.first() is not None:
+        rebuild_history(recorded_movements())
+        db.session.commit()
+
+# CLI commands
+@app.cli.command('init-db')
+def init_db_command():
+    """Create database tables"""
+    init_db()
+    click.echo('Database initialized.')
+
+@app.cli.command('migrate-db')
+@click.option('--dry-run', is_flag=True, help='Only list the changes that would be applied.')
+def migrate_db_command(dry_run):
+    """Bring an existing database schema up to date (tables and indexes)"""
+    changes = pending_migrations(db.engine) if dry_run else migrate(db.engine)
+    for change in changes:
+        click.echo(change)
+    if not changes:
+        click.echo('Schema is up to date.')
+
+@app.cli.command('import-movements')
+@click.argument('source', type=click.File('r'))
+@click.option('--atomic', is_flag=True, help='Insert nothing if any row fails validation.')
+def import_movements_command(source, atomic):
+    """Bulk-load movements from a JSON or NDJSON file ('-' for stdin)"""
+    try:
+        records = load_records(source.read())
+    except BulkFormatError as e:
+        raise click.ClickException(str(e))
+    started = time.perf_counter()
+    result = ingest_movements(records, atomic=atomic)
+    elapsed = time.perf_counter() - started
+    for error in result['errors'][:20]:
+        click.echo(f"row {error['row']}: {error['error']}")
+    if result['failed'] > 20:
+        click.echo(f"... and {result['failed'] - 20} more errors")
+    rate = result['inserted'] / elapsed if elapsed else 0
+    click.echo(f"Inserted {result['inserted']} movements, {result['failed']} failed ({elapsed:.2f}s, {rate:,.0f}/s).")
+
+@app.cli.command('import-catalog')
+@click.argument('kind', type=click.Choice(sorted(CATALOGS)))
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)),
+              help='Input format (default: from the file extension, else NDJSON).')
+@click.option('--mode', type=click.Choice(IMPORT_MODES), default='upsert', show_default=True,
+              help='upsert updates existing IDs; insert reports them as errors.')
+def import_catalog_command(kind, source, fmt, mode):
+    """Bulk-load products or locations from a CSV or NDJSON file ('-' for stdin)"""
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'ndjson')
+    # newline='' keeps line breaks inside quoted CSV fields intact
+    stream = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    started = time.perf_counter()
+    try:
+        result = import_catalog(kind, iter_catalog_records(stream, fmt), mode)
+    except UnicodeDecodeError as e:
+        db.session.rollback()
+        raise click.ClickException(f'{source.name} is not valid UTF-8 ({e}); rows before it were imported.')
+    elapsed = time.perf_counter() - started
+    if result['inserted'] or result['updated']:
+        invalidate_catalog(kind)
+    for error in result['errors'][:20]:
+        click.echo(f"row {error['row']}: {error['error']}")
+    if result['failed'] > 20:
+        click.echo(f"... and {result['failed'] - 20} more errors")
+    written = result['inserted'] + result['updated']
+    rate = written / elapsed if elapsed else 0
+    click.echo(f"Inserted {result['inserted']}, updated {result['updated']} {kind}, "
+               f"{result['failed']} failed ({elapsed:.2f}s, {rate:,.0f}/s).")
+
+@app.cli.command('export-catalog')
+@click.argument('kind', type=click.Choice(sorted(CATALOGS)))
+@click.argument('target', type=click.File('w'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)),
+              help='Output format (default: from the file extension, else NDJSON).')
+def export_catalog_command(kind, target, fmt):
+    """Write every product or location to a CSV or NDJSON file ('-' for stdout)"""
+    fmt = fmt or ('csv' if target.name.endswith('.csv') else 'ndjson')
+    _, columns = CATALOGS[kind]
+    generate = iter_csv if fmt == 'csv' else iter_ndjson
+    for text in generate(columns, catalog_rows(kind)):
+        target.write(text)
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Re-index products, locations and movements for full-text search"""
+    if not install_search_index(db.engine):
+        raise click.ClickException('Full-text search needs SQLite with FTS5; searches use LIKE instead.')
+    rebuild_search_index(db.engine)
+    click.echo('Search index rebuilt.')
+
+@app.cli.command('snapshot-balances')
+@click.option('--as-of', 'as_of', help='Date or date/time to snapshot (a date means the end of that day).')
+@click.option('--daily', is_flag=True, help='Create midnight checkpoints for every day since the last one.')
+def snapshot_balances_command(as_of, daily):
+    """Store point-in-time balance checkpoints (run --daily from cron)"""
+    if daily:
+        created = take_daily_snapshots()
+        click.echo(f'Created {len(created)} daily checkpoints.')
+        return
+    try:
+        point = parse_as_of(as_of) if as_of else datetime.utcnow()
+        count = take_snapshot(point)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Snapshot as of {point}: {count} balance rows.')
+
+@app.cli.command('archive-movements')
+@click.option('--before', required=True, help='Archive movements before this date or date/time (a date means its midnight).')
+@click.option('--dry-run', is_flag=True, help='Only report what would be archived.')
+def archive_movements_command(before, dry_run):
+    """Move a closed period of the ledger to the archive, leaving opening balances"""
+    try:
+        cutoff = parse_datetime(before)
+        result = archive_preview(cutoff) if dry_run else archive_movements(cutoff)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    verb = 'Would archive' if dry_run else 'Archived'
+    click.echo(f"{verb} {result['movements']} movements before {cutoff} "
+               f"into {result['openings']} opening balances.")
+
+@app.cli.command('rebuild-balances')
+def rebuild_balances_command():
+    """Recompute the stock balance table from the movement ledger"""
+    count = rebuild_balances()
+    invalidate(STOCK_ALERTS)
+    click.echo(f'Rebuilt {count} balance rows.')
+
+@app.cli.command('prune-jobs')
+@click.option('--days', type=int, default=7, show_default=True, help='Delete finished jobs older than this.')
+def prune_jobs_command(days):
+    """Delete old background jobs and their result files"""
+    count = prune_jobs(datetime.utcnow() - timedelta(days=days))
+    click.echo(f'Deleted {count} jobs.')
+
+@app.cli.command('verify-balances')
+def verify_balances_command():
+    """Check the stock balance table against the movement ledger"""
+    mismatches = verify_balances()
+    for m in mismatches:
+        click.echo(f"{m['product_id']} @ {m['location_id']}: expected {m['expected']}, found {m['actual']}")
+    if mismatches:
+        raise SystemExit(f'{len(mismatches)} balance mismatches found; run "flask rebuild-balances" to fix.')
+    click.echo('Balances are consistent with the movement ledger.')
+
+@app.cli.command('check-ledger')
+@click.option('--workers', type=int, help='Worker processes (default: one per CPU).')
+@click.option('--report', type=click.File('w'), help='Write every issue to this file as NDJSON.')
+@click.option('--show', type=int, default=20, show_default=True, help='Issues to print.')
+def check_ledger_command(workers, report, show):
+    """Replay the movement ledger in parallel and report invalid movements and bad balances"""
+    started = time.perf_counter()
+    result = check_ledger(db.engine.url.render_as_string(hide_password=False), workers)
+    elapsed = time.perf_counter() - started
+    issues = result['issues']
+    if report:
+        for issue in issues:
+            report.write(json.dumps(issue, default=str) + '\n')
+    for issue in issues[:show]:
+        click.echo(json.dumps(issue, default=str))
+    if len(issues) > show:
+        click.echo(f'... and {len(issues) - show} more issues')
+    click.echo(f"Checked {result['movements']} movements and {result['balances']} balances in "
+               f"{result['ranges']} ranges ({elapsed:.2f}s, {result['movements'] / max(elapsed, 1e-9):,.0f}/s).")
+    if issues:
+        counts = ', '.join(f'{count} {kind}' for kind, count in result['counts'].items() if count)
+        raise SystemExit(f'{len(issues)} issues found: {counts}.')
+    click.echo('The ledger and balances are consistent.')
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
         create_sample_data()
     
     app.run(debug=True)
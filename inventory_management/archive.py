@@ -0,0 +1,100 @@
+"""Archival of closed periods of the movement ledger.
+
+``archive_movements(before)`` closes the ledger before an instant: the live
+movements older than it are copied to ``archived_movements`` (tagged with
+the period in ``archive_periods``) and deleted from ``product_movements``,
+and each non-zero (product, location) balance they add up to is written back
+as one opening-balance movement (ID prefix ``OB-``) timestamped just before
+the cutoff. The live table then holds only the open period plus a handful of
+opening rows, so stock, list and detail queries stay proportional to recent
+activity, while the balance table and every balance at or after the cutoff
+are unchanged. Historical reads before the cutoff use the archive through
+``balances.ledger_source``.
+
+A closed period is read-only: movements can't be added, edited or deleted
+before the latest cutoff.
+
+The movement lists (``/movements``, the product and location pages and
+``/api/v1/movements``) page through the live table only, so once a period is
+archived its movements are no longer listed there; each list says so and
+names the cutoff (``archived_before`` in the API). Archived movements can
+still be opened by ID, and as-of balances read the archive.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, literal, select
+
+from balances import (LEDGER_COLUMNS, OPENING_PREFIX, archived_table, closed_until, ledger_balances_select,
+                      movements_table)
+from models import db, ArchivePeriod
+
+periods_table = ArchivePeriod.__table__
+
+
+def opening_timestamp(period_end: datetime) -> datetime:
+    """Timestamp of the opening balances of the period starting at period_end"""
+    return period_end - timedelta(microseconds=1)
+
+
+def is_closed(timestamp: datetime, cutoff: Optional[datetime] = None) -> bool:
+    """True if a movement at timestamp falls in an archived period"""
+    cutoff = cutoff if cutoff is not None else closed_until()
+    return cutoff is not None and timestamp < cutoff
+
+
+def archive_preview(before: datetime) -> dict:
+    """Counts of what archive_movements(before) would move, without changing anything"""
+    m = movements_table
+    live = ~m.c.movement_id.startswith(OPENING_PREFIX)
+    movements = db.session.execute(
+        select(func.count()).select_from(m).where(m.c.timestamp < before, live)
+    ).scalar()
+    balances = ledger_balances_select(until=before).subquery()
+    openings = db.session.execute(
+        select(func.count()).select_from(balances).where(balances.c.qty != 0)
+    ).scalar()
+    return {'period_end': before, 'movements': movements, 'openings': openings}
+
+
+def archive_movements(before: datetime) -> dict:
+    """Move live movements before the given instant to the archive, replacing them
+    with opening balances. Returns the counts written; raises ValueError if the
+    instant is in the future or not after the current cutoff.
+    """
+    if before > datetime.utcnow():
+        raise ValueError('Cannot archive a period that has not ended')
+    cutoff = closed_until()
+    if cutoff is not None and before <= cutoff:
+        raise ValueError(f'Movements before {cutoff} are already archived')
+
+    m = movements_table
+    # Net balances before the cutoff, including the previous period's opening rows
+    openings = [row for row in db.session.execute(ledger_balances_select(until=before)) if row.qty]
+    db.session.execute(periods_table.insert().values(period_end=before, archived_at=datetime.utcnow()))
+    db.session.execute(archived_table.insert().from_select(
+        LEDGER_COLUMNS + ['period_end'],
+        select(*[m.c[name] for name in LEDGER_COLUMNS], literal(before, db.DateTime))
+        .where(m.c.timestamp < before, ~m.c.movement_id.startswith(OPENING_PREFIX)),
+    ))
+    archived = db.session.execute(
+        select(func.count()).select_from(archived_table).where(archived_table.c.period_end == before)
+    ).scalar()
+    db.session.execute(m.delete().where(m.c.timestamp < before))
+
+    timestamp = opening_timestamp(before)
+    rows = [{
+        'movement_id': f'{OPENING_PREFIX}{before:%Y%m%d%H%M%S}-{number:06d}',
+        'timestamp': timestamp,
+        'product_id': row.product_id,
+        'from_location': row.location_id if row.qty < 0 else None,
+        'to_location': row.location_id if row.qty > 0 else None,
+        'qty': abs(int(row.qty)),
+        'notes': f'Opening balance carried over from movements before {before}',
+    } for number, row in enumerate(openings, 1)]
+    if rows:
+        db.session.execute(m.insert(), rows)
+    db.session.execute(periods_table.update().where(periods_table.c.period_end == before)
+                       .values(movement_count=archived, opening_count=len(rows)))
+    db.session.commit()
+    return {'period_end': before, 'movements': archived, 'openings': len(rows)}
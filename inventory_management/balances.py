@@ -0,0 +1,310 @@
+"""Materialized per-(product, location) stock balances.
+
+The ``stock_balances`` table holds the running sum of the movement ledger so
+that stock lookups and the balance report don't have to re-scan
+``product_movements``. Every write to the ledger must go through
+``apply_movement`` in the same session so the two stay in step.
+
+Debits are applied with a conditional UPDATE (``... WHERE qty >= :amount``)
+rather than check-then-write, so concurrent writers in separate processes
+can't both draw the same stock: the database serializes the row updates and
+the loser sees no matching row. Edits and deletes of a movement likewise
+``claim_movement`` its row with the values their reversal was computed from,
+so two writers can't both reverse the same stored quantity.
+
+Once closed periods have been archived (see archive.py), the ledger is the
+live table, whose opening-balance rows stand in for the archived history.
+Reads of time ranges reaching into an archived period go through
+``ledger_source``, which returns the archive plus the live movements instead.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, func, select, union_all
+
+from alerts import rebuild_alerts, refresh_alerts
+from history import apply_flows, movement_flows, rebuild_history
+from jobs import expire_job_results
+from models import db, ArchivedMovement, ArchivePeriod, Location, Product, ProductMovement, StockBalance
+from writes import add, upsert
+
+balances_table = StockBalance.__table__
+movements_table = ProductMovement.__table__
+archived_table = ArchivedMovement.__table__
+
+# movement_id prefix of the rows that carry archived history into the live ledger
+OPENING_PREFIX = 'OB-'
+# Largest qty a movement may carry: the range of the 32-bit integer columns
+MAX_QTY = 2 ** 31 - 1
+LEDGER_COLUMNS = ['movement_id', 'timestamp', 'from_location', 'to_location', 'product_id', 'qty', 'notes']
+
+Pair = Tuple[str, str]
+
+
+def movement_deltas(product_id: str, from_location: Optional[str], to_location: Optional[str],
+                    qty: int, sign: int = 1) -> List[Tuple[Pair, int]]:
+    """Return the balance changes a movement implies as ((product, location), delta) pairs.
+    Use sign=-1 to get the deltas that undo the movement.
+    """
+    deltas = []
+    if from_location:
+        deltas.append(((product_id, from_location), -sign * qty))
+    if to_location:
+        deltas.append(((product_id, to_location), sign * qty))
+    return deltas
+
+
+class InsufficientStock(Exception):
+    """Raised when a debit would take a balance below zero.
+    The transaction must be rolled back; earlier writes in it may have been applied.
+    """
+
+    def __init__(self, product_id: str, location_id: str, available: int, shortfall: int):
+        super().__init__(f'Insufficient stock of {product_id} at {location_id}: '
+                         f'{available} available, {shortfall} short')
+        self.product_id = product_id
+        self.location_id = location_id
+        self.available = available
+        self.shortfall = shortfall
+
+
+class MovementChanged(Exception):
+    """Raised when a movement was edited or deleted by another writer since it was read.
+    The transaction must be rolled back.
+    """
+
+    def __init__(self, movement_id: str):
+        super().__init__(f'Movement {movement_id} was changed by another writer')
+        self.movement_id = movement_id
+
+
+def conditional_debit():
+    """UPDATE subtracting :b_amount from a balance only if enough stock remains.
+    The condition is checked under the row's write lock, so concurrent debits
+    of the same balance can't both succeed past zero.
+    """
+    b = balances_table
+    return b.update()\
+        .where(b.c.product_id == bindparam('b_product_id'))\
+        .where(b.c.location_id == bindparam('b_location_id'))\
+        .where(b.c.qty >= bindparam('b_amount'))\
+        .values(qty=b.c.qty - bindparam('b_amount'))
+
+
+def claim_movement(movement_id: str, product_id: str, from_location: Optional[str],
+                   to_location: Optional[str], qty: int) -> None:
+    """Write-lock a movement's row before reversing it, provided it still has the
+    given (previously read) values; otherwise raise MovementChanged.
+    The no-op UPDATE holds the row until commit, so a concurrent edit or delete
+    of the same movement waits and then finds the values changed.
+    """
+    m = movements_table
+    result = db.session.execute(
+        m.update()
+        .where(m.c.movement_id == movement_id, m.c.product_id == product_id,
+               m.c.from_location.is_not_distinct_from(from_location),
+               m.c.to_location.is_not_distinct_from(to_location), m.c.qty == qty)
+        .values(movement_id=m.c.movement_id)
+    )
+    if result.rowcount == 0:
+        raise MovementChanged(movement_id)
+
+
+def apply_delta(product_id: str, location_id: str, delta: int, check_stock: bool = True) -> None:
+    """Add delta to a balance row, creating it if it doesn't exist yet.
+    With check_stock, a negative delta is applied atomically only if the balance
+    covers it; otherwise InsufficientStock is raised.
+    """
+    if not delta:
+        return
+    if delta < 0 and check_stock:
+        result = db.session.execute(conditional_debit(), {
+            'b_product_id': product_id, 'b_location_id': location_id, 'b_amount': -delta,
+        })
+        if result.rowcount == 0:
+            available = get_balance(product_id, location_id)
+            raise InsufficientStock(product_id, location_id, available, -delta - available)
+        return
+    upsert(balances_table, ['product_id', 'location_id'], {'qty': add},
+           [{'product_id': product_id, 'location_id': location_id, 'qty': delta}])
+
+
+def apply_deltas(deltas: Iterable[Tuple[Pair, int]], check_stock: bool = True) -> None:
+    """Apply a batch of deltas, merging changes to the same pair first,
+    re-evaluate the reorder alerts of the changed pairs and expire background
+    job results computed from the previous ledger.
+    Raises InsufficientStock if check_stock is set and a balance would go negative.
+    """
+    merged: Dict[Pair, int] = {}
+    for pair, delta in deltas:
+        merged[pair] = merged.get(pair, 0) + delta
+    # Sorted, so concurrent writers take the row locks in the same order
+    for (product_id, location_id), delta in sorted(merged.items()):
+        apply_delta(product_id, location_id, delta, check_stock)
+    refresh_alerts(pair for pair, delta in merged.items() if delta)
+    expire_job_results()
+
+
+def apply_movement(movement: ProductMovement, sign: int = 1, check_stock: bool = True) -> None:
+    """Apply (sign=1) or reverse (sign=-1) a movement against the balance table
+    and the daily history rollups (see history.py).
+    Must be called in the same session/transaction as the ledger write; raises
+    InsufficientStock (see apply_deltas) and the caller must then roll back.
+    """
+    apply_deltas(movement_deltas(movement.product_id, movement.from_location,
+                                 movement.to_location, movement.qty, sign), check_stock)
+    if movement.timestamp is None:
+        # Stamp a new movement now, so its history day is the day it is stored with
+        movement.timestamp = datetime.utcnow()
+    apply_flows(movement_flows(movement.product_id, movement.from_location, movement.to_location,
+                               movement.qty, movement.timestamp, sign))
+
+
+def get_balance(product_id: str, location_id: str) -> int:
+    """Read the materialized balance for a product at a location"""
+    qty = db.session.execute(
+        select(balances_table.c.qty)
+        .where(balances_table.c.product_id == product_id)
+        .where(balances_table.c.location_id == location_id)
+    ).scalar()
+    return int(qty or 0)
+
+
+def closed_until() -> Optional[datetime]:
+    """End of the latest archived period; movements before it are archived"""
+    return db.session.execute(select(func.max(ArchivePeriod.__table__.c.period_end))).scalar()
+
+
+def ledger_source(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """The movements to read for the range since <= timestamp < until.
+
+    The live table is complete for ranges that start at the beginning of time
+    (its opening balances summarize the archive) or after the latest archived
+    period. Other ranges need the individual archived movements, so they read
+    the archive plus the live movements other than the opening balances.
+    """
+    cutoff = closed_until()
+    if cutoff is None or ((since is None or since >= cutoff) and (until is None or until >= cutoff)):
+        return movements_table
+    return recorded_movements()
+
+
+def recorded_movements():
+    """Every movement ever recorded: the archive plus the live movements other than
+    the opening balances
+    """
+    a, m = archived_table, movements_table
+    return union_all(
+        select(*[a.c[name] for name in LEDGER_COLUMNS]),
+        select(*[m.c[name] for name in LEDGER_COLUMNS]).where(~m.c.movement_id.startswith(OPENING_PREFIX)),
+    ).subquery('ledger')
+
+
+def ledger_flows(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Signed (product_id, location_id, qty) flows of the ledger, optionally limited
+    to movements with since <= timestamp < until
+    """
+    m = ledger_source(since, until)
+    inbound = select(m.c.product_id, m.c.to_location.label('location_id'), m.c.qty.label('qty'))\
+        .where(m.c.to_location.isnot(None))
+    outbound = select(m.c.product_id, m.c.from_location.label('location_id'), (-m.c.qty).label('qty'))\
+        .where(m.c.from_location.isnot(None))
+    if since is not None:
+        inbound = inbound.where(m.c.timestamp >= since)
+        outbound = outbound.where(m.c.timestamp >= since)
+    if until is not None:
+        inbound = inbound.where(m.c.timestamp < until)
+        outbound = outbound.where(m.c.timestamp < until)
+    return [inbound, outbound]
+
+
+def ledger_balances_select(since: Optional[datetime] = None, until: Optional[datetime] = None, opening=None):
+    """SELECT computing (product_id, location_id, qty) from the raw movement ledger.
+    opening is an optional SELECT of starting balances with the same columns.
+    """
+    parts = ledger_flows(since, until)
+    if opening is not None:
+        parts.insert(0, opening)
+    flows = union_all(*parts).subquery()
+    return select(flows.c.product_id, flows.c.location_id, func.sum(flows.c.qty).label('qty'))\
+        .group_by(flows.c.product_id, flows.c.location_id)
+
+
+def rebuild_balances() -> int:
+    """Recompute the balance table, with the alerts and history rollups derived from it,
+    from the movement ledger. Returns the number of balance rows written.
+    """
+    db.session.execute(balances_table.delete())
+    db.session.execute(
+        balances_table.insert().from_select(['product_id', 'location_id', 'qty'], ledger_balances_select())
+    )
+    rebuild_alerts()
+    rebuild_history(recorded_movements())
+    expire_job_results()
+    db.session.commit()
+    return db.session.query(func.count()).select_from(balances_table).scalar()
+
+
+def verify_balances() -> List[dict]:
+    """Compare the balance table against the ledger.
+    Returns a list of mismatches; an empty list means the table is consistent.
+    """
+    expected = {(row.product_id, row.location_id): int(row.qty)
+                for row in db.session.execute(ledger_balances_select())}
+    actual = {(row.product_id, row.location_id): int(row.qty)
+              for row in db.session.execute(select(balances_table))}
+
+    mismatches = []
+    for pair in sorted(set(expected) | set(actual)):
+        exp = expected.get(pair, 0)
+        act = actual.get(pair, 0)
+        if exp != act:
+            mismatches.append({'product_id': pair[0], 'location_id': pair[1],
+                               'expected': exp, 'actual': act})
+    return mismatches
+
+
+# Column order used by the balance report and its exports
+REPORT_COLUMNS = ['product_id', 'product_name', 'location_id', 'location_name', 'qty', 'unit_price', 'value']
+
+
+def balance_report_query(source=None):
+    """Query of non-zero balances with product and location details, in report order.
+    source is an optional subquery of (product_id, location_id, qty) to report on
+    instead of the current balances (e.g. balances as of a past date).
+    Rows are plain tuples (see REPORT_COLUMNS), so they can be paginated or streamed.
+    """
+    balances = source if source is not None else balances_table
+    unit_price = func.coalesce(Product.unit_price, 0)
+    return db.session.query(
+        balances.c.product_id,
+        Product.name.label('product_name'),
+        balances.c.location_id,
+        Location.name.label('location_name'),
+        balances.c.qty,
+        unit_price.label('unit_price'),
+        (balances.c.qty * unit_price).label('value'),
+    ).select_from(balances)\
+     .outerjoin(Product, Product.product_id == balances.c.product_id)\
+     .outerjoin(Location, Location.location_id == balances.c.location_id)\
+     .filter(balances.c.qty != 0)\
+     .order_by(Product.name, Location.name, balances.c.product_id, balances.c.location_id)
+
+
+def balance_report_summary(query) -> dict:
+    """Aggregate totals for the report in a single query over the same rows"""
+    rows = query.order_by(None).subquery()
+    totals = db.session.query(
+        func.count(),
+        func.coalesce(func.sum(case((rows.c.qty > 0, 1), else_=0)), 0),
+        func.coalesce(func.sum(case(((rows.c.qty > 0) & (rows.c.qty < 10), 1), else_=0)), 0),
+        func.coalesce(func.sum(case((rows.c.qty < 1, 1), else_=0)), 0),
+        func.coalesce(func.sum(rows.c.value), 0),
+    ).select_from(rows).one()
+    return {
+        'entries': totals[0],
+        'positive': totals[1],
+        'low_stock': totals[2],
+        'out_of_stock': totals[3],
+        'total_value': float(totals[4]),
+    }
@@ -0,0 +1,356 @@
+"""Benchmarks for the movement ledger and the app's routes.
+
+Both commands run against a synthetic SQLite database built by datagen.py
+(generated on first use, then reused):
+
+``plans`` reports, for each query behind a hot route, the EXPLAIN QUERY PLAN
+and median latency without the secondary indexes and again after
+``migrate`` has created them. Stock reads are point lookups in the balance
+table and the movements list is paged by keyset; the per-balance ledger sum
+is timed too, but only rebuild-balances and verify-balances run it.
+
+``routes`` drives every page and API route (including the alert, job,
+versioned API, history and metrics endpoints), plus ``get_stock``, through the
+Flask test client and reports p50/p99/mean latency and throughput per route
+and the process's peak RSS. Results written with --json can be compared with
+``compare``. The stock-in scenario adds movements, so later runs on the same
+file see a slightly longer ledger; use --regenerate for strictly repeatable
+numbers.
+
+Usage (from the inventory_management directory):
+    python benchmark.py plans --movements 1000000 --db /tmp/inventory_bench.db
+    python benchmark.py routes --db /tmp/inventory_bench.db --requests 200 --json after.json
+    python benchmark.py compare before.json after.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import time
+from datetime import datetime
+
+from sqlalchemy import case, create_engine, func, or_, select, tuple_
+
+from datagen import generate_dataset
+from models import ProductMovement, StockBalance
+from migrations import migrate
+
+movements_table = ProductMovement.__table__
+balances_table = StockBalance.__table__
+
+
+def drop_secondary_indexes(engine) -> None:
+    """Remove the ledger indexes so the 'before' numbers reflect the original schema.
+    stock_balances is read through its primary key, which stays.
+    """
+    with engine.begin() as conn:
+        for index in movements_table.indexes:
+            index.drop(conn, checkfirst=True)
+        conn.exec_driver_sql('ANALYZE')
+
+
+def page_cursor(engine, per_page: int = 10) -> tuple:
+    """(timestamp, movement_id) of the last row of the first movements page, where the next page starts"""
+    m = movements_table
+    with engine.connect() as conn:
+        return tuple(conn.execute(select(m.c.timestamp, m.c.movement_id)
+                                  .order_by(m.c.timestamp.desc(), m.c.movement_id.desc())
+                                  .offset(per_page - 1).limit(1)).one())
+
+
+def route_queries(product_id: str, location_id: str, cursor: tuple) -> dict:
+    """The statements issued by the hot routes, keyed by a descriptive name.
+    cursor is the (timestamp, movement_id) the next movements page starts after.
+    """
+    m = movements_table
+    b = balances_table
+    # Detail pages show one cursor page of raw movements (their history comes from rollups)
+    newest_first = (m.c.timestamp.desc(), m.c.movement_id.desc())
+    return {
+        'get_stock': select(b.c.qty).where(b.c.product_id == product_id, b.c.location_id == location_id),
+        'view_product': select(m).where(m.c.product_id == product_id).order_by(*newest_first).limit(21),
+        'view_location (from)': select(m).where(m.c.from_location == location_id).order_by(*newest_first).limit(21),
+        'view_location (to)': select(m).where(m.c.to_location == location_id).order_by(*newest_first).limit(21),
+        'delete_product guard': select(m.c.movement_id).where(m.c.product_id == product_id).limit(1),
+        'delete_location guard': select(m.c.movement_id)
+            .where(or_(m.c.from_location == location_id, m.c.to_location == location_id)).limit(1),
+        'movements list (first page)': select(m).order_by(*newest_first).limit(11),
+        'movements list (next page)': select(m).where(tuple_(m.c.timestamp, m.c.movement_id) < tuple_(*cursor))
+            .order_by(*newest_first).limit(11),
+        'dashboard recent': select(m).order_by(*newest_first).limit(5),
+        # Not on any route: what rebuild-balances and verify-balances sum per balance
+        'ledger sum (rebuild/verify)': select(func.coalesce(func.sum(
+            case((m.c.to_location == location_id, m.c.qty), else_=-m.c.qty)), 0))
+            .where(m.c.product_id == product_id,
+                   or_(m.c.from_location == location_id, m.c.to_location == location_id)),
+    }
+
+
+def measure(engine, queries: dict, repeat: int) -> dict:
+    """Return the query plan and median latency (ms) of each query"""
+    results = {}
+    with engine.connect() as conn:
+        for name, stmt in queries.items():
+            sql = str(stmt.compile(engine, compile_kwargs={'literal_binds': True}))
+            plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.exec_driver_sql(sql).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {'plan': plan, 'median_ms': round(statistics.median(timings), 3)}
+    return results
+
+
+def prepare_database(args) -> None:
+    """Generate the dataset unless the file already holds one"""
+    if args.regenerate and os.path.exists(args.db):
+        os.remove(args.db)
+    if not os.path.exists(args.db) or os.path.getsize(args.db) == 0:
+        print(f'Generating {args.movements:,} movements into {args.db} ...')
+        generate_dataset(create_engine(f'sqlite:///{args.db}'), args.products, args.locations, args.movements,
+                         seed=args.seed)
+
+
+def run_plans(args) -> dict:
+    prepare_database(args)
+    engine = create_engine(f'sqlite:///{args.db}')
+
+    queries = route_queries('P000001', 'L0001', page_cursor(engine))
+    drop_secondary_indexes(engine)
+    before = measure(engine, queries, args.repeat)
+    migrate(engine)
+    after = measure(engine, queries, args.repeat)
+
+    for name in queries:
+        print(f'\n{name}')
+        print(f'  before: {before[name]["median_ms"]:>10.3f} ms  {" | ".join(before[name]["plan"])}')
+        print(f'  after:  {after[name]["median_ms"]:>10.3f} ms  {" | ".join(after[name]["plan"])}')
+    return {'movements': args.movements, 'before': before, 'after': after}
+
+
+def percentile(timings: list, fraction: float) -> float:
+    """Nearest-rank percentile of a list of timings"""
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is in KB on Linux)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def sample_ids(conn, rng: random.Random, count: int) -> dict:
+    """Random product, location and movement IDs to request, drawn uniformly, and a report date"""
+    def pick(table, column):
+        top = conn.exec_driver_sql(f'SELECT max(rowid) FROM {table}').scalar() or 0
+        ids = []
+        for _ in range(count):
+            row = conn.exec_driver_sql(
+                f'SELECT {column} FROM {table} WHERE rowid >= ? ORDER BY rowid LIMIT 1', (rng.randint(1, top),)
+            ).first()
+            if row:
+                ids.append(row[0])
+        return ids
+
+    first, last = conn.exec_driver_sql('SELECT min(timestamp), max(timestamp) FROM product_movements').first()
+    first, last = datetime.fromisoformat(first), datetime.fromisoformat(last)
+    return {
+        'product': pick('products', 'product_id'),
+        'location': pick('locations', 'location_id'),
+        'movement': pick('product_movements', 'movement_id'),
+        # A date halfway through the ledger, for historical reports
+        'as_of': (first + (last - first) / 2).date().isoformat(),
+    }
+
+
+def route_scenarios(ids: dict, requests: int) -> list:
+    """(name, request count, function of i returning (method, path, data)) per scenario.
+    data is form fields, or a JSON string. Scenarios that read a whole table run a tenth as often.
+    """
+    def pick(kind, i):
+        return ids[kind][i % len(ids[kind])]
+
+    heavy = max(1, requests // 10)
+    return [
+        ('index', requests, lambda i: ('GET', '/', None)),
+        ('api_dashboard', requests, lambda i: ('GET', '/api/dashboard', None)),
+        ('products', requests, lambda i: ('GET', '/products', None)),
+        ('products (cursor)', requests, lambda i: ('GET', '/products?paging=cursor', None)),
+        ('products (search)', requests, lambda i: ('GET', f'/products?q={pick("product", i)}', None)),
+        ('view_product', requests, lambda i: ('GET', f'/products/view/{pick("product", i)}', None)),
+        ('edit_product (form)', requests, lambda i: ('GET', f'/products/edit/{pick("product", i)}', None)),
+        ('add_product (form)', requests, lambda i: ('GET', '/products/add', None)),
+        ('locations', requests, lambda i: ('GET', '/locations', None)),
+        ('view_location', requests, lambda i: ('GET', f'/locations/view/{pick("location", i)}', None)),
+        ('edit_location (form)', requests, lambda i: ('GET', f'/locations/edit/{pick("location", i)}', None)),
+        ('movements', requests, lambda i: ('GET', '/movements', None)),
+        ('movements (cursor)', requests, lambda i: ('GET', '/movements?paging=cursor', None)),
+        ('movements (search)', requests, lambda i: ('GET', f'/movements?q={pick("product", i)}', None)),
+        ('view_movement', requests, lambda i: ('GET', f'/movements/view/{pick("movement", i)}', None)),
+        ('edit_movement (form)', requests, lambda i: ('GET', f'/movements/edit/{pick("movement", i)}', None)),
+        ('add_movement (form)', requests, lambda i: ('GET', '/movements/add', None)),
+        ('add_movement (stock in)', requests, lambda i: ('POST', '/movements/add', {
+            'product_id': pick('product', i), 'to_location': pick('location', i), 'qty': '1',
+            'notes': 'Benchmark stock in',
+        })),
+        ('product_lookup', requests, lambda i: ('GET', f'/api/products/lookup?q={pick("product", i)[:4]}', None)),
+        ('location_lookup', requests, lambda i: ('GET', f'/api/locations/lookup?q={pick("location", i)[:3]}', None)),
+        ('balance_report', requests, lambda i: ('GET', '/reports/balance', None)),
+        ('balance_report (as_of)', heavy, lambda i: ('GET', f'/reports/balance?as_of={ids["as_of"]}', None)),
+        ('balance_report.csv', heavy, lambda i: ('GET', '/reports/balance.csv', None)),
+        ('products.csv', heavy, lambda i: ('GET', '/products.csv', None)),
+        ('locations.csv', heavy, lambda i: ('GET', '/locations.csv', None)),
+        ('product_history_api', requests, lambda i: ('GET', f'/api/products/{pick("product", i)}/history', None)),
+        ('product_history (month)', requests,
+         lambda i: ('GET', f'/api/products/{pick("product", i)}/history?bucket=month', None)),
+        ('location_history_api', requests, lambda i: ('GET', f'/api/locations/{pick("location", i)}/history', None)),
+        ('stock_alerts', requests, lambda i: ('GET', '/alerts', None)),
+        ('alerts_api', requests, lambda i: ('GET', '/api/alerts', None)),
+        ('alerts_api (location)', requests, lambda i: ('GET', f'/api/alerts?location_id={pick("location", i)}', None)),
+        ('api_v1 products', requests, lambda i: ('GET', '/api/v1/products', None)),
+        ('api_v1 movements (fields)', requests,
+         lambda i: ('GET', '/api/v1/movements?fields=movement_id,qty&limit=100', None)),
+        ('api_v1 balances', requests, lambda i: ('GET', '/api/v1/balances', None)),
+        ('api_v1 product', requests, lambda i: ('GET', f'/api/v1/products/{pick("product", i)}', None)),
+        ('api_v1 movement', requests, lambda i: ('GET', f'/api/v1/movements/{pick("movement", i)}', None)),
+        ('jobs', requests, lambda i: ('GET', '/jobs', None)),
+        # The first request starts the job; the rest reuse it while the ledger is unchanged
+        ('submit_job (reused)', requests,
+         lambda i: ('POST', '/api/jobs', json.dumps({'kind': 'balance_summary', 'params': {'as_of': ids['as_of']}}))),
+        ('metrics', requests, lambda i: ('GET', '/metrics', None)),
+    ]
+
+
+def summarize(timings: list, elapsed: float) -> dict:
+    """Latency percentiles (ms) and throughput of one scenario"""
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else None,
+    }
+
+
+def run_routes(args) -> dict:
+    prepare_database(args)
+    # The app binds its engine when imported, so the database must be chosen first
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    os.environ['METRICS_ENABLED'] = '1'
+    os.environ.pop('METRICS_TOKEN', None)
+    from app import app, get_stock, init_db
+
+    app.config['QUERY_BUDGET_STRICT'] = False
+    app.config['SLOW_QUERY_SECONDS'] = None
+    app.logger.setLevel('ERROR')
+    with app.app_context():
+        init_db()
+    rng = random.Random(args.seed)
+    with create_engine(f'sqlite:///{args.db}').connect() as conn:
+        ids = sample_ids(conn, rng, args.sample)
+
+    client = app.test_client()
+    results = {}
+    for name, count, make_request in route_scenarios(ids, args.requests):
+        timings = []
+        status = None
+        for i in range(-args.warmup, count):
+            method, path, data = make_request(i)
+            started = time.perf_counter()
+            content_type = 'application/json' if isinstance(data, str) else None
+            response = client.open(path, method=method, data=data, content_type=content_type)
+            response.get_data()  # streamed responses only do their work while being read
+            duration = (time.perf_counter() - started) * 1000
+            status = response.status_code
+            response.close()
+            if i >= 0:
+                timings.append(duration)
+        results[name] = dict(summarize(timings, sum(timings) / 1000), status=status)
+        print(f'{name:<26} p50 {results[name]["p50_ms"]:>9.3f} ms  p99 {results[name]["p99_ms"]:>9.3f} ms  '
+              f'{results[name]["throughput_rps"]:>8.1f} req/s  [{status}]')
+
+    timings = []
+    with app.test_request_context():
+        for i in range(-args.warmup, args.requests * 10):
+            product_id = ids['product'][i % len(ids['product'])]
+            location_id = ids['location'][i % len(ids['location'])]
+            started = time.perf_counter()
+            get_stock(product_id, location_id)
+            if i >= 0:
+                timings.append((time.perf_counter() - started) * 1000)
+    results['get_stock'] = summarize(timings, sum(timings) / 1000)
+    print(f'{"get_stock":<26} p50 {results["get_stock"]["p50_ms"]:>9.3f} ms  '
+          f'p99 {results["get_stock"]["p99_ms"]:>9.3f} ms  {results["get_stock"]["throughput_rps"]:>8.1f} calls/s')
+
+    peak = peak_rss_mb()
+    print(f'\nPeak RSS: {peak} MB')
+    with create_engine(f'sqlite:///{args.db}').connect() as conn:
+        dataset = {table: conn.exec_driver_sql(f'SELECT count(*) FROM {table}').scalar()
+                   for table in ('products', 'locations', 'product_movements')}
+    return {'dataset': dataset, 'requests': args.requests, 'peak_rss_mb': peak, 'routes': results}
+
+
+def run_compare(args) -> None:
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    def change(old, current):
+        return f'{(current - old) / old * 100:+7.1f}%' if old else '    n/a'
+
+    print(f'{"route":<26} {"p50 base":>10} {"p50 new":>10} {"change":>8}  {"p99 base":>10} {"p99 new":>10} {"change":>8}')
+    for name, after in new['routes'].items():
+        before = base['routes'].get(name)
+        if before is None:
+            print(f'{name:<26} (not in {args.base})')
+            continue
+        print(f'{name:<26} {before["p50_ms"]:>10.3f} {after["p50_ms"]:>10.3f} {change(before["p50_ms"], after["p50_ms"])}'
+              f'  {before["p99_ms"]:>10.3f} {after["p99_ms"]:>10.3f} {change(before["p99_ms"], after["p99_ms"])}')
+    print(f'{"peak RSS (MB)":<26} {base["peak_rss_mb"]:>10} {new["peak_rss_mb"]:>10} '
+          f'{change(base["peak_rss_mb"], new["peak_rss_mb"])}')
+
+
+def add_dataset_arguments(parser, movements: int, products: int, locations: int) -> None:
+    parser.add_argument('--db', default='inventory_bench.db', help='SQLite file to create or reuse')
+    parser.add_argument('--movements', type=int, default=movements)
+    parser.add_argument('--products', type=int, default=products)
+    parser.add_argument('--locations', type=int, default=locations)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--regenerate', action='store_true', help='Rebuild the dataset even if the file exists')
+    parser.add_argument('--json', help='Also write the results to this file')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plans = subparsers.add_parser('plans', help='Query plans and latency before/after the ledger indexes')
+    add_dataset_arguments(plans, movements=1000000, products=10000, locations=100)
+    plans.add_argument('--repeat', type=int, default=5, help='Runs per query; the median is reported')
+
+    routes = subparsers.add_parser('routes', help='Latency, throughput and memory of every route')
+    add_dataset_arguments(routes, movements=1000000, products=10000, locations=100)
+    routes.add_argument('--requests', type=int, default=100, help='Requests per route')
+    routes.add_argument('--warmup', type=int, default=5, help='Untimed requests per route first')
+    routes.add_argument('--sample', type=int, default=1000, help='Random IDs to spread requests over')
+
+    compare = subparsers.add_parser('compare', help='Compare two --json results of the routes command')
+    compare.add_argument('base')
+    compare.add_argument('new')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        run_compare(args)
+        return
+    results = run_plans(args) if args.command == 'plans' else run_routes(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
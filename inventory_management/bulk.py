@@ -0,0 +1,239 @@
+"""Bulk ingestion of product movements.
+
+A batch is validated as a whole before anything is written: referenced
+products and locations are checked with one set-based lookup, the balances
+of every touched (product, location) pair are preloaded, and the movements
+are applied in order against those in-memory balances so that stock checks
+see the effect of earlier rows in the same batch. Valid rows are then
+inserted with a single executemany and the balance table (and the history
+rollups) are updated in the same transaction, debits conditionally so a concurrent writer can't be
+overdrawn (the batch is then rejected as a conflict and can be retried).
+"""
+import json
+from datetime import datetime, timezone
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from sqlalchemy import select, tuple_
+
+from balances import MAX_QTY, OPENING_PREFIX, balances_table, closed_until, conditional_debit, movement_deltas
+from alerts import refresh_alerts
+from history import apply_flows, movement_flows
+from jobs import expire_job_results
+from models import db, generate_id, ArchivedMovement, Location, Product, ProductMovement
+from snapshots import invalidate_snapshots
+from writes import LOOKUP_CHUNK, add, upsert
+
+movements_table = ProductMovement.__table__
+
+# Bulk IDs are longer than the form's 8 characters to keep collisions unlikely at volume
+BULK_ID_LENGTH = 16
+
+Pair = Tuple[str, str]
+
+
+class BulkFormatError(ValueError):
+    """Raised when a bulk payload can't be parsed at all"""
+
+
+def iter_records(lines: Iterable[str]) -> Iterator[dict]:
+    """Parse NDJSON lines into records, skipping blank lines"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise BulkFormatError(f'Line {number}: invalid JSON ({e})')
+        if not isinstance(record, dict):
+            raise BulkFormatError(f'Line {number}: expected a JSON object')
+        yield record
+
+
+def load_records(text: str) -> List[dict]:
+    """Parse a JSON array, a {"movements": [...]} object or NDJSON text into records"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return list(iter_records(text.splitlines()))
+    if isinstance(data, dict):
+        data = data.get('movements', [data])
+    if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+        raise BulkFormatError('Expected a list of movement objects')
+    return data
+
+
+def _chunks(items: list, size: int = LOOKUP_CHUNK) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def existing_values(column, values: Set[str]) -> Set[str]:
+    """Return the subset of values present in column, using chunked IN lookups"""
+    found = set()
+    for chunk in _chunks(sorted(values)):
+        found.update(db.session.execute(select(column).where(column.in_(chunk))).scalars())
+    return found
+
+
+def load_balances(pairs: Set[Pair]) -> Dict[Pair, int]:
+    """Preload the stored balances of the given (product, location) pairs"""
+    balances = {}
+    b = balances_table
+    for chunk in _chunks(sorted(pairs)):
+        rows = db.session.execute(
+            select(b.c.product_id, b.c.location_id, b.c.qty)
+            .where(tuple_(b.c.product_id, b.c.location_id).in_(chunk))
+        )
+        for product_id, location_id, qty in rows:
+            balances[(product_id, location_id)] = int(qty)
+    return balances
+
+
+def _normalize(record: dict) -> dict:
+    """Validate the shape of one record and return a movements row; raises ValueError"""
+    product_id = str(record.get('product_id') or '').strip()
+    from_location = str(record.get('from_location') or '').strip() or None
+    to_location = str(record.get('to_location') or '').strip() or None
+    if not product_id:
+        raise ValueError('product_id is required')
+    if not from_location and not to_location:
+        raise ValueError('Either from_location or to_location must be specified')
+    if from_location == to_location:
+        raise ValueError('from_location and to_location must differ')
+    qty = record.get('qty')
+    # int() would silently truncate 1.7, so only integral values are accepted
+    if isinstance(qty, float) and qty.is_integer():
+        qty = int(qty)
+    elif isinstance(qty, str):
+        try:
+            qty = int(qty.strip())
+        except ValueError:
+            raise ValueError('qty must be an integer')
+    if not isinstance(qty, int) or isinstance(qty, bool):
+        raise ValueError('qty must be an integer')
+    if qty <= 0:
+        raise ValueError('qty must be positive')
+    if qty > MAX_QTY:
+        raise ValueError('qty is too large')
+    timestamp = record.get('timestamp')
+    if timestamp:
+        try:
+            timestamp = datetime.fromisoformat(str(timestamp))
+        except ValueError:
+            raise ValueError('timestamp must be an ISO 8601 date/time')
+        # Stored timestamps are naive UTC; convert offsets instead of dropping them
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    notes = record.get('notes')
+    if notes is None:
+        notes = ''
+    elif isinstance(notes, (int, float)) and not isinstance(notes, bool):
+        notes = str(notes)
+    elif not isinstance(notes, str):
+        raise ValueError('notes must be a string')
+    movement_id = str(record.get('movement_id') or generate_id(BULK_ID_LENGTH))
+    if movement_id.startswith(OPENING_PREFIX):
+        raise ValueError(f'movement_id must not start with {OPENING_PREFIX}')
+    return {
+        'movement_id': movement_id,
+        'timestamp': timestamp or datetime.utcnow(),
+        'product_id': product_id,
+        'from_location': from_location,
+        'to_location': to_location,
+        'qty': qty,
+        'notes': notes,
+    }
+
+
+def ingest_movements(records: Iterable[dict], atomic: bool = False) -> dict:
+    """Validate and insert a batch of movements in one transaction.
+
+    Rows that fail validation are reported in ``errors`` (with their 0-based
+    position in the batch) and skipped. With atomic=True nothing is written if
+    any row fails.
+    """
+    errors = []
+    rows = []
+    positions = []
+    for position, record in enumerate(records):
+        try:
+            rows.append(_normalize(record))
+            positions.append(position)
+        except ValueError as e:
+            errors.append({'row': position, 'error': str(e)})
+
+    # Set-based existence checks for everything the batch references
+    known_products = existing_values(Product.product_id, {r['product_id'] for r in rows})
+    known_locations = existing_values(Location.location_id,
+                                      {loc for r in rows for loc in (r['from_location'], r['to_location']) if loc})
+    movement_ids = {r['movement_id'] for r in rows}
+    known_movements = (existing_values(ProductMovement.movement_id, movement_ids)
+                       | existing_values(ArchivedMovement.movement_id, movement_ids))
+    cutoff = closed_until()
+
+    touched = {pair for r in rows
+               for pair, _ in movement_deltas(r['product_id'], r['from_location'], r['to_location'], r['qty'])}
+    stored = load_balances(touched)
+    balances = dict(stored)
+
+    accepted = []
+    seen_ids = set()
+    for position, row in zip(positions, rows):
+        error = None
+        if row['product_id'] not in known_products:
+            error = f"Unknown product {row['product_id']}"
+        elif row['from_location'] and row['from_location'] not in known_locations:
+            error = f"Unknown location {row['from_location']}"
+        elif row['to_location'] and row['to_location'] not in known_locations:
+            error = f"Unknown location {row['to_location']}"
+        elif row['movement_id'] in known_movements or row['movement_id'] in seen_ids:
+            error = f"Duplicate movement_id {row['movement_id']}"
+        elif cutoff is not None and row['timestamp'] < cutoff:
+            error = f"timestamp is in an archived period (movements before {cutoff} are closed)"
+        elif row['from_location']:
+            available = balances.get((row['product_id'], row['from_location']), 0)
+            if row['qty'] > available:
+                error = f"Insufficient stock at {row['from_location']}. Available: {available}, Requested: {row['qty']}"
+        if error:
+            errors.append({'row': position, 'error': error})
+            continue
+        for pair, delta in movement_deltas(row['product_id'], row['from_location'], row['to_location'], row['qty']):
+            balances[pair] = balances.get(pair, 0) + delta
+        seen_ids.add(row['movement_id'])
+        accepted.append(row)
+
+    errors.sort(key=lambda e: e['row'])
+    if not accepted or (atomic and errors):
+        return {'inserted': 0, 'failed': len(errors), 'errors': errors}
+
+    db.session.execute(movements_table.insert(), accepted)
+    # Backdated rows change history covered by existing snapshots
+    invalidate_snapshots(min(row['timestamp'] for row in accepted))
+    # Write balance changes as relative deltas: credits as upserts and debits
+    # conditionally, so stock drawn by a concurrent writer since the balances
+    # were preloaded is detected instead of driving a balance negative. The
+    # pairs are written in key order, so concurrent writers take the row locks
+    # in the same order; consecutive credits or debits share one executemany.
+    deltas = {pair: qty - stored.get(pair, 0) for pair, qty in balances.items()}
+    changed = [(pair, delta) for pair, delta in sorted(deltas.items()) if delta]
+    for is_debit, run in groupby(changed, key=lambda item: item[1] < 0):
+        run = list(run)
+        if not is_debit:
+            upsert(balances_table, ['product_id', 'location_id'], {'qty': add},
+                   [{'product_id': p, 'location_id': l, 'qty': delta} for (p, l), delta in run])
+            continue
+        result = db.session.execute(conditional_debit(), [
+            {'b_product_id': p, 'b_location_id': l, 'b_amount': -delta} for (p, l), delta in run])
+        if result.rowcount != len(run):
+            db.session.rollback()
+            failed = len(errors) + len(accepted)
+            errors.append({'row': None, 'error': 'Stock changed while the batch was being applied; retry the batch'})
+            return {'inserted': 0, 'failed': failed, 'errors': errors, 'conflict': True}
+    refresh_alerts(pair for pair, delta in deltas.items() if delta)
+    apply_flows(flow for row in accepted for flow in movement_flows(
+        row['product_id'], row['from_location'], row['to_location'], row['qty'], row['timestamp']))
+    expire_job_results()
+    db.session.commit()
+    return {'inserted': len(accepted), 'failed': len(errors), 'errors': errors}
@@ -0,0 +1,146 @@
+"""Caching of dashboard statistics, low-stock alerts and form choice lists.
+
+Values are cached under fixed keys with a TTL and dropped explicitly by the
+routes that change them (``invalidate`` right after the commit), so readers
+normally see fresh data and the TTL only bounds staleness from writers the
+cache can't see, such as other processes or CLI commands.
+
+The default backend is an in-process LRU. Set CACHE_BACKEND to any object
+with ``get(key)``, ``set(key, value, ttl)``, ``delete(*keys)`` and
+``clear()`` (e.g. a thin Redis wrapper) to share the cache between
+processes. Cached values must be plain data (dicts, lists, datetimes), not
+ORM instances, since they outlive the session that loaded them.
+
+Config:
+    CACHE_TTL          seconds a value stays cached (default 60, 0 disables caching)
+    CACHE_MAX_ENTRIES  size of the in-process LRU (default 256)
+    CACHE_BACKEND      backend object replacing the in-process LRU
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+from flask import current_app
+
+# Keys of the cached values; routes invalidate the ones their writes affect
+PRODUCT_COUNT = 'product_count'
+LOCATION_COUNT = 'location_count'
+MOVEMENT_COUNT = 'movement_count'
+RECENT_MOVEMENTS = 'recent_movements'
+PRODUCT_CHOICES = 'product_choices'
+LOCATION_CHOICES = 'location_choices'
+STOCK_ALERTS = 'stock_alerts'
+
+
+class MemoryBackend:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class Cache:
+    """Cache facade used by the routes; also records when each key last changed"""
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._changed = {}
+        self._fingerprints = {}
+
+    def get_or_set(self, key: str, compute: Callable):
+        """Return the cached value of key, computing and storing it on a miss"""
+        if not self.ttl:
+            return self._computed(key, compute())
+        # Values are wrapped so that a cached None isn't mistaken for a miss
+        wrapped = self.backend.get(key)
+        if wrapped is not None:
+            return wrapped[0]
+        value = self._computed(key, compute())
+        self.backend.set(key, (value,), self.ttl)
+        return value
+
+    def _computed(self, key: str, value):
+        """Note when a freshly computed value differs from the previous one, so
+        changes made by writers the cache can't see still move last_modified
+        """
+        fingerprint = hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+        if self._fingerprints.get(key) != fingerprint:
+            self._fingerprints[key] = fingerprint
+            self._changed[key] = datetime.utcnow().replace(microsecond=0)
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """Drop keys after a write that changed them"""
+        self.backend.delete(*keys)
+        now = datetime.utcnow().replace(microsecond=0)
+        for key in keys:
+            self._changed[key] = now
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self._changed.clear()
+        self._fingerprints.clear()
+
+    def last_modified(self, *keys: str) -> Optional[datetime]:
+        """When any of keys was last invalidated, or recomputed with a different value, in this process"""
+        stamps = [self._changed[key] for key in keys if key in self._changed]
+        return max(stamps) if stamps else None
+
+
+def init_cache(app) -> Cache:
+    """Create the app's cache from its config"""
+    app.config.setdefault('CACHE_TTL', 60)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 256)
+    backend = app.config.get('CACHE_BACKEND') or MemoryBackend(app.config['CACHE_MAX_ENTRIES'])
+    app.extensions['cache'] = Cache(backend, app.config['CACHE_TTL'])
+    return app.extensions['cache']
+
+
+def get_cache() -> Cache:
+    return current_app.extensions['cache']
+
+
+def cached(key: str, compute: Callable):
+    """Shortcut for get_or_set on the current app's cache"""
+    return get_cache().get_or_set(key, compute)
+
+
+def invalidate(*keys: str) -> None:
+    """Shortcut for invalidate on the current app's cache"""
+    get_cache().invalidate(*keys)
@@ -0,0 +1,157 @@
+"""Bulk import and export of the product and location catalogs.
+
+Imports read CSV (with a header row) or NDJSON as a stream and work through
+it in chunks of IMPORT_CHUNK records: each chunk is validated, its IDs are
+checked against the table with one set-based lookup, and it is written with
+a single executemany and committed. Memory use is therefore bounded by the
+chunk size, not the file size. By default rows are upserted (existing
+records take the imported name and details); with mode='insert' existing IDs
+are reported as errors instead. Within a file the last occurrence of an ID
+wins. An existing record only takes the columns a row has: a CSV without
+an address column, or an NDJSON record without an "address" key, leaves the
+stored address alone, while an empty value clears it.
+
+Exports stream the table in ID order through exports.py.
+"""
+import csv
+import math
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from sqlalchemy import select
+
+from bulk import BulkFormatError, existing_values, iter_records
+from jobs import expire_job_results
+from models import db, Location, Product
+from writes import replace, upsert
+
+# Columns per catalog; the first is the ID
+CATALOGS = {
+    'products': (Product, ['product_id', 'name', 'description', 'unit_price']),
+    'locations': (Location, ['location_id', 'name', 'address', 'manager']),
+}
+
+IMPORT_MODES = ('upsert', 'insert')
+
+# Records validated and written per transaction
+IMPORT_CHUNK = 5000
+
+# Per-row errors kept for the report; later ones are only counted
+MAX_ERRORS = 1000
+
+# Column sizes of the catalog tables
+MAX_LENGTHS = {'product_id': 50, 'location_id': 50, 'name': 100, 'manager': 100}
+
+
+def iter_catalog_records(stream: TextIO, fmt: str) -> Iterator[dict]:
+    """Parse a CSV or NDJSON text stream into records, one at a time"""
+    if fmt == 'csv':
+        return csv.DictReader(stream)
+    return iter_records(stream)
+
+
+def _normalize(kind: str, record: dict) -> dict:
+    """Validate one record and return a catalog row of the columns it has; raises ValueError"""
+    _, columns = CATALOGS[kind]
+    row = {}
+    for column in columns:
+        value = record.get(column)
+        if value is not None:
+            row[column] = str(value).strip()
+    for required in (columns[0], 'name'):
+        if not row.get(required):
+            raise ValueError(f'{required} is required')
+    for column, length in MAX_LENGTHS.items():
+        if len(row.get(column, '')) > length:
+            raise ValueError(f'{column} is longer than {length} characters')
+    if 'unit_price' in row:
+        try:
+            row['unit_price'] = float(row['unit_price'] or 0)
+        except ValueError:
+            raise ValueError('unit_price must be a number')
+        if not math.isfinite(row['unit_price']):
+            raise ValueError('unit_price must be a number')
+        if row['unit_price'] < 0:
+            raise ValueError('unit_price must not be negative')
+    return row
+
+
+def _write_chunk(kind: str, rows: List[dict]) -> None:
+    model, columns = CATALOGS[kind]
+    now = datetime.utcnow()
+    defaults = dict.fromkeys(columns[1:], '')
+    if kind == 'products':
+        defaults['unit_price'] = 0.0
+    # One statement per set of columns present: existing records take only
+    # those (and keep their created_at); new ones get defaults for the rest
+    by_columns: Dict[tuple, List[dict]] = {}
+    for row in rows:
+        by_columns.setdefault(tuple(column for column in columns[1:] if column in row), []).append(row)
+    for present, group in by_columns.items():
+        upsert(model.__table__, [columns[0]], {column: replace for column in present},
+               [dict(defaults, **row, created_at=now) for row in group])
+    # Updated names and prices change balance exports and summaries
+    expire_job_results()
+
+
+def import_catalog(kind: str, records: Iterable[dict], mode: str = 'upsert') -> dict:
+    """Validate and write catalog records chunk by chunk, committing each chunk.
+
+    Returns counts of inserted, updated and failed rows plus up to MAX_ERRORS
+    per-row errors (with their 0-based position in the input). A stream that
+    can't be parsed stops the import at that point; earlier chunks stay written.
+    """
+    model, columns = CATALOGS[kind]
+    key = columns[0]
+    result = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def error(position: Optional[int], message: str) -> None:
+        result['failed'] += 1
+        if len(result['errors']) < MAX_ERRORS:
+            result['errors'].append({'row': position, 'error': message})
+
+    def flush(chunk: dict) -> None:
+        existing = existing_values(getattr(model, key), set(chunk))
+        rows = []
+        for row_id, (position, row) in chunk.items():
+            if mode == 'insert' and row_id in existing:
+                error(position, f'{key} {row_id} already exists')
+            else:
+                rows.append(row)
+        if rows:
+            _write_chunk(kind, rows)
+            db.session.commit()
+        updated = sum(1 for row in rows if row[key] in existing)
+        result['updated'] += updated
+        result['inserted'] += len(rows) - updated
+
+    chunk = {}
+    try:
+        for position, record in enumerate(records):
+            try:
+                row = _normalize(kind, record)
+            except ValueError as e:
+                error(position, str(e))
+                continue
+            if mode == 'insert' and row[key] in chunk:
+                error(position, f'Duplicate {key} {row[key]}')
+                continue
+            # Later occurrences of an ID replace earlier ones
+            chunk.pop(row[key], None)
+            chunk[row[key]] = (position, row)
+            if len(chunk) >= IMPORT_CHUNK:
+                flush(chunk)
+                chunk = {}
+    except (BulkFormatError, csv.Error) as e:
+        error(None, f'Stopped reading the input: {e}')
+    if chunk:
+        flush(chunk)
+    return result
+
+
+def catalog_rows(kind: str):
+    """All rows of a catalog in ID order, fetched in batches"""
+    model, columns = CATALOGS[kind]
+    table = model.__table__
+    stmt = select(*[table.c[c] for c in columns]).order_by(table.c[columns[0]])
+    return db.session.execute(stmt.execution_options(yield_per=1000))
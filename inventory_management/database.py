@@ -0,0 +1,131 @@
+"""Database engine configuration and read-replica routing.
+
+The database is chosen with the DATABASE_URL environment variable (default
+``sqlite:///inventory.db``). SQLite connections get the pragmas in
+SQLITE_PRAGMAS when they open: WAL journaling lets readers proceed while a
+write is in progress, synchronous=NORMAL is durable across application
+crashes with far fewer fsyncs under WAL, and busy_timeout makes writers wait
+for the lock instead of failing with "database is locked". Other databases
+(PostgreSQL) get a connection pool sized by DB_POOL_SIZE/DB_MAX_OVERFLOW with
+pre-ping, so connections dropped by the server are replaced transparently.
+
+Set DATABASE_REPLICA_URL to serve the endpoints in READ_ONLY_ENDPOINTS (the
+lists, reports, exports, API lists and history series) from a second,
+read-only engine: a streaming replica on PostgreSQL, or the same file on
+SQLite, where it gives reads their own connection pool marked query_only.
+A replica may lag the primary, so the pages a write redirects to can briefly
+show the state before it. Anything flushed in the session always goes to the
+primary.
+
+Config:
+    SQLITE_PRAGMAS         pragmas run on each new SQLite connection
+    DB_POOL_SIZE           pooled connections per engine (default 10; not SQLite)
+    DB_MAX_OVERFLOW        extra connections allowed under load (default 20)
+    DB_POOL_TIMEOUT        seconds to wait for a pooled connection (default 30)
+    DB_POOL_RECYCLE        seconds before a connection is replaced (default 1800)
+    READ_ONLY_ENDPOINTS    endpoints routed to the replica when one is configured
+"""
+import os
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA = 'replica'
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative: KiB rather than pages
+}
+
+DEFAULT_READ_ONLY_ENDPOINTS = {
+    'products',
+    'locations',
+    'movements',
+    'balance_report',
+    'export_balance_report',
+    'export_catalog',
+    'api_v1.list_resource',
+    'product_history_api',
+    'location_history_api',
+}
+
+
+def backend_name(url) -> str:
+    """'sqlite', 'postgresql', ... for a database URL"""
+    return make_url(url).get_backend_name()
+
+
+def engine_options(url: str, config, read_only: bool = False) -> dict:
+    """Engine keyword arguments for a database URL"""
+    backend = backend_name(url)
+    if backend == 'sqlite':
+        # SQLite waits for locks through busy_timeout; pooling defaults suit it
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+    if read_only and backend == 'postgresql':
+        options['connect_args'] = {'options': '-c default_transaction_read_only=on'}
+    return options
+
+
+def configure_database(app) -> None:
+    """Set the database URI, engine options and replica bind. Call before db.init_app."""
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', 'sqlite:///inventory.db'))
+    app.config.setdefault('SQLITE_PRAGMAS', dict(DEFAULT_SQLITE_PRAGMAS))
+    app.config.setdefault('DB_POOL_SIZE', 10)
+    app.config.setdefault('DB_MAX_OVERFLOW', 20)
+    app.config.setdefault('DB_POOL_TIMEOUT', 30)
+    app.config.setdefault('DB_POOL_RECYCLE', 1800)
+    app.config.setdefault('READ_ONLY_ENDPOINTS', set(DEFAULT_READ_ONLY_ENDPOINTS))
+
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(url, app.config))
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA, dict(engine_options(replica_url, app.config, read_only=True), url=replica_url))
+
+
+def _pragma_listener(pragmas: dict, read_only: bool):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            if read_only and name == 'journal_mode':
+                continue  # persistent in the file; set by the primary
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+    return set_pragmas
+
+
+def init_database(app, db) -> None:
+    """Apply SQLite pragmas to new connections and route read-only endpoints to the replica"""
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _pragma_listener(app.config['SQLITE_PRAGMAS'], key == REPLICA))
+
+    @app.before_request
+    def choose_bind():
+        g.use_replica = request.endpoint in app.config['READ_ONLY_ENDPOINTS']
+
+
+class RoutingSession(Session):
+    """Session that sends reads in read-only endpoints to the replica engine, if configured"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context() and g.get('use_replica')
+                and REPLICA in self._db.engines):
+            return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
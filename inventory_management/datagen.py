@@ -0,0 +1,172 @@
+"""Synthetic large-scale datasets for benchmarks.
+
+Generates a catalog and a movement ledger shaped like the seed data in
+``create_sample_data``: goods are received into warehouses, restocked to
+stores, sold, returned and occasionally moved between stores. Popularity is
+skewed (Zipf-like) so a small share of products and stores account for most
+movements, as in production. Stock is tracked while generating so no
+balance ever goes negative, and the balance table and history rollups are
+written to match, so the result is a database the app can serve directly.
+
+Usage (from the inventory_management directory):
+    python datagen.py --db /tmp/inventory_large.db --products 100000 --locations 1000 --movements 10000000
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import create_engine
+
+from history import rebuild_statements
+from models import db, Location, Product, ProductMovement, StockBalance
+
+INSERT_CHUNK = 50000
+
+products_table = Product.__table__
+locations_table = Location.__table__
+movements_table = ProductMovement.__table__
+balances_table = StockBalance.__table__
+
+# Share of each kind of flow, as in the seed data
+FLOW_MIX = (
+    ('receipt', 0.18),
+    ('restock', 0.27),
+    ('sale', 0.36),
+    ('return', 0.09),
+    ('inter_store', 0.10),
+)
+
+NOTES = {
+    'receipt': 'Initial stock',
+    'restock': 'Store restock',
+    'sale': 'Customer sale',
+    'return': 'Customer return',
+    'inter_store': 'Inter-store transfer',
+}
+
+
+def zipf_cum_weights(n: int, s: float) -> List[float]:
+    """Cumulative weights giving item i (0-based) a probability proportional to 1 / (i + 1) ** s"""
+    return list(itertools.accumulate(1.0 / (i + 1) ** s for i in range(n)))
+
+
+def generate_dataset(engine, n_products: int, n_locations: int, n_movements: int, seed: int = 42,
+                     skew: float = 1.1, days: int = 365) -> None:
+    """Fill an empty database with a synthetic catalog, movement ledger and matching balances
+    and history rollups
+    """
+    rng = random.Random(seed)
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    product_ids = [f'P{i:06d}' for i in range(1, n_products + 1)]
+    location_ids = [f'L{i:04d}' for i in range(1, n_locations + 1)]
+
+    # A few warehouses and one returns location; the rest are stores
+    n_warehouses = max(1, n_locations // 50)
+    warehouses = location_ids[:n_warehouses]
+    returns = location_ids[n_warehouses] if n_locations > n_warehouses else warehouses[0]
+    stores = location_ids[n_warehouses + 1:] or warehouses
+
+    def location_name(location_id):
+        if location_id in warehouses:
+            return f'Warehouse {location_id}'
+        return f'Returns {location_id}' if location_id == returns else f'Store {location_id}'
+
+    with engine.begin() as conn:
+        conn.execute(products_table.insert(), [
+            {'product_id': pid, 'name': f'Product {pid}', 'description': f'Synthetic product {pid}',
+             'unit_price': round(rng.uniform(1, 50000), 2), 'created_at': start}
+            for pid in product_ids
+        ])
+        conn.execute(locations_table.insert(), [
+            {'location_id': lid, 'name': location_name(lid), 'address': '', 'manager': '', 'created_at': start}
+            for lid in location_ids
+        ])
+
+    product_weights = zipf_cum_weights(n_products, skew)
+    store_weights = zipf_cum_weights(len(stores), skew / 2)
+    flow_names = [name for name, _ in FLOW_MIX]
+    flow_weights = list(itertools.accumulate(share for _, share in FLOW_MIX))
+    balances = {}
+    step = (now - start) / max(n_movements, 1)
+
+    def take(product_id, location_id, most):
+        """Quantity up to `most` available at a location, or 0"""
+        return min(most, balances.get((product_id, location_id), 0))
+
+    for chunk_start in range(0, n_movements, INSERT_CHUNK):
+        size = min(INSERT_CHUNK, n_movements - chunk_start)
+        products = rng.choices(product_ids, cum_weights=product_weights, k=size)
+        store_picks = rng.choices(stores, cum_weights=store_weights, k=2 * size)
+        flows = rng.choices(flow_names, cum_weights=flow_weights, k=size)
+        rows = []
+        for offset in range(size):
+            i = chunk_start + offset
+            product_id = products[offset]
+            home = warehouses[int(product_id[1:]) % n_warehouses]
+            store, other_store = store_picks[2 * offset], store_picks[2 * offset + 1]
+            flow = flows[offset]
+            from_location = to_location = None
+            qty = 0
+            if flow == 'restock':
+                from_location, to_location, qty = home, store, take(product_id, home, rng.randint(5, 30))
+            elif flow == 'sale':
+                from_location, qty = store, take(product_id, store, rng.randint(1, 5))
+            elif flow == 'return':
+                to_location, qty = returns, rng.randint(1, 2)
+            elif flow == 'inter_store' and store != other_store:
+                from_location, to_location = store, other_store
+                qty = take(product_id, store, rng.randint(1, 5))
+            if qty <= 0:
+                # Nothing to move (or a receipt was drawn): receive goods at the product's warehouse
+                flow, from_location, to_location, qty = 'receipt', None, home, rng.randint(20, 200)
+            if from_location:
+                balances[(product_id, from_location)] -= qty
+            if to_location:
+                balances[(product_id, to_location)] = balances.get((product_id, to_location), 0) + qty
+            rows.append({
+                'movement_id': f'M{i:09d}',
+                'timestamp': start + step * i,
+                'from_location': from_location,
+                'to_location': to_location,
+                'product_id': product_id,
+                'qty': qty,
+                'notes': NOTES[flow],
+            })
+        with engine.begin() as conn:
+            conn.execute(movements_table.insert(), rows)
+
+    balance_rows = [{'product_id': p, 'location_id': l, 'qty': qty} for (p, l), qty in balances.items() if qty]
+    with engine.begin() as conn:
+        for i in range(0, len(balance_rows), INSERT_CHUNK):
+            conn.execute(balances_table.insert(), balance_rows[i:i + INSERT_CHUNK])
+        for statement in rebuild_statements(movements_table, engine.dialect.name):
+            conn.execute(statement)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='inventory_large.db', help='SQLite file to create')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--locations', type=int, default=1000)
+    parser.add_argument('--movements', type=int, default=10000000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of product popularity')
+    parser.add_argument('--days', type=int, default=365, help='Span of the ledger, ending now')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        raise SystemExit(f'{args.db} already exists; remove it first')
+    started = time.perf_counter()
+    generate_dataset(create_engine(f'sqlite:///{args.db}'), args.products, args.locations, args.movements,
+                     args.seed, args.skew, args.days)
+    print(f'Generated {args.movements:,} movements into {args.db} in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
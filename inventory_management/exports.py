@@ -0,0 +1,55 @@
+"""Streaming CSV/NDJSON responses.
+
+Rows are written out as they are fetched, so exports run in constant memory
+regardless of how many rows the underlying query returns.
+"""
+import csv
+import io
+import json
+from typing import Iterable, Iterator, Sequence
+
+from flask import Response, stream_with_context
+
+# Rows are buffered into chunks of this many before being sent to the client
+CHUNK_ROWS = 500
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_csv(columns: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    """Yield CSV text in chunks, starting with a header row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(columns: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    """Yield newline-delimited JSON objects in chunks"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), default=str))
+        if len(lines) >= CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_response(fmt: str, columns: Sequence[str], rows: Iterable[Sequence], filename: str) -> Response:
+    """Build a streaming download response for rows in the given format ('csv' or 'ndjson')"""
+    generate = iter_csv if fmt == 'csv' else iter_ndjson
+    return Response(
+        stream_with_context(generate(columns, rows)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'},
+    )
@@ -0,0 +1,225 @@
+"""Time-bucketed movement history of products and locations.
+
+The product and location pages chart the units moved in and out per day,
+week or month. Summing the movements themselves would cost time in
+proportion to an entity's activity, so two daily rollups are kept instead:
+``product_daily_flows`` per (product, location, day) and
+``location_daily_flows`` per (location, day). Every ledger write adds its
+flows to both in the same transaction (``apply_movement`` does it for
+single movements; the bulk path and movement edits call ``apply_flows``),
+so a history query reads at most one rollup row per day of its window,
+whatever the number of movements behind them. Days are UTC, like the stored
+timestamps; weeks start on Monday.
+
+Archiving a period leaves the rollups alone: they keep the archived
+movements' history, and the opening-balance rows that replace them in the
+live ledger are not movements and never counted. ``rebuild_history``
+recomputes both rollups from the full ledger.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Date, String, cast, func, literal, select, union_all
+
+from models import db, Location, LocationDailyFlow, ProductDailyFlow
+from writes import add, upsert
+
+product_flows_table = ProductDailyFlow.__table__
+location_flows_table = LocationDailyFlow.__table__
+
+# Bucket sizes and how many of them a page shows by default
+BUCKETS = {'day': 30, 'week': 26, 'month': 12}
+MAX_PERIODS = 366
+
+FLOW_COLUMNS = ['qty_in', 'qty_out', 'moves_in', 'moves_out']
+FLOW_ADD = {name: add for name in FLOW_COLUMNS}
+
+Flow = Tuple[str, str, date, int, int, int, int]
+
+
+def movement_flows(product_id: str, from_location: Optional[str], to_location: Optional[str], qty: int,
+                   timestamp: datetime, sign: int = 1) -> List[Flow]:
+    """The rollup changes a movement implies, as (product, location, day, qty_in, qty_out,
+    moves_in, moves_out) tuples. Use sign=-1 to get the changes that undo it.
+    """
+    day = timestamp.date()
+    flows = []
+    if from_location:
+        flows.append((product_id, from_location, day, 0, sign * qty, 0, sign))
+    if to_location:
+        flows.append((product_id, to_location, day, sign * qty, 0, sign, 0))
+    return flows
+
+
+def apply_flows(flows: Iterable[Flow]) -> None:
+    """Add movement flows to both rollups, merging changes to the same row first.
+    Runs in the caller's transaction, alongside the ledger write.
+    """
+    by_product: Dict[tuple, List[int]] = {}
+    by_location: Dict[tuple, List[int]] = {}
+    for product_id, location_id, day, *amounts in flows:
+        for merged, key in ((by_product, (product_id, location_id, day)), (by_location, (location_id, day))):
+            totals = merged.setdefault(key, [0, 0, 0, 0])
+            for i, amount in enumerate(amounts):
+                totals[i] += amount
+    # Sorted, so concurrent writers take the row locks in the same order
+    product_rows = [dict(zip(['product_id', 'location_id', 'day'] + FLOW_COLUMNS, key + tuple(totals)))
+                    for key, totals in sorted(by_product.items()) if any(totals)]
+    location_rows = [dict(zip(['location_id', 'day'] + FLOW_COLUMNS, key + tuple(totals)))
+                     for key, totals in sorted(by_location.items()) if any(totals)]
+    if product_rows:
+        upsert(product_flows_table, ['product_id', 'location_id', 'day'], FLOW_ADD, product_rows)
+    if location_rows:
+        upsert(location_flows_table, ['location_id', 'day'], FLOW_ADD, location_rows)
+
+
+def day_of(column, dialect: str):
+    """SQL date (UTC day) of a timestamp column"""
+    if dialect == 'sqlite':
+        return func.date(column, type_=Date)
+    return cast(column, Date)
+
+
+def rebuild_statements(ledger, dialect: str) -> list:
+    """Statements that refill both rollups from ledger, a table or subquery of movements
+    (see ``balances.recorded_movements``). The rollups must be empty.
+    """
+    day = day_of(ledger.c.timestamp, dialect)
+    zero, one = literal(0), literal(1)
+    inbound = select(ledger.c.product_id, ledger.c.to_location.label('location_id'), day.label('day'),
+                     ledger.c.qty.label('qty_in'), zero.label('qty_out'), one.label('moves_in'),
+                     zero.label('moves_out')).where(ledger.c.to_location.isnot(None))
+    outbound = select(ledger.c.product_id, ledger.c.from_location.label('location_id'), day.label('day'),
+                      zero.label('qty_in'), ledger.c.qty.label('qty_out'), zero.label('moves_in'),
+                      one.label('moves_out')).where(ledger.c.from_location.isnot(None))
+    flows = union_all(inbound, outbound).subquery()
+    p = product_flows_table
+    return [
+        p.insert().from_select(
+            ['product_id', 'location_id', 'day'] + FLOW_COLUMNS,
+            select(flows.c.product_id, flows.c.location_id, flows.c.day,
+                   *[func.sum(flows.c[name]) for name in FLOW_COLUMNS])
+            .group_by(flows.c.product_id, flows.c.location_id, flows.c.day),
+        ),
+        location_flows_table.insert().from_select(
+            ['location_id', 'day'] + FLOW_COLUMNS,
+            select(p.c.location_id, p.c.day, *[func.sum(p.c[name]) for name in FLOW_COLUMNS])
+            .group_by(p.c.location_id, p.c.day),
+        ),
+    ]
+
+
+def rebuild_history(ledger) -> int:
+    """Recompute both rollups from the given ledger (see rebuild_statements).
+    Returns the number of product rollup rows; the caller commits.
+    """
+    db.session.execute(product_flows_table.delete())
+    db.session.execute(location_flows_table.delete())
+    for statement in rebuild_statements(ledger, db.session.get_bind().dialect.name):
+        db.session.execute(statement)
+    return db.session.query(func.count()).select_from(product_flows_table).scalar()
+
+
+def parse_bucket(bucket: Optional[str], periods: Optional[int]) -> Tuple[str, int]:
+    """Validate ?bucket= and ?periods=, filling in the defaults; raises ValueError"""
+    bucket = bucket or 'day'
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    periods = periods or BUCKETS[bucket]
+    if not 1 <= periods <= MAX_PERIODS:
+        raise ValueError(f'periods must be between 1 and {MAX_PERIODS}')
+    return bucket, periods
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def bucket_starts(bucket: str, periods: int, today: Optional[date] = None) -> List[date]:
+    """Start dates of the last periods buckets up to the one containing today, oldest first"""
+    current = bucket_start(today or datetime.utcnow().date(), bucket)
+    starts = [current]
+    for _ in range(periods - 1):
+        current = bucket_start(current - timedelta(days=1), bucket)
+        starts.append(current)
+    return starts[::-1]
+
+
+def bucket_of(column, bucket: str, dialect: str):
+    """SQL expression giving the 'YYYY-MM-DD' start of the bucket a date column falls in"""
+    if dialect == 'sqlite':
+        if bucket == 'week':
+            # Back to the previous Monday (or the same day on a Monday)
+            return func.date(column, '-6 days', 'weekday 1', type_=String)
+        if bucket == 'month':
+            return func.strftime('%Y-%m-01', column, type_=String)
+        return func.date(column, type_=String)
+    return func.to_char(func.date_trunc(bucket, column), 'YYYY-MM-DD', type_=String)
+
+
+def _series(rows, periods: List[str]) -> Dict[str, list]:
+    """Fill in/out/net lists, one entry per period, from (period, qty_in, qty_out) rows"""
+    position = {period: i for i, period in enumerate(periods)}
+    qty_in, qty_out = [0] * len(periods), [0] * len(periods)
+    for row in rows:
+        i = position.get(row.period)
+        if i is not None:
+            qty_in[i] += int(row.qty_in)
+            qty_out[i] += int(row.qty_out)
+    return {'in': qty_in, 'out': qty_out, 'net': [a - b for a, b in zip(qty_in, qty_out)]}
+
+
+def product_history(product_id: str, bucket: str = 'day', periods: Optional[int] = None) -> dict:
+    """Units of a product moved in and out per bucket, in total and per location.
+    One query over at most one rollup row per location and day of the window.
+    """
+    bucket, periods = parse_bucket(bucket, periods)
+    starts = bucket_starts(bucket, periods)
+    labels = [start.isoformat() for start in starts]
+    f = product_flows_table
+    period = bucket_of(f.c.day, bucket, db.session.get_bind().dialect.name).label('period')
+    rows = db.session.execute(
+        select(period, f.c.location_id, Location.name.label('location_name'),
+               func.sum(f.c.qty_in).label('qty_in'), func.sum(f.c.qty_out).label('qty_out'))
+        .select_from(f.outerjoin(Location.__table__, Location.location_id == f.c.location_id))
+        .where(f.c.product_id == product_id, f.c.day >= starts[0])
+        .group_by(period, f.c.location_id, Location.name)
+    ).all()
+
+    by_location: Dict[str, list] = {}
+    names = {}
+    for row in rows:
+        by_location.setdefault(row.location_id, []).append(row)
+        names[row.location_id] = row.location_name
+    locations = []
+    for location_id, location_rows in by_location.items():
+        series = _series(location_rows, labels)
+        locations.append(dict(series, location_id=location_id, location_name=names[location_id],
+                              total_in=sum(series['in']), total_out=sum(series['out']),
+                              total_net=sum(series['net'])))
+    locations.sort(key=lambda item: (-(item['total_in'] + item['total_out']), item['location_id']))
+    return {'bucket': bucket, 'periods': labels, 'totals': _series(rows, labels), 'locations': locations}
+
+
+def location_history(location_id: str, bucket: str = 'day', periods: Optional[int] = None) -> dict:
+    """Units of all products moved in and out of a location per bucket, with movement counts.
+    One query over at most one rollup row per day of the window.
+    """
+    bucket, periods = parse_bucket(bucket, periods)
+    starts = bucket_starts(bucket, periods)
+    labels = [start.isoformat() for start in starts]
+    f = location_flows_table
+    period = bucket_of(f.c.day, bucket, db.session.get_bind().dialect.name).label('period')
+    rows = db.session.execute(
+        select(period, func.sum(f.c.qty_in).label('qty_in'), func.sum(f.c.qty_out).label('qty_out'),
+               func.sum(f.c.moves_in).label('moves_in'), func.sum(f.c.moves_out).label('moves_out'))
+        .where(f.c.location_id == location_id, f.c.day >= starts[0])
+        .group_by(period)
+    ).all()
+    return {'bucket': bucket, 'periods': labels, 'totals': _series(rows, labels),
+            'moves_in': sum(int(row.moves_in) for row in rows),
+            'moves_out': sum(int(row.moves_out) for row in rows)}
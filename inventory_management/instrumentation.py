@@ -0,0 +1,318 @@
+"""Request, SQL and template instrumentation.
+
+Query budgets: every statement executed on the app's engines during a
+request is counted. When a route goes over its budget a warning is logged,
+or, with QUERY_BUDGET_STRICT (on by default under app.testing),
+QueryBudgetExceeded is raised so the offending request fails loudly in tests.
+
+Metrics: ``init_metrics`` records per-endpoint request latency and status,
+SQL statement counts and time, and template render time, and serves them in
+the Prometheus text format at /metrics. Statements slower than
+SLOW_QUERY_SECONDS are logged with their parameters. Metrics are kept per
+process; scrape each worker or run a single process.
+
+Profiling: with PROFILE_SAMPLE_RATE > 0 that fraction of requests runs under
+cProfile and the aggregated statistics are served at /metrics/profile (POST
+to it to clear them). Profiling slows the sampled requests down
+considerably, so keep the rate low in production.
+
+The metrics and profile endpoints reveal endpoint names, timings and code
+paths, so they are off unless METRICS_ENABLED is set, and with METRICS_TOKEN
+they require an ``Authorization: Bearer <token>`` header. Both default to
+the environment variables of the same name.
+
+Config:
+    QUERY_BUDGET         default budget for every endpoint (None disables)
+    QUERY_BUDGETS        {endpoint: budget} overrides
+    QUERY_BUDGET_STRICT  raise instead of logging (defaults to app.testing)
+    METRICS_ENABLED      serve /metrics and /metrics/profile (default off)
+    METRICS_TOKEN        bearer token the metrics endpoints require (default none)
+    SLOW_QUERY_SECONDS   log statements slower than this (default 0.5, None disables)
+    PROFILE_SAMPLE_RATE  fraction of requests to profile (default 0)
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when a request executes more SQL statements than its budget allows"""
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def query_budget(app, endpoint):
+    """Return the configured query budget for an endpoint, or None if unlimited"""
+    budgets = app.config.get('QUERY_BUDGETS') or {}
+    return budgets.get(endpoint, app.config.get('QUERY_BUDGET'))
+
+
+def init_query_counter(app, db):
+    """Attach the query counter to the app's engines and enforce budgets after each request"""
+    with app.app_context():
+        for engine in db.engines.values():
+            if not event.contains(engine, 'before_cursor_execute', _count_query):
+                event.listen(engine, 'before_cursor_execute', _count_query)
+
+    @app.before_request
+    def reset_query_count():
+        # g lives on the app context, which may be shared by several requests
+        g.query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        budget = query_budget(app, request.endpoint)
+        count = g.get('query_count', 0)
+        if budget is not None and count > budget:
+            message = f'{request.endpoint} executed {count} SQL queries (budget {budget})'
+            if app.config.get('QUERY_BUDGET_STRICT', app.testing):
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
+
+
+# Latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Longest parameter repr written to the slow query log
+MAX_LOGGED_PARAMETERS = 500
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Monotonic counter per label set"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: Tuple, amount: float = 1) -> None:
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                yield f'{self.name}{_labels(self.labels, label_values)} {value}'
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str], buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: Tuple, value: float) -> None:
+        with self._lock:
+            state = self.values.get(label_values)
+            if state is None:
+                # One count per bucket, then +Inf, then the sum
+                state = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            for label_values, state in sorted(self.values.items()):
+                for bound, count in zip(self.buckets + ('+Inf',), state):
+                    le = f'le="{bound}"'
+                    yield f'{self.name}_bucket{_labels(self.labels, label_values, le)} {count}'
+                yield f'{self.name}_sum{_labels(self.labels, label_values)} {state[-1]:.6f}'
+                yield f'{self.name}_count{_labels(self.labels, label_values)} {state[-2]}'
+
+
+class Metrics:
+    """The app's metric families"""
+
+    def __init__(self):
+        self.requests = Counter('app_requests_total', 'Requests by endpoint, method and status',
+                                ['endpoint', 'method', 'status'])
+        self.request_seconds = Histogram('app_request_duration_seconds', 'Request latency by endpoint',
+                                         ['endpoint'])
+        self.sql_queries = Counter('app_sql_queries_total', 'SQL statements executed by endpoint', ['endpoint'])
+        self.sql_seconds = Histogram('app_sql_duration_seconds', 'SQL statement latency by endpoint', ['endpoint'])
+        self.slow_queries = Counter('app_sql_slow_queries_total', 'Statements over SLOW_QUERY_SECONDS', ['endpoint'])
+        self.template_seconds = Histogram('app_template_render_seconds', 'Template render time', ['template'])
+        self.profiler_stats: Optional[pstats.Stats] = None
+        self.profiled_requests = 0
+        self._profile_lock = threading.Lock()
+
+    def families(self):
+        return [self.requests, self.request_seconds, self.sql_queries, self.sql_seconds,
+                self.slow_queries, self.template_seconds]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for family in self.families():
+            lines.append(f'# HELP {family.name} {family.help_text}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            lines.extend(family.samples())
+        return '\n'.join(lines) + '\n'
+
+    def add_profile(self, profile: cProfile.Profile) -> None:
+        with self._profile_lock:
+            if self.profiler_stats is None:
+                self.profiler_stats = pstats.Stats(profile)
+            else:
+                self.profiler_stats.add(profile)
+            self.profiled_requests += 1
+
+    def profile_report(self, limit: int = 40) -> str:
+        with self._profile_lock:
+            if self.profiler_stats is None:
+                return 'No requests profiled yet (set PROFILE_SAMPLE_RATE).\n'
+            out = io.StringIO()
+            self.profiler_stats.stream = out
+            out.write(f'{self.profiled_requests} profiled requests\n')
+            self.profiler_stats.sort_stats('cumulative').print_stats(limit)
+            return out.getvalue()
+
+    def reset_profile(self) -> None:
+        with self._profile_lock:
+            self.profiler_stats = None
+            self.profiled_requests = 0
+
+
+def _current_endpoint() -> str:
+    return (request.endpoint or 'unknown') if has_request_context() else 'none'
+
+
+def init_metrics(app, db) -> Metrics:
+    """Record request, SQL and template timings for the app and serve them at /metrics"""
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+    app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    app.config.setdefault('SLOW_QUERY_SECONDS', 0.5)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0)
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        endpoint = _current_endpoint()
+        metrics.sql_queries.inc((endpoint,))
+        metrics.sql_seconds.observe((endpoint,), elapsed)
+        threshold = app.config.get('SLOW_QUERY_SECONDS')
+        if threshold is not None and elapsed >= threshold:
+            metrics.slow_queries.inc((endpoint,))
+            shown = repr(parameters)
+            if len(shown) > MAX_LOGGED_PARAMETERS:
+                shown = shown[:MAX_LOGGED_PARAMETERS] + '...'
+            app.logger.warning('Slow query (%.0f ms) in %s: %s; parameters: %s',
+                               elapsed * 1000, endpoint, ' '.join(statement.split()), shown)
+
+    def execute_failed(context):
+        # after_cursor_execute doesn't run for a failed statement; drop its start time
+        if context.connection is not None:
+            context.connection.info.pop('query_started', None)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_execute)
+            event.listen(engine, 'after_cursor_execute', after_execute)
+            event.listen(engine, 'handle_error', execute_failed)
+
+    def template_started(sender, template, context, **extra):
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        started = g.get('template_started')
+        if started:
+            metrics.template_seconds.observe((template.name or 'string',), time.perf_counter() - started.pop())
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        g.pop('request_recorded', None)
+        g.pop('profiler', None)
+        rate = app.config.get('PROFILE_SAMPLE_RATE') or 0
+        if rate and random.random() < rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def record(status: int) -> None:
+        if g.get('request_recorded') or 'request_started' not in g:
+            return
+        g.request_recorded = True
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            metrics.add_profile(profiler)
+        endpoint = _current_endpoint()
+        metrics.requests.inc((endpoint, request.method, str(status)))
+        metrics.request_seconds.observe((endpoint,), time.perf_counter() - g.request_started)
+
+    @app.after_request
+    def record_request(response):
+        record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(exc):
+        # after_request doesn't run when the view raised
+        if exc is not None:
+            record(500)
+
+    if app.config['METRICS_ENABLED']:
+        def authorize() -> None:
+            token = app.config.get('METRICS_TOKEN')
+            if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                abort(401)
+
+        def metrics_view():
+            authorize()
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        def profile_view():
+            authorize()
+            if request.method == 'POST':
+                metrics.reset_profile()
+            return Response(metrics.profile_report(), mimetype='text/plain')
+
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+        app.add_url_rule('/metrics/profile', 'metrics_profile', profile_view, methods=['GET', 'POST'])
+    return metrics
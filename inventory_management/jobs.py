@@ -0,0 +1,263 @@
+"""Background jobs for long reports, exports and recomputations.
+
+Work that reads the whole ledger (full exports, historical summaries,
+balance checks and rebuilds) runs on a thread pool instead of the request
+thread. Each job is a row in the ``jobs`` table, so its status, progress and
+result can be polled from any process, and results survive restarts: JSON
+results are stored on the row, file results (exports) in JOB_RESULTS_DIR.
+
+Tasks are registered with ``@task(kind, params)``; a task receives a
+``JobContext`` for progress reports plus its validated parameters, and
+returns a JSON-serializable result. Submitting a job with the same kind and
+parameters as a queued, running or finished job whose result is still valid
+returns that job instead of starting another. Every ledger write calls
+``expire_job_results`` in its transaction, so a result is reused only until
+the movements change. While a task runs, a heartbeat thread refreshes the
+job's ``updated_at`` every quarter of JOB_STALE_SECONDS, so tasks that never
+report progress aren't mistaken for dead ones; a queued or running job that
+has been silent for JOB_STALE_SECONDS (e.g. its process died) is marked failed
+and replaced. Jobs running in the current process are never considered stale,
+since their heartbeat can be held up by a long write transaction on SQLite.
+
+Config:
+    JOB_WORKERS         worker threads (default 2; 0 runs jobs inline, for tests and the CLI)
+    JOB_RESULTS_DIR     where file results are written (default <instance>/job_results)
+    JOB_STALE_SECONDS   silence after which an unfinished job is considered dead (default 600)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import current_app
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, Job
+
+jobs_table = Job.__table__
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+# Progress is written at most this often (seconds)
+PROGRESS_INTERVAL = 0.5
+
+# kind -> (function, {param: validator})
+TASKS: Dict[str, Tuple[Callable, Dict[str, Callable]]] = {}
+
+# IDs of the jobs running in this process
+_running = set()
+
+
+class JobError(ValueError):
+    """Raised when a job can't be submitted (unknown kind or invalid parameters)"""
+
+
+def task(kind: str, params: Optional[Dict[str, Callable]] = None):
+    """Register a job function. params maps each accepted parameter to a
+    validator that raises ValueError for bad values; parameters are strings.
+    """
+    def register(function):
+        TASKS[kind] = (function, params or {})
+        return function
+    return register
+
+
+class JobContext:
+    """Handed to a running task to report progress and place file results"""
+
+    def __init__(self, job_id: str, results_dir: str):
+        self.job_id = job_id
+        self.results_dir = results_dir
+        self.result_path = None
+        self._reported = 0.0
+
+    def progress(self, fraction: float, message: Optional[str] = None, force: bool = False) -> None:
+        """Record progress (0..1), writing it at most every PROGRESS_INTERVAL seconds"""
+        now = time.monotonic()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        values = {'progress': max(0.0, min(fraction, 1.0)), 'updated_at': datetime.utcnow()}
+        if message is not None:
+            values['message'] = message
+        # On its own connection, so the task's session (and any result it is streaming) is left alone
+        with db.engine.begin() as conn:
+            conn.execute(jobs_table.update().where(jobs_table.c.job_id == self.job_id).values(**values))
+
+    def result_file(self, extension: str) -> str:
+        """Path for this job's file result"""
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.result_path = os.path.join(self.results_dir, f'{self.job_id}.{extension}')
+        return self.result_path
+
+
+def job_key(kind: str, params: dict) -> str:
+    return hashlib.sha1(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+
+def validate_params(kind: str, params: dict) -> dict:
+    """Check a submission against the task's parameters; returns the normalized params"""
+    if kind not in TASKS:
+        raise JobError(f'Unknown job kind {kind}')
+    if not isinstance(params, dict):
+        raise JobError('params must be an object')
+    _, accepted = TASKS[kind]
+    unknown = sorted(set(params) - set(accepted))
+    if unknown:
+        raise JobError(f"Unknown parameter(s) for {kind}: {', '.join(unknown)}")
+    normalized = {}
+    for name, validate in accepted.items():
+        value = str(params.get(name) or '').strip()
+        if not value:
+            continue
+        try:
+            validate(value)
+        except ValueError as e:
+            raise JobError(f'Invalid {name}: {e}')
+        normalized[name] = value
+    return normalized
+
+
+def reusable_job(key: str) -> Optional[Job]:
+    """The newest live job with this key whose result is still valid, if any"""
+    stale_before = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+    for job in Job.query.filter(Job.key == key, Job.expired_at.is_(None)).order_by(Job.created_at.desc()):
+        if job.status == DONE:
+            return job
+        if job.status in (QUEUED, RUNNING):
+            if job.job_id in _running or (job.updated_at or job.created_at) >= stale_before:
+                return job
+            finish(job.job_id, FAILED, message='Interrupted: no progress reported')
+    return None
+
+
+def submit_job(kind: str, params: Optional[dict] = None, force: bool = False) -> Tuple[Job, bool]:
+    """Queue a job, or return an identical one whose result is still valid.
+    Returns (job, created). Raises JobError for unknown kinds or bad parameters.
+    """
+    params = validate_params(kind, params or {})
+    key = job_key(kind, params)
+    if not force:
+        existing = reusable_job(key)
+        if existing is not None:
+            return existing, False
+    job = Job(job_id=uuid.uuid4().hex, kind=kind, params=json.dumps(params), key=key,
+              status=QUEUED, created_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    runner = current_app.extensions['jobs']
+    if runner is None:
+        run_job(current_app._get_current_object(), job.job_id)
+    else:
+        runner.submit(run_job, current_app._get_current_object(), job.job_id)
+    # The job is updated from the runner's own session
+    db.session.refresh(job)
+    return job, True
+
+
+def finish(job_id: str, status: str, message: Optional[str] = None, result=None,
+           result_path: Optional[str] = None) -> None:
+    now = datetime.utcnow()
+    values = {'status': status, 'finished_at': now, 'updated_at': now, 'message': message}
+    if status == DONE:
+        values.update(progress=1.0, result=json.dumps(result, default=str), result_path=result_path)
+    else:
+        # Failed jobs are never reused
+        values['expired_at'] = now
+    db.session.execute(jobs_table.update().where(jobs_table.c.job_id == job_id).values(**values))
+    db.session.commit()
+
+
+def heartbeat(app, engine, job_id: str, stop: threading.Event) -> None:
+    """Refresh a running job's updated_at until stop is set"""
+    interval = app.config['JOB_STALE_SECONDS'] / 4
+    while not stop.wait(interval):
+        try:
+            with engine.begin() as conn:
+                conn.execute(jobs_table.update().where(jobs_table.c.job_id == job_id, jobs_table.c.status == RUNNING)
+                             .values(updated_at=datetime.utcnow()))
+        except OperationalError:
+            # e.g. the task holds SQLite's write lock; this process still knows the job is alive
+            app.logger.warning('Heartbeat of job %s skipped: database busy', job_id)
+
+
+def run_job(app, job_id: str) -> None:
+    """Execute a queued job in its own app context (and so its own session)"""
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        function, _ = TASKS[job.kind]
+        params = json.loads(job.params)
+        now = datetime.utcnow()
+        db.session.execute(jobs_table.update().where(jobs_table.c.job_id == job_id)
+                           .values(status=RUNNING, started_at=now, updated_at=now))
+        db.session.commit()
+        context = JobContext(job_id, app.config['JOB_RESULTS_DIR'])
+        _running.add(job_id)
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(app, db.engine, job_id, stop),
+                                name=f'job-heartbeat-{job_id[:8]}', daemon=True)
+        beat.start()
+        try:
+            result = function(context, **params)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Job %s (%s) failed', job_id, job.kind)
+            finish(job_id, FAILED, message=str(e) or type(e).__name__)
+            return
+        finally:
+            stop.set()
+            beat.join()
+            _running.discard(job_id)
+        finish(job_id, DONE, result=result, result_path=context.result_path)
+
+
+def expire_job_results() -> None:
+    """Mark every reusable job result stale; call in the same transaction as a write
+    results depend on: the ledger, or the product and location names and prices
+    """
+    db.session.execute(jobs_table.update().where(jobs_table.c.expired_at.is_(None))
+                       .values(expired_at=datetime.utcnow()))
+
+
+def prune_jobs(before: datetime) -> int:
+    """Delete jobs created before the given instant, with their result files. Returns the count."""
+    jobs = Job.query.filter(Job.created_at < before, Job.status.in_((DONE, FAILED))).all()
+    for job in jobs:
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
+
+
+def job_dict(job: Job) -> dict:
+    """Plain-data form of a job for JSON responses"""
+    return {
+        'job_id': job.job_id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'has_file': bool(job.result_path),
+        'stale': job.status == DONE and job.expired_at is not None,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def init_jobs(app) -> None:
+    """Create the app's job runner from its config"""
+    app.config.setdefault('JOB_WORKERS', 2)
+    app.config.setdefault('JOB_RESULTS_DIR', os.path.join(app.instance_path, 'job_results'))
+    app.config.setdefault('JOB_STALE_SECONDS', 600)
+    workers = app.config['JOB_WORKERS']
+    app.extensions['jobs'] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job') if workers else None
@@ -0,0 +1,200 @@
+"""Parallel consistency check of the movement ledger against the balance table.
+
+``verify_balances`` compares the two with one GROUP BY in one process; this
+check goes further and is meant for after imports or incidents. The ledger is
+split into ranges of product_id (every movement of a product, and so every
+balance of it, falls in exactly one range) and the ranges are checked on a
+process pool, each worker with its own read-only connection. A worker streams
+its range in (product, timestamp) order in chunks of CHUNK_ROWS, replays the
+movements and reports:
+
+    no_locations       a movement with neither a source nor a destination
+    same_location      a movement whose source and destination are the same
+    non_positive_qty   a movement of zero or negative quantity
+    unknown_product    a movement of a product that isn't in the catalog
+    unknown_location   a movement from or to a location that doesn't exist
+    went_negative      the first movement that took a balance below zero
+    negative_balance   a balance that is negative at the end of the ledger
+    balance_mismatch   a stored balance that differs from the ledger's
+
+There are several ranges per worker so that workers which finish early pick
+up more work, which keeps all cores busy despite skewed product popularity.
+The live table alone is complete even after archival (its opening-balance
+rows stand in for the archived history), so archived movements aren't read.
+
+Usage (from the inventory_management directory):
+    flask --app app check-ledger --workers 8 --report issues.ndjson
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, event, select
+
+from models import Location, Product, ProductMovement, StockBalance
+
+products_table = Product.__table__
+locations_table = Location.__table__
+movements_table = ProductMovement.__table__
+balances_table = StockBalance.__table__
+
+CHUNK_ROWS = 10000
+
+# Ranges per worker; more ranges balance the load better at a small cost per range
+RANGES_PER_WORKER = 8
+
+ISSUE_KINDS = ['no_locations', 'same_location', 'non_positive_qty', 'unknown_product', 'unknown_location',
+               'went_negative', 'negative_balance', 'balance_mismatch']
+
+Bounds = Tuple[Optional[str], Optional[str]]
+
+# Per-process state of the pool workers
+_engine = None
+_locations = None
+
+
+def read_only_engine(url: str):
+    """A fresh engine for a worker process; SQLite connections are opened query_only"""
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA query_only = ON')
+            cursor.execute('PRAGMA busy_timeout = 5000')
+            cursor.close()
+    return engine
+
+
+def _init_worker(url: str) -> None:
+    global _engine, _locations
+    _engine = read_only_engine(url)
+    with _engine.connect() as conn:
+        _locations = set(conn.execute(select(locations_table.c.location_id)).scalars())
+
+
+def product_ranges(conn, count: int) -> List[Bounds]:
+    """Split the product_id key space into up to count contiguous [low, high) ranges
+    of about as many catalog products each. The first and last ranges are open, so
+    movements of products missing from the catalog are covered too.
+    """
+    product_ids = list(conn.execute(select(products_table.c.product_id).order_by(products_table.c.product_id))
+                       .scalars())
+    step = max(1, -(-len(product_ids) // max(count, 1)))
+    cuts = product_ids[step::step]
+    return list(zip([None] + cuts, cuts + [None]))
+
+
+def _in_range(column, bounds: Bounds):
+    low, high = bounds
+    clauses = []
+    if low is not None:
+        clauses.append(column >= low)
+    if high is not None:
+        clauses.append(column < high)
+    return clauses
+
+
+def check_range(bounds: Bounds) -> dict:
+    """Replay the movements of one product range and compare with its stored balances"""
+    m, p, b = movements_table, products_table, balances_table
+    issues = []
+    running: Dict[Tuple[str, str], int] = {}
+    went_negative = set()
+    locations = _locations
+    movements = 0
+
+    def add(pair, delta, movement_id, timestamp):
+        qty = running.get(pair, 0) + delta
+        running[pair] = qty
+        if qty < 0 and pair not in went_negative:
+            went_negative.add(pair)
+            issues.append({'issue': 'went_negative', 'product_id': pair[0], 'location_id': pair[1],
+                           'qty': qty, 'movement_id': movement_id, 'timestamp': timestamp})
+
+    with _engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            select(m.c.movement_id, m.c.timestamp, m.c.product_id, m.c.from_location, m.c.to_location, m.c.qty,
+                   p.c.product_id.isnot(None))
+            .select_from(m.outerjoin(p, p.c.product_id == m.c.product_id))
+            .where(*_in_range(m.c.product_id, bounds))
+            .order_by(m.c.product_id, m.c.timestamp, m.c.movement_id)
+        )
+        for chunk in result.partitions(CHUNK_ROWS):
+            movements += len(chunk)
+            # Plain tuple unpacking: this loop runs once per movement of the ledger
+            for movement_id, timestamp, product_id, source, destination, qty, known_product in chunk:
+                problem = None
+                if not source and not destination:
+                    problem = 'no_locations'
+                elif source == destination:
+                    problem = 'same_location'
+                elif qty is None or qty <= 0:
+                    problem = 'non_positive_qty'
+                if problem:
+                    issues.append({'issue': problem, 'movement_id': movement_id, 'product_id': product_id,
+                                   'from_location': source, 'to_location': destination, 'qty': qty})
+                if not known_product:
+                    issues.append({'issue': 'unknown_product', 'movement_id': movement_id, 'product_id': product_id})
+                # The balance table applies every movement as recorded, so replay them the same way
+                if source:
+                    if source not in locations:
+                        issues.append({'issue': 'unknown_location', 'movement_id': movement_id,
+                                       'product_id': product_id, 'location_id': source})
+                    add((product_id, source), -(qty or 0), movement_id, timestamp)
+                if destination:
+                    if destination not in locations:
+                        issues.append({'issue': 'unknown_location', 'movement_id': movement_id,
+                                       'product_id': product_id, 'location_id': destination})
+                    add((product_id, destination), qty or 0, movement_id, timestamp)
+
+        stored = {(row.product_id, row.location_id): row.qty for row in conn.execute(
+            select(b.c.product_id, b.c.location_id, b.c.qty).where(*_in_range(b.c.product_id, bounds))
+        )}
+
+    for pair in sorted(set(running) | set(stored)):
+        expected = running.get(pair, 0)
+        actual = stored.get(pair, 0)
+        if expected < 0:
+            issues.append({'issue': 'negative_balance', 'product_id': pair[0], 'location_id': pair[1],
+                           'qty': expected})
+        if expected != actual:
+            issues.append({'issue': 'balance_mismatch', 'product_id': pair[0], 'location_id': pair[1],
+                           'expected': expected, 'actual': actual})
+    return {'movements': movements, 'balances': len(running), 'issues': issues}
+
+
+def check_ledger(url: str, workers: Optional[int] = None, ranges: Optional[int] = None) -> dict:
+    """Check the whole ledger of the database at url on a pool of workers (default:
+    one per CPU). Returns {'movements', 'balances', 'ranges', 'counts', 'issues'}, with
+    the issues sorted by kind, product and location.
+    """
+    workers = workers or os.cpu_count() or 1
+    engine = read_only_engine(url)
+    with engine.connect() as conn:
+        bounds = product_ranges(conn, ranges or workers * RANGES_PER_WORKER)
+    engine.dispose()
+
+    results = []
+    if workers == 1:
+        _init_worker(url)
+        results = [check_range(b) for b in bounds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(url,)) as pool:
+            futures = [pool.submit(check_range, b) for b in bounds]
+            results = [future.result() for future in as_completed(futures)]
+
+    issues = [issue for result in results for issue in result['issues']]
+    order = {kind: i for i, kind in enumerate(ISSUE_KINDS)}
+    issues.sort(key=lambda issue: (order[issue['issue']], issue['product_id'] or '',
+                                   issue.get('location_id') or '', issue.get('movement_id') or ''))
+    counts = {kind: 0 for kind in ISSUE_KINDS}
+    for issue in issues:
+        counts[issue['issue']] += 1
+    return {
+        'movements': sum(result['movements'] for result in results),
+        'balances': sum(result['balances'] for result in results),
+        'ranges': len(bounds),
+        'counts': counts,
+        'issues': issues,
+    }
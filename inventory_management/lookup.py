@@ -0,0 +1,118 @@
+"""Prefix lookups behind the product and location pickers.
+
+The movement form no longer renders the whole catalog as <select> options;
+its pickers query ``/api/products/lookup`` and ``/api/locations/lookup`` as
+the user types. The sorted (ID, name) rows are held in the app cache under
+the same keys the form dropdowns used, so the routes that invalidate those
+keys keep them fresh; they are cached as plain data with a digest, and each
+process builds its in-memory index once per digest it sees.
+Matching is by prefix of the ID or of any word of the name, case-insensitively,
+with a bisect over sorted keys, so a lookup costs O(log n + limit); an empty
+query lists the first IDs in order from a presorted list.
+"""
+import hashlib
+import json
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from cache import LOCATION_CHOICES, PRODUCT_CHOICES, cached
+from models import db, Location, Product
+
+# Results per lookup unless ?limit= asks for fewer (or up to MAX_LOOKUP_LIMIT)
+LOOKUP_LIMIT = 20
+MAX_LOOKUP_LIMIT = 100
+
+
+def _terms(text: str) -> List[str]:
+    return text.lower().split()
+
+
+class ChoiceIndex:
+    """Sorted prefix index over (id, name) pairs"""
+
+    def __init__(self, rows: Iterable[Tuple[str, str]]):
+        self.names = {}
+        entries = []
+        for choice_id, name in rows:
+            name = name or ''
+            self.names[choice_id] = name
+            entries.append((choice_id.lower(), choice_id))
+            entries.extend((term, choice_id) for term in _terms(name))
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._ids = [choice_id for _, choice_id in entries]
+        # What an empty query lists, so it doesn't sort the catalog per call
+        self._sorted_ids = sorted(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, choice_id):
+        return choice_id in self.names
+
+    def _matches_all(self, choice_id: str, terms: List[str]) -> bool:
+        words = [choice_id.lower()] + _terms(self.names[choice_id])
+        return all(any(word.startswith(term) for word in words) for term in terms)
+
+    def search(self, q: str, limit: int = LOOKUP_LIMIT) -> List[dict]:
+        """Choices with every term of q prefixing their ID or a word of their name"""
+        terms = _terms(q)
+        if not terms:
+            ids = self._sorted_ids[:limit]
+        else:
+            # Walk the keys starting with the first term; check the others per candidate
+            first, rest = terms[0], terms[1:]
+            ids = []
+            seen = set()
+            for position in range(bisect_left(self._keys, first), len(self._keys)):
+                if len(ids) >= limit or not self._keys[position].startswith(first):
+                    break
+                choice_id = self._ids[position]
+                if choice_id in seen:
+                    continue
+                seen.add(choice_id)
+                if not rest or self._matches_all(choice_id, rest):
+                    ids.append(choice_id)
+        return [{'id': choice_id, 'name': self.names[choice_id]} for choice_id in ids]
+
+    def label(self, choice_id: Optional[str]) -> str:
+        """Name of a choice, or '' if unknown"""
+        return self.names.get(choice_id, '') if choice_id else ''
+
+
+# {cache key: (digest, index)} of the indexes this process has built
+_indexes: Dict[str, Tuple[str, ChoiceIndex]] = {}
+
+
+def choice_rows(id_column, name_column) -> dict:
+    """Every (id, name) pair ordered by id, and a digest of them, as plain data to cache"""
+    rows = [[choice_id, name or ''] for choice_id, name in
+            db.session.execute(select(id_column, name_column).order_by(id_column)).all()]
+    return {'digest': hashlib.sha1(json.dumps(rows).encode()).hexdigest(), 'rows': rows}
+
+
+def _index(key: str, choices: dict) -> ChoiceIndex:
+    """The index of cached choices, rebuilt only when their digest changes"""
+    built = _indexes.get(key)
+    if built is None or built[0] != choices['digest']:
+        built = _indexes[key] = (choices['digest'], ChoiceIndex(choices['rows']))
+    return built[1]
+
+
+def product_index() -> ChoiceIndex:
+    """Index of every product, built from the cached product rows"""
+    return _index(PRODUCT_CHOICES, cached(PRODUCT_CHOICES, lambda: choice_rows(Product.product_id, Product.name)))
+
+
+def location_index() -> ChoiceIndex:
+    """Index of every location, built from the cached location rows"""
+    return _index(LOCATION_CHOICES, cached(LOCATION_CHOICES, lambda: choice_rows(Location.location_id, Location.name)))
+
+
+def lookup_limit(requested: Optional[int]) -> int:
+    """Clamp a requested result count to 1..MAX_LOOKUP_LIMIT"""
+    if requested is None:
+        return LOOKUP_LIMIT
+    return max(1, min(requested, MAX_LOOKUP_LIMIT))
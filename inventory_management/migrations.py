@@ -0,0 +1,59 @@
+"""Schema migrations for existing databases.
+
+``db.create_all()`` only creates missing tables; it never touches tables that
+already exist. ``migrate`` brings an existing database up to the current
+models by also creating any indexes declared on the models that are missing,
+and dropping the indexes in REPLACED_INDEXES, which earlier versions created
+and newer ones superseded. Other indexes the models don't declare, such as
+ones an operator added by hand, are left alone. Every step is idempotent, so
+it is safe to run on every start-up.
+"""
+from typing import List
+
+from sqlalchemy import inspect
+
+from models import db
+
+# {table: [index]} created by earlier versions of the models and since replaced
+REPLACED_INDEXES = {
+    # By the (product, location, timestamp) indexes that also serve as-of sums
+    'product_movements': ['ix_product_movements_product_to', 'ix_product_movements_product_from'],
+}
+
+
+def pending_migrations(engine) -> List[str]:
+    """List the schema changes needed to bring the database up to the models"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    pending = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            pending.append(f'create table {table.name}')
+            continue
+        existing_indexes = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name not in existing_indexes:
+                pending.append(f'create index {index.name} on {table.name}')
+        for name in REPLACED_INDEXES.get(table.name, []):
+            if name in existing_indexes:
+                pending.append(f'drop index {name} on {table.name}')
+    return pending
+
+
+def migrate(engine) -> List[str]:
+    """Create missing tables and indexes. Returns the list of changes applied."""
+    applied = pending_migrations(engine)
+    if not applied:
+        return applied
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for change in applied:
+            if change.startswith('drop index '):
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS {change.split()[2]}')
+        if engine.dialect.name == 'sqlite':
+            # Refresh planner statistics so the new indexes are used
+            conn.exec_driver_sql('ANALYZE')
+    return applied
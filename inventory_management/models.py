@@ -1,10 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import uuid
 
-db = SQLAlchemy()
+from database import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def generate_id(length: int = 8):
+    """Generate a unique ID"""
+    return uuid.uuid4().hex[:length].upper()
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # List ordering and keyset pagination
+        db.Index('ix_products_created_at', 'created_at', 'product_id'),
+    )
     
     product_id = db.Column(db.String(50), primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -20,6 +31,10 @@ class Product(db.Model):
 
 class Location(db.Model):
     __tablename__ = 'locations'
+    __table_args__ = (
+        # List ordering and keyset pagination
+        db.Index('ix_locations_created_at', 'created_at', 'location_id'),
+    )
     
     location_id = db.Column(db.String(50), primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -40,6 +55,17 @@ class Location(db.Model):
 
 class ProductMovement(db.Model):
     __tablename__ = 'product_movements'
+    __table_args__ = (
+        # Stock sums (optionally bounded in time) and per-product history
+        db.Index('ix_product_movements_product_to_ts', 'product_id', 'to_location', 'timestamp'),
+        db.Index('ix_product_movements_product_from_ts', 'product_id', 'from_location', 'timestamp'),
+        db.Index('ix_product_movements_product_timestamp', 'product_id', 'timestamp'),
+        # Per-location history and the location delete guard
+        db.Index('ix_product_movements_from_timestamp', 'from_location', 'timestamp'),
+        db.Index('ix_product_movements_to_timestamp', 'to_location', 'timestamp'),
+        # Movement list and dashboard ordering; movement_id breaks timestamp ties
+        db.Index('ix_product_movements_timestamp', 'timestamp', 'movement_id'),
+    )
     
     movement_id = db.Column(db.String(50), primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -63,3 +89,164 @@ class ProductMovement(db.Model):
             return "Stock Out"
         else:
             return "Unknown"
+
+class ArchivePeriod(db.Model):
+    """A closed period of the movement ledger whose movements were archived"""
+    __tablename__ = 'archive_periods'
+    
+    period_end = db.Column(db.DateTime, primary_key=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    movement_count = db.Column(db.Integer, nullable=False, default=0)
+    opening_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ArchivePeriod before {self.period_end}: {self.movement_count} movements>'
+
+class ArchivedMovement(db.Model):
+    """A movement from a closed period, moved out of the live ledger"""
+    __tablename__ = 'archived_movements'
+    __table_args__ = (
+        db.Index('ix_archived_movements_product_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_archived_movements_from_timestamp', 'from_location', 'timestamp'),
+        db.Index('ix_archived_movements_to_timestamp', 'to_location', 'timestamp'),
+        db.Index('ix_archived_movements_timestamp', 'timestamp', 'movement_id'),
+    )
+    
+    movement_id = db.Column(db.String(50), primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    from_location = db.Column(db.String(50), db.ForeignKey('locations.location_id'), nullable=True)
+    to_location = db.Column(db.String(50), db.ForeignKey('locations.location_id'), nullable=True)
+    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), nullable=False)
+    qty = db.Column(db.Integer, nullable=False)
+    notes = db.Column(db.Text)
+    period_end = db.Column(db.DateTime, db.ForeignKey('archive_periods.period_end'), nullable=False)
+    
+    product = db.relationship('Product', lazy=True)
+    from_location_obj = db.relationship('Location', foreign_keys=[from_location], lazy=True)
+    to_location_obj = db.relationship('Location', foreign_keys=[to_location], lazy=True)
+    
+    movement_type = ProductMovement.movement_type
+    
+    def __repr__(self):
+        return f'<ArchivedMovement {self.movement_id}: {self.qty} x {self.product_id}>'
+
+class ReorderThreshold(db.Model):
+    """Reorder point of a product at a location; stock at or below it raises an alert"""
+    __tablename__ = 'reorder_thresholds'
+    
+    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), primary_key=True)
+    location_id = db.Column(db.String(50), db.ForeignKey('locations.location_id'), primary_key=True)
+    reorder_point = db.Column(db.Integer, nullable=False)
+    
+    product = db.relationship('Product', lazy=True)
+    location = db.relationship('Location', lazy=True)
+    
+    def __repr__(self):
+        return f'<ReorderThreshold {self.product_id}@{self.location_id}: {self.reorder_point}>'
+
+class StockAlert(db.Model):
+    """A (product, location) whose balance is at or below its reorder point; see alerts.py"""
+    __tablename__ = 'stock_alerts'
+    
+    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), primary_key=True)
+    location_id = db.Column(db.String(50), db.ForeignKey('locations.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False)
+    reorder_point = db.Column(db.Integer, nullable=False)
+    raised_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StockAlert {self.product_id}@{self.location_id}: {self.qty} <= {self.reorder_point}>'
+
+class Job(db.Model):
+    """A report, export or recomputation run in the background; see jobs.py"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Deduplication lookups and the jobs list
+        db.Index('ix_jobs_key_created_at', 'key', 'created_at'),
+        db.Index('ix_jobs_created_at', 'created_at'),
+        # Results still valid for reuse, expired by ledger writes
+        db.Index('ix_jobs_expired_at', 'expired_at'),
+    )
+    
+    job_id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    key = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Float, nullable=False, default=0.0)
+    message = db.Column(db.Text)
+    result = db.Column(db.Text)
+    result_path = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expired_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Job {self.job_id}: {self.kind} {self.status}>'
+
+class StockBalance(db.Model):
+    __tablename__ = 'stock_balances'
+    
+    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), primary_key=True)
+    location_id = db.Column(db.String(50), db.ForeignKey('locations.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    
+    product = db.relationship('Product', lazy=True)
+    location = db.relationship('Location', lazy=True)
+    
+    def __repr__(self):
+        return f'<StockBalance {self.product_id}@{self.location_id}: {self.qty}>'
+
+class ProductDailyFlow(db.Model):
+    """Units of a product moved into and out of a location on one (UTC) day; see history.py"""
+    __tablename__ = 'product_daily_flows'
+    
+    product_id = db.Column(db.String(50), primary_key=True)
+    location_id = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    qty_in = db.Column(db.Integer, nullable=False, default=0)
+    qty_out = db.Column(db.Integer, nullable=False, default=0)
+    moves_in = db.Column(db.Integer, nullable=False, default=0)
+    moves_out = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ProductDailyFlow {self.product_id}@{self.location_id} {self.day}: +{self.qty_in} -{self.qty_out}>'
+
+class LocationDailyFlow(db.Model):
+    """Units of all products moved into and out of a location on one (UTC) day; see history.py"""
+    __tablename__ = 'location_daily_flows'
+    
+    location_id = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    qty_in = db.Column(db.Integer, nullable=False, default=0)
+    qty_out = db.Column(db.Integer, nullable=False, default=0)
+    moves_in = db.Column(db.Integer, nullable=False, default=0)
+    moves_out = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<LocationDailyFlow {self.location_id} {self.day}: +{self.qty_in} -{self.qty_out}>'
+
+class BalanceCheckpoint(db.Model):
+    """A point in time for which balances have been snapshotted"""
+    __tablename__ = 'balance_checkpoints'
+    
+    as_of = db.Column(db.DateTime, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<BalanceCheckpoint {self.as_of}: {self.row_count} rows>'
+
+class BalanceSnapshot(db.Model):
+    """Balance of a product at a location from all movements before a checkpoint"""
+    __tablename__ = 'balance_snapshots'
+    
+    as_of = db.Column(db.DateTime, db.ForeignKey('balance_checkpoints.as_of'), primary_key=True)
+    product_id = db.Column(db.String(50), primary_key=True)
+    location_id = db.Column(db.String(50), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.as_of} {self.product_id}@{self.location_id}: {self.qty}>'
@@ -0,0 +1,143 @@
+"""Keyset (cursor) pagination.
+
+``paginate()`` pages with COUNT(*) plus OFFSET, so page N costs O(N * per_page).
+Keyset pagination instead continues from the sort key of the last row seen
+(``WHERE (ts, id) < (:ts, :id) ORDER BY ts DESC, id DESC LIMIT n``), which an
+index on (ts, id) answers in the same time for any depth. Cursors are opaque
+URL-safe tokens encoding that key.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+
+from sqlalchemy import text, tuple_
+
+from models import db
+
+COUNT_MODES = ('none', 'approx', 'exact')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token can't be decoded"""
+
+
+def encode_cursor(direction: str, values: Sequence) -> str:
+    """Encode a page direction ('n' or 'p') and sort key into an opaque token"""
+    payload = [direction] + [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str, columns: Sequence) -> tuple:
+    """Decode a token into (direction, key values), restoring datetime columns"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        direction, values = payload[0], payload[1:]
+        if direction not in ('n', 'p') or len(values) != len(columns):
+            raise ValueError('wrong cursor shape')
+        values = [datetime.fromisoformat(v) if v is not None and _is_datetime(col) else v
+                  for v, col in zip(values, columns)]
+    except (ValueError, TypeError, IndexError) as e:
+        raise InvalidCursor(str(e))
+    return direction, values
+
+
+def _is_datetime(column) -> bool:
+    try:
+        return column.type.python_type is datetime
+    except NotImplementedError:
+        return False
+
+
+def approximate_count(table) -> Optional[int]:
+    """Cheap row-count estimate for a whole table, or None if the backend has none.
+    On SQLite this is MAX(rowid), which is exact until rows are deleted.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return db.session.execute(text(f'SELECT MAX(rowid) FROM {table.name}')).scalar() or 0
+    if dialect == 'postgresql':
+        estimate = db.session.execute(
+            text('SELECT reltuples FROM pg_class WHERE relname = :name'), {'name': table.name}
+        ).scalar()
+        return int(estimate) if estimate is not None and estimate >= 0 else None
+    return None
+
+
+class KeysetPagination:
+    """A page of results fetched by cursor.
+    Exposes the parts of Flask-SQLAlchemy's Pagination the templates use
+    (items, per_page, has_next, has_prev, total) plus next/prev cursors.
+    """
+    cursor_mode = True
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def as_dict(self) -> dict:
+        """Paging metadata for JSON responses"""
+        return {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'total': self.total,
+            'total_is_estimate': self.total_is_estimate,
+        }
+
+
+def keyset_paginate(query, columns: Sequence, cursor: Optional[str] = None, per_page: int = 10,
+                    count: str = 'none') -> KeysetPagination:
+    """Fetch one page of query ordered by columns descending, continuing from cursor.
+
+    columns must identify rows uniquely (end with the primary key). count
+    selects how the total is reported: 'none' skips it, 'approx' uses a cheap
+    table-level estimate and 'exact' runs COUNT(*) over the filtered query.
+    """
+    per_page = max(per_page, 1)
+    key = tuple_(*columns)
+    direction, values = decode_cursor(cursor, columns) if cursor else ('n', None)
+
+    total = None
+    total_is_estimate = False
+    if count == 'exact':
+        total = query.order_by(None).count()
+    elif count == 'approx' and query.whereclause is None:
+        total = approximate_count(columns[0].expression.table)
+        total_is_estimate = total is not None
+
+    if direction == 'n':
+        page_query = query.order_by(*[c.desc() for c in columns])
+        if values:
+            page_query = page_query.filter(key < tuple_(*values))
+    else:
+        page_query = query.order_by(*[c.asc() for c in columns]).filter(key > tuple_(*values))
+
+    rows = page_query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'p':
+        rows.reverse()
+
+    def key_of(item):
+        return [getattr(item, c.key) for c in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if (direction == 'n' and more) or direction == 'p':
+            next_cursor = encode_cursor('n', key_of(rows[-1]))
+        if (direction == 'p' and more) or (direction == 'n' and values):
+            prev_cursor = encode_cursor('p', key_of(rows[0]))
+    return KeysetPagination(rows, per_page, next_cursor, prev_cursor, total, total_is_estimate)
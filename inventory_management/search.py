@@ -0,0 +1,139 @@
+"""Full-text search for the product, location and movement lists.
+
+On SQLite builds with FTS5, each searchable table gets an external-content
+FTS5 index (``<name>_fts``) keyed by the table's rowid. SQL triggers keep it
+in sync on INSERT, UPDATE and DELETE, so every write path (forms, bulk
+ingestion, raw SQL) is covered without application code. Queries use prefix
+matching per term and bm25 ranking. Elsewhere (other databases, or SQLite
+without FTS5) searches fall back to the original ILIKE scans.
+
+Whether a database has the FTS tables is looked up once per engine by
+``init_search`` at start-up (and recorded by ``install_search_index``), so
+requests never pay for the schema inspection.
+
+The tables are keyed by implicit rowids, which VACUUM may renumber; run
+``flask rebuild-search`` after a VACUUM.
+"""
+import re
+from typing import Optional
+
+from sqlalchemy import column, inspect, literal_column, or_, select, table, text
+
+from models import db
+
+# Searchable columns per table, and the FTS table indexing them
+SEARCH_INDEXES = {
+    'products': ('products_fts', ['product_id', 'name', 'description']),
+    'locations': ('locations_fts', ['location_id', 'name', 'address']),
+    'product_movements': ('movements_fts', ['movement_id', 'product_id', 'notes']),
+}
+
+# Database URL -> whether its FTS tables are installed; the replica of a
+# SQLite database is the same file, so it shares the primary's entry
+_enabled = {}
+
+
+def fts5_supported(engine) -> bool:
+    """True if the database is SQLite compiled with FTS5"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        options = {row[0] for row in conn.exec_driver_sql('PRAGMA compile_options')}
+    return 'ENABLE_FTS5' in options
+
+
+def _ddl(source: str, fts: str, columns: list) -> list:
+    cols = ', '.join(columns)
+    new_values = ', '.join(f'new.{c}' for c in columns)
+    old_values = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{source}', content_rowid='rowid')",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN
+            INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {source} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_values});
+        END""",
+    ]
+
+
+def install_search_index(engine) -> bool:
+    """Create the FTS tables and sync triggers if supported, indexing existing rows.
+    Returns True if full-text search is available afterwards.
+    """
+    if not fts5_supported(engine):
+        _enabled[engine.url] = False
+        return False
+    existing = set(inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        for source, (fts, columns) in SEARCH_INDEXES.items():
+            created = fts not in existing
+            for statement in _ddl(source, fts, columns):
+                conn.exec_driver_sql(statement)
+            if created:
+                conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    _enabled[engine.url] = True
+    return True
+
+
+def rebuild_search_index(engine) -> None:
+    """Re-index every searchable table from its content table"""
+    with engine.begin() as conn:
+        for fts, _ in SEARCH_INDEXES.values():
+            conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def init_search(app, db) -> None:
+    """Record which of the app's databases have the FTS tables, outside any request"""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.url not in _enabled:
+                _enabled[engine.url] = engine.dialect.name == 'sqlite' and inspect(engine).has_table('products_fts')
+
+
+def search_enabled() -> bool:
+    """True if the current database has the FTS tables installed"""
+    return _enabled.get(db.session.get_bind().url, False)
+
+
+def match_expression(q: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching every term as a prefix"""
+    terms = [t for t in re.split(r'\s+', q.strip()) if t]
+    if not terms:
+        return None
+    return ' '.join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+
+
+def _fts_table(model):
+    fts, _ = SEARCH_INDEXES[model.__tablename__]
+    return table(fts, column('rowid'), column('rank'))
+
+
+def _match(model, q: str, purpose: str):
+    fts = _fts_table(model)
+    param = f'{fts.name}_{purpose}'
+    return fts, text(f'{fts.name} MATCH :{param}').bindparams(**{param: match_expression(q)})
+
+
+def search_filter(model, q: str):
+    """Boolean clause restricting model's rows to those matching q"""
+    if search_enabled() and match_expression(q):
+        fts, match = _match(model, q, 'filter')
+        rowid = literal_column(f'{model.__tablename__}.rowid')
+        return rowid.in_(select(fts.c.rowid).where(match))
+    like = f'%{q}%'
+    _, columns = SEARCH_INDEXES[model.__tablename__]
+    return or_(*[getattr(model, c).ilike(like) for c in columns])
+
+
+def search_rank(model, q: str):
+    """ORDER BY expression putting the best matches first (bm25), or None without FTS"""
+    if not (search_enabled() and match_expression(q)):
+        return None
+    fts, match = _match(model, q, 'rank')
+    rowid = literal_column(f'{model.__tablename__}.rowid')
+    return select(fts.c.rank).where(match).where(fts.c.rowid == rowid).scalar_subquery()
@@ -0,0 +1,132 @@
+"""Point-in-time balance snapshots.
+
+A checkpoint stores every non-zero (product, location) balance computed from
+all movements before its ``as_of`` instant. Balances "as of T" are answered by
+loading the nearest checkpoint at or before T and adding only the movements
+in [checkpoint, T), so historical queries cost O(movements since checkpoint)
+instead of a replay of the whole ledger. Each new checkpoint is itself built
+incrementally from the previous one.
+
+"As of T" always means "from movements with timestamp < T". A bare date
+means the end of that day. Stored timestamps are naive UTC, so instants given
+with a UTC offset are converted to that.
+
+Checkpoints are only valid while the history before them doesn't change.
+Writes that touch a movement at or before a checkpoint must call
+``invalidate_snapshots`` so those checkpoints are discarded.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import func, literal, select
+
+from balances import ledger_balances_select, ledger_source
+from models import db, BalanceCheckpoint, BalanceSnapshot, ProductMovement
+
+checkpoints_table = BalanceCheckpoint.__table__
+snapshots_table = BalanceSnapshot.__table__
+movements_table = ProductMovement.__table__
+
+
+def parse_datetime(value: str) -> datetime:
+    """Parse an ISO date/time as naive UTC, converting a UTC offset if it has one"""
+    parsed = datetime.fromisoformat(value.strip())
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_as_of(value: str) -> datetime:
+    """Parse an ISO date or date/time as naive UTC. A bare date means the end of that day."""
+    value = value.strip()
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), time()) + timedelta(days=1)
+    return parse_datetime(value)
+
+
+def nearest_checkpoint(as_of: datetime) -> Optional[datetime]:
+    """The latest checkpoint at or before as_of, if any"""
+    return db.session.execute(
+        select(func.max(checkpoints_table.c.as_of)).where(checkpoints_table.c.as_of <= as_of)
+    ).scalar()
+
+
+def balances_as_of_select(as_of: datetime):
+    """SELECT of (product_id, location_id, qty) as of the given instant"""
+    checkpoint = nearest_checkpoint(as_of)
+    opening = None
+    if checkpoint is not None:
+        s = snapshots_table
+        opening = select(s.c.product_id, s.c.location_id, s.c.qty).where(s.c.as_of == checkpoint)
+    return ledger_balances_select(since=checkpoint, until=as_of, opening=opening)
+
+
+def stock_as_of(product_id: str, location_id: str, as_of: datetime) -> int:
+    """Stock of a product at a location as of the given instant"""
+    checkpoint = nearest_checkpoint(as_of)
+    qty = 0
+    if checkpoint is not None:
+        s = snapshots_table
+        qty = db.session.execute(
+            select(s.c.qty).where(s.c.as_of == checkpoint, s.c.product_id == product_id,
+                                  s.c.location_id == location_id)
+        ).scalar() or 0
+
+    m = ledger_source(checkpoint, as_of)
+    for location_column, sign in ((m.c.to_location, 1), (m.c.from_location, -1)):
+        stmt = select(func.coalesce(func.sum(m.c.qty), 0))\
+            .where(m.c.product_id == product_id, location_column == location_id, m.c.timestamp < as_of)
+        if checkpoint is not None:
+            stmt = stmt.where(m.c.timestamp >= checkpoint)
+        qty += sign * int(db.session.execute(stmt).scalar())
+    return int(qty)
+
+
+def take_snapshot(as_of: datetime) -> int:
+    """Store balances as of the given instant as a checkpoint. Returns the row count."""
+    if as_of > datetime.utcnow():
+        raise ValueError('Cannot snapshot balances in the future')
+    # Replace any existing checkpoint first so it isn't used as its own starting point
+    db.session.execute(snapshots_table.delete().where(snapshots_table.c.as_of == as_of))
+    db.session.execute(checkpoints_table.delete().where(checkpoints_table.c.as_of == as_of))
+    balances = balances_as_of_select(as_of).subquery()
+    db.session.execute(checkpoints_table.insert().values(as_of=as_of, created_at=datetime.utcnow(), row_count=0))
+    db.session.execute(snapshots_table.insert().from_select(
+        ['as_of', 'product_id', 'location_id', 'qty'],
+        select(literal(as_of, db.DateTime), balances.c.product_id, balances.c.location_id, balances.c.qty)
+        .where(balances.c.qty != 0),
+    ))
+    count = db.session.execute(
+        select(func.count()).select_from(snapshots_table).where(snapshots_table.c.as_of == as_of)
+    ).scalar()
+    db.session.execute(checkpoints_table.update().where(checkpoints_table.c.as_of == as_of).values(row_count=count))
+    db.session.commit()
+    return count
+
+
+def take_daily_snapshots(until: Optional[datetime] = None) -> List[datetime]:
+    """Create a midnight checkpoint for every day since the last one (or the first movement).
+    Returns the checkpoints created.
+    """
+    until = until or datetime.utcnow()
+    last = db.session.execute(select(func.max(checkpoints_table.c.as_of))).scalar()
+    if last is None:
+        first = db.session.execute(select(func.min(movements_table.c.timestamp))).scalar()
+        if first is None:
+            return []
+        last = datetime.combine(first.date(), time())
+    day = datetime.combine(last.date(), time()) + timedelta(days=1)
+    created = []
+    while day <= until:
+        take_snapshot(day)
+        created.append(day)
+        day += timedelta(days=1)
+    return created
+
+
+def invalidate_snapshots(since: datetime) -> None:
+    """Discard checkpoints whose history changed, i.e. those after a movement at `since`.
+    Call in the same transaction as the ledger write.
+    """
+    db.session.execute(snapshots_table.delete().where(snapshots_table.c.as_of > since))
+    db.session.execute(checkpoints_table.delete().where(checkpoints_table.c.as_of > since))
@@ -60,13 +60,50 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         }
         
-        fromLocationSelect.addEventListener('change', updateMovementType);
-        toLocationSelect.addEventListener('change', updateMovementType);
+        fromLocationSelect.addEventListener('input', updateMovementType);
+        toLocationSelect.addEventListener('input', updateMovementType);
         
         // Initial call
         updateMovementType();
     }
 
+    // Typeahead pickers: fill each input's datalist from its lookup endpoint as the user types
+    const lookupInputs = document.querySelectorAll('input[data-lookup]');
+    lookupInputs.forEach(function(input) {
+        const datalist = document.getElementById(input.getAttribute('list'));
+        const label = document.querySelector(`[data-lookup-label="${input.id}"]`);
+        const names = {};
+        let timer = null;
+
+        function showLabel() {
+            if (label && input.value in names) {
+                label.textContent = names[input.value];
+            }
+        }
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            showLabel();
+            timer = setTimeout(function() {
+                const url = `${input.dataset.lookup}?q=${encodeURIComponent(input.value)}`;
+                fetch(url)
+                    .then(function(response) { return response.json(); })
+                    .then(function(results) {
+                        datalist.innerHTML = '';
+                        results.forEach(function(result) {
+                            names[result.id] = result.name;
+                            const option = document.createElement('option');
+                            option.value = result.id;
+                            option.textContent = result.name;
+                            datalist.appendChild(option);
+                        });
+                        showLabel();
+                    })
+                    .catch(function() {});
+            }, 150);
+        });
+    });
+
     // Table sorting functionality
     const sortableHeaders = document.querySelectorAll('th[data-sort]');
     sortableHeaders.forEach(function(header) {
@@ -133,16 +170,47 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Auto-refresh for dashboard (every 30 seconds)
-    if (window.location.pathname === '/') {
+    // Auto-refresh for dashboard: poll every 30 seconds and reload only if the data changed
+    const dashboard = document.getElementById('dashboard');
+    if (dashboard) {
+        const etag = `"${dashboard.dataset.etag}"`;
         setInterval(function() {
-            // Only refresh if the page is visible
-            if (!document.hidden) {
-                location.reload();
+            // Only poll if the page is visible
+            if (document.hidden) {
+                return;
             }
+            fetch('/api/dashboard', {headers: {'If-None-Match': etag}, cache: 'no-store'})
+                .then(function(response) {
+                    if (response.status === 200 && response.headers.get('ETag') !== etag) {
+                        location.reload();
+                    }
+                })
+                .catch(function() {});
         }, 30000);
     }
 
+    // Background job page: poll its status every second until it finishes
+    const jobProgress = document.querySelector('[data-job-status]');
+    if (jobProgress) {
+        const bar = jobProgress.querySelector('.progress-bar');
+        const message = jobProgress.querySelector('[data-job-message]');
+        const poll = setInterval(function() {
+            fetch(jobProgress.dataset.jobStatus, {cache: 'no-store'})
+                .then(function(response) { return response.json(); })
+                .then(function(job) {
+                    bar.style.width = Math.round(job.progress * 100) + '%';
+                    if (job.message) {
+                        message.textContent = job.message;
+                    }
+                    if (job.status === 'done' || job.status === 'failed') {
+                        clearInterval(poll);
+                        location.reload();
+                    }
+                })
+                .catch(function() {});
+        }, 1000);
+    }
+
     // Print functionality
     window.printReport = function() {
         window.print();
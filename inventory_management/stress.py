@@ -0,0 +1,170 @@
+"""Concurrency stress test for stock movements.
+
+Seeds a fresh database with one product stocked at a single source location
+and a small pool of shared transfers out of it, then starts several
+processes that each post transfers and outbound movements from that source
+through the movement form as fast as they can, and edit and delete the
+shared transfers in between. Far more stock is requested than exists, so the
+writers race for the last units, and the pool is small, so they race to
+change the same movements too. Afterwards it checks that no balance went
+negative, that the balance table matches the ledger (an edit and a delete
+that both reversed the same stored quantity would break this) and that no
+more stock left the source than was there.
+
+Usage (from the inventory_management directory):
+    python stress.py --workers 8 --movements 200
+    python stress.py --db /tmp/stress.db --stock 500 --shared 5 --json stress.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+PRODUCT = 'STRESS001'
+SOURCE = 'SRC'
+DESTINATIONS = ['DST1', 'DST2', 'DST3']
+
+
+def shared_ids(count: int) -> list:
+    return [f'RACE{number:04d}' for number in range(count)]
+
+
+def setup(stock: int, shared: int) -> None:
+    from app import app, init_db
+    from models import db, Product, Location, ProductMovement
+    from balances import apply_movement
+
+    with app.app_context():
+        init_db()
+        db.session.add(Product(product_id=PRODUCT, name='Stress test product', unit_price=1))
+        for location_id in [SOURCE] + DESTINATIONS:
+            db.session.add(Location(location_id=location_id, name=location_id))
+        opening = ProductMovement(movement_id='STRESS00', product_id=PRODUCT, to_location=SOURCE,
+                                  qty=stock, notes='Opening stock')
+        db.session.add(opening)
+        apply_movement(opening)
+        for movement_id in shared_ids(shared):
+            transfer = ProductMovement(movement_id=movement_id, product_id=PRODUCT, from_location=SOURCE,
+                                       to_location=DESTINATIONS[0], qty=1, notes='Shared by the workers')
+            db.session.add(transfer)
+            apply_movement(transfer)
+        db.session.commit()
+
+
+def worker(args) -> dict:
+    """Post movements out of SOURCE and edit or delete the shared ones; returns counts per outcome"""
+    seed, movements, max_qty, shared = args
+    from app import app
+
+    rng = random.Random(seed)
+    client = app.test_client()
+    pool = shared_ids(shared)
+    outcomes = {'accepted': 0, 'rejected': 0, 'edited': 0, 'deleted': 0, 'conflicts': 0, 'gone': 0, 'errors': 0}
+    for _ in range(movements):
+        qty = rng.randint(1, max_qty)
+        # One in four movements leaves the system entirely
+        to_location = rng.choice(DESTINATIONS) if rng.random() >= 0.25 else ''
+        form = {'product_id': PRODUCT, 'from_location': SOURCE, 'to_location': to_location, 'qty': qty,
+                'notes': 'stress'}
+        # Half the requests add movements; the rest edit or delete a shared one
+        action = rng.choice(['add', 'add', 'edit', 'delete']) if pool else 'add'
+        if action == 'add':
+            path = '/movements/add'
+        else:
+            path = f'/movements/{action}/{rng.choice(pool)}'
+        try:
+            response = client.post(path, data=form if action != 'delete' else None)
+            with client.session_transaction() as session:
+                flashes = session.pop('_flashes', [])
+        except Exception:
+            outcomes['errors'] += 1
+            continue
+        if response.status_code == 302:
+            # An edit or delete that lost the race redirects with an error message
+            failed = any(category == 'error' for category, _ in flashes)
+            if failed:
+                outcomes['conflicts'] += 1
+            else:
+                outcomes[{'add': 'accepted', 'edit': 'edited', 'delete': 'deleted'}[action]] += 1
+        elif response.status_code == 200:
+            outcomes['rejected'] += 1
+        elif response.status_code == 404:
+            outcomes['gone'] += 1  # deleted by another worker
+        else:
+            # Typically "database is locked" when SQLite's busy timeout runs out
+            outcomes['errors'] += 1
+    return outcomes
+
+
+def check(stock: int) -> dict:
+    from sqlalchemy import func
+    from app import app
+    from models import db, ProductMovement, StockBalance
+    from balances import get_balance, verify_balances
+
+    with app.app_context():
+        negative = [(b.product_id, b.location_id, b.qty)
+                    for b in StockBalance.query.filter(StockBalance.qty < 0)]
+        mismatches = verify_balances()
+        remaining = get_balance(PRODUCT, SOURCE)
+        # Edits and deletes change what left the source, so it is read from the ledger
+        moved = db.session.query(func.coalesce(func.sum(ProductMovement.qty), 0))\
+            .filter(ProductMovement.from_location == SOURCE).scalar()
+        db.session.remove()
+    return {'negative_balances': negative, 'mismatches': mismatches, 'remaining_at_source': remaining,
+            'moved': int(moved), 'opening_stock': stock}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='SQLite file to use (default: a new temporary file)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--movements', type=int, default=200, help='Movements posted by each worker')
+    parser.add_argument('--stock', type=int, default=1000, help='Opening stock at the source')
+    parser.add_argument('--max-qty', type=int, default=10, help='Largest quantity per movement')
+    parser.add_argument('--shared', type=int, default=10, help='Transfers the workers race to edit and delete')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='inventory_stress_'), 'stress.db')
+    if os.path.exists(path):
+        os.remove(path)
+    # Workers import the app after this is set, so they all share the one database
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(path)}'
+
+    setup(args.stock, args.shared)
+    started = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers) as pool:
+        outcomes = pool.map(worker, [(args.seed + i, args.movements, args.max_qty, args.shared)
+                                      for i in range(args.workers)])
+    elapsed = time.perf_counter() - started
+
+    totals = {key: sum(o[key] for o in outcomes) for key in outcomes[0]}
+    results = check(args.stock)
+    results.update(totals, workers=args.workers, elapsed_s=round(elapsed, 3), db=path)
+    ok = (not results['negative_balances'] and not results['mismatches']
+          and results['moved'] + results['remaining_at_source'] == args.stock)
+    results['ok'] = ok
+
+    print(f'{args.workers} workers x {args.movements} movements in {elapsed:.2f}s against {path}')
+    print(f'  accepted: {totals["accepted"]}  rejected (insufficient stock): {totals["rejected"]}'
+          f'  errors (locks etc.): {totals["errors"]}')
+    print(f'  shared movements edited: {totals["edited"]}  deleted: {totals["deleted"]}'
+          f'  conflicts: {totals["conflicts"]}  already deleted: {totals["gone"]}')
+    print(f'  moved {results["moved"]} of {args.stock}; {results["remaining_at_source"]} left at {SOURCE}')
+    print(f'  negative balances: {len(results["negative_balances"])}  ledger mismatches: {len(results["mismatches"])}')
+    print('OK' if ok else 'FAILED')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
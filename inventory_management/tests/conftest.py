@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app binds its engine when imported, so the database must be chosen first
+_db_dir = tempfile.mkdtemp(prefix='inventory-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.pop('DATABASE_REPLICA_URL', None)
+
+from app import app as flask_app, init_db  # noqa: E402
+from cache import get_cache  # noqa: E402
+from models import db, Location, Product  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, JOB_RESULTS_DIR=os.path.join(_db_dir, 'jobs'))
+    with flask_app.app_context():
+        init_db()
+        yield flask_app
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        get_cache().clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def catalog(app):
+    """Two products and two locations"""
+    db.session.add_all([
+        Product(product_id='P1', name='Widget'),
+        Product(product_id='P2', name='Gadget'),
+        Location(location_id='L1', name='Warehouse'),
+        Location(location_id='L2', name='Shop'),
+    ])
+    db.session.commit()
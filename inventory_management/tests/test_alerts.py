@@ -0,0 +1,75 @@
+import pytest
+
+from alerts import set_reorder_point
+from models import db, ProductMovement, ReorderThreshold, StockAlert
+
+
+def low_stock(client):
+    return client.get('/api/dashboard').get_json()['low_stock']
+
+
+def test_catalog_import_refreshes_cached_alert_names(client, catalog):
+    set_reorder_point('P1', 'L1', 5)
+    db.session.commit()
+    assert low_stock(client)['alerts'][0]['product_name'] == 'Widget'
+
+    response = client.post('/api/products/import?format=ndjson', data='{"product_id": "P1", "name": "Sprocket"}\n')
+    assert response.get_json()['updated'] == 1
+    assert low_stock(client)['alerts'][0]['product_name'] == 'Sprocket'
+
+
+def test_rebuild_job_refreshes_cached_alerts(app, client, catalog):
+    assert low_stock(client)['count'] == 0
+    # A threshold written behind the alert maintenance, as a rebuild would repair
+    db.session.add(ReorderThreshold(product_id='P2', location_id='L2', reorder_point=3))
+    db.session.commit()
+    runner = app.extensions['jobs']
+    app.extensions['jobs'] = None
+    try:
+        assert client.post('/api/jobs', json={'kind': 'rebuild_balances'}).get_json()['status'] == 'done'
+    finally:
+        app.extensions['jobs'] = runner
+    assert low_stock(client)['count'] == 1
+
+
+def alerts() -> dict:
+    return {(a.product_id, a.location_id): a.qty for a in StockAlert.query}
+
+
+@pytest.mark.parametrize('form', [
+    {'product_id': 'P1', 'location_id': '', 'reorder_point': '3'},
+    {'product_id': 'P1', 'location_id': '  ', 'reorder_point': '3'},
+    {'product_id': '', 'location_id': 'L1', 'reorder_point': '3'},
+    {'product_id': 'P1', 'reorder_point': '3'},
+    {'product_id': 'P1', 'location_id': 'L9', 'reorder_point': '3'},
+])
+def test_threshold_needs_a_known_product_and_location(client, catalog, form):
+    assert client.post('/alerts/thresholds', data=form).status_code == 302
+    assert ReorderThreshold.query.count() == 0
+
+
+def test_movement_writes_refresh_only_the_pairs_they_touch(client, catalog):
+    set_reorder_point('P1', 'L1', 5)
+    set_reorder_point('P1', 'L2', 5)
+    # Written behind the alert maintenance: only a re-evaluation of P2@L1 would raise it
+    db.session.add(ReorderThreshold(product_id='P2', location_id='L1', reorder_point=3))
+    db.session.commit()
+    assert alerts() == {('P1', 'L1'): 0, ('P1', 'L2'): 0}
+
+    assert client.post('/movements/add', data={'product_id': 'P1', 'to_location': 'L1', 'qty': '10'}).status_code == 302
+    assert alerts() == {('P1', 'L2'): 0}
+    movement_id = ProductMovement.query.one().movement_id
+
+    response = client.post(f'/movements/edit/{movement_id}', data={'product_id': 'P1', 'to_location': 'L2', 'qty': '4'})
+    assert response.status_code == 302
+    assert alerts() == {('P1', 'L1'): 0, ('P1', 'L2'): 4}
+
+    assert client.post(f'/movements/delete/{movement_id}').status_code == 302
+    assert alerts() == {('P1', 'L1'): 0, ('P1', 'L2'): 0}
+
+    response = client.post('/api/movements/bulk', json=[
+        {'product_id': 'P1', 'to_location': 'L2', 'qty': 9},
+        {'product_id': 'P2', 'to_location': 'L2', 'qty': 1},
+    ])
+    assert response.get_json()['inserted'] == 2
+    assert alerts() == {('P1', 'L1'): 0}
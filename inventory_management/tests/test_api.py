@@ -0,0 +1,73 @@
+import gzip
+import json
+
+import pytest
+
+import api
+from bulk import ingest_movements
+from models import db, Product
+
+
+@pytest.fixture
+def ledger(catalog):
+    rows = [{'movement_id': f'M{i:02d}', 'product_id': 'P1', 'to_location': 'L1', 'qty': i + 1,
+             'notes': 'x' * 40, 'timestamp': f'2024-01-{i + 1:02d}T00:00:00'} for i in range(25)]
+    assert ingest_movements(rows)['inserted'] == 25
+
+
+def test_fields_select_and_order_the_output(client, ledger):
+    response = client.get('/api/v1/movements?fields=qty,movement_id&limit=2')
+    assert response.status_code == 200
+    assert response.get_json()['data'] == [{'qty': 25, 'movement_id': 'M24'}, {'qty': 24, 'movement_id': 'M23'}]
+    assert list(response.get_json()['data'][0]) == ['qty', 'movement_id']
+    assert client.get('/api/v1/products/P1?fields=name').get_json() == {'data': {'name': 'Widget'}}
+
+    response = client.get('/api/v1/movements?fields=qty,colour')
+    assert response.status_code == 400
+    assert 'colour' in response.get_json()['error']
+
+
+def test_cursor_walks_the_whole_list(client, ledger):
+    seen = []
+    url = '/api/v1/movements?fields=movement_id&limit=10&count=exact'
+    while url:
+        body = client.get(url).get_json()
+        assert body['paging']['total'] == 25
+        seen += [row['movement_id'] for row in body['data']]
+        cursor = body['paging']['next_cursor']
+        url = f'/api/v1/movements?fields=movement_id&limit=10&count=exact&cursor={cursor}' if cursor else None
+    assert seen == [f'M{i:02d}' for i in reversed(range(25))]
+
+
+def test_bad_cursor_is_a_bad_request(client, ledger):
+    response = client.get('/api/v1/movements?cursor=garbage')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+    assert client.get('/api/v1/movements?count=lots').status_code == 400
+    assert client.get('/api/v1/widgets').status_code == 404
+
+
+def test_unchanged_responses_are_not_modified(client, ledger):
+    first = client.get('/api/v1/products/P1')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/api/v1/products/P1', headers={'If-None-Match': etag}).status_code == 304
+
+    db.session.get(Product, 'P1').name = 'Sprocket'
+    db.session.commit()
+    changed = client.get('/api/v1/products/P1', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()['data']['name'] == 'Sprocket'
+
+
+def test_large_bodies_are_gzipped(client, ledger, monkeypatch):
+    monkeypatch.setattr(api, 'brotli', None)
+    small = client.get('/api/v1/products/P1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+    plain = client.get('/api/v1/movements')
+    assert len(plain.data) > 1024 and 'Content-Encoding' not in plain.headers
+    response = client.get('/api/v1/movements', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == plain.get_json()
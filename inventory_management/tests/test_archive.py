@@ -0,0 +1,97 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app import app as flask_app, get_stock
+from archive import archive_movements
+from balances import get_balance, verify_balances
+from bulk import ingest_movements
+from ledgercheck import check_ledger
+from models import db, ArchivedMovement, ProductMovement
+
+
+@pytest.fixture
+def archived(app, catalog):
+    """A ledger from January 2024, archived before January 4th"""
+    result = ingest_movements([
+        {'movement_id': 'IN1', 'product_id': 'P1', 'to_location': 'L1', 'qty': 10, 'timestamp': '2024-01-01T09:00:00'},
+        {'movement_id': 'IN2', 'product_id': 'P2', 'to_location': 'L2', 'qty': 5, 'timestamp': '2024-01-02T09:00:00'},
+        {'movement_id': 'MOVE', 'product_id': 'P1', 'from_location': 'L1', 'to_location': 'L2', 'qty': 3,
+         'timestamp': '2024-01-03T09:00:00'},
+        {'movement_id': 'OUT', 'product_id': 'P2', 'from_location': 'L2', 'qty': 5, 'timestamp': '2024-01-04T09:00:00'},
+        {'movement_id': 'IN3', 'product_id': 'P1', 'to_location': 'L1', 'qty': 4, 'timestamp': '2024-01-05T09:00:00'},
+    ])
+    assert result['errors'] == []
+    # The offset is converted: 05:00 at UTC+5 is midnight UTC
+    result = flask_app.test_cli_runner().invoke(args=['archive-movements', '--before', '2024-01-04T05:00:00+05:00'])
+    assert result.exit_code == 0, result.output
+    assert 'Archived 3 movements before 2024-01-04 00:00:00 into 3 opening balances' in result.output
+
+
+def test_balances_and_checks_agree_after_archiving(archived):
+    assert ArchivedMovement.query.count() == 3
+    assert sorted(m.movement_id for m in ProductMovement.query if not m.movement_id.startswith('OB-')) \
+        == ['IN3', 'OUT']
+    assert [get_stock('P1', 'L1'), get_stock('P1', 'L2'), get_stock('P2', 'L2')] == [11, 3, 0]
+    assert verify_balances() == []
+    result = check_ledger(db.engine.url.render_as_string(hide_password=False), workers=1)
+    assert result['issues'] == []
+    assert flask_app.test_cli_runner().invoke(args=['verify-balances']).exit_code == 0
+
+
+def test_as_of_before_the_cutoff_reads_the_archive(client, archived):
+    assert get_stock('P1', 'L1', datetime(2024, 1, 2)) == 10
+    assert get_stock('P1', 'L1', datetime(2024, 1, 3, 12)) == 7
+    assert get_stock('P1', 'L1', datetime(2024, 1, 6)) == 11
+    response = client.get('/reports/balance.ndjson?as_of=2024-01-02')
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [(row['product_id'], row['location_id'], row['qty']) for row in rows] == [('P2', 'L2', 5), ('P1', 'L1', 10)]
+
+
+def test_closed_period_is_read_only(client, archived):
+    opening = ProductMovement.query.filter(ProductMovement.movement_id.startswith('OB-')).first()
+    response = client.post(f'/movements/edit/{opening.movement_id}',
+                           data={'product_id': opening.product_id, 'to_location': 'L1', 'qty': '1'})
+    assert response.status_code == 302
+    assert client.post(f'/movements/delete/{opening.movement_id}').status_code == 302
+    # Archived movements are no longer in the live ledger at all
+    assert client.post('/movements/edit/MOVE', data={'product_id': 'P1', 'to_location': 'L1', 'qty': '1'}) \
+        .status_code == 404
+    assert client.post('/movements/delete/MOVE').status_code == 404
+
+    result = ingest_movements([
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'timestamp': '2024-01-03T23:59:59'},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'timestamp': '2024-01-04T00:00:00'},
+    ])
+    assert result['inserted'] == 1
+    assert [e['row'] for e in result['errors']] == [0]
+    assert 'archived period' in result['errors'][0]['error']
+
+    db.session.rollback()
+    assert db.session.get(ProductMovement, opening.movement_id).qty == opening.qty
+    assert get_balance('P1', 'L1') == 12
+    assert verify_balances() == []
+
+
+def test_earlier_cutoff_is_rejected(archived):
+    with pytest.raises(ValueError, match='already archived'):
+        archive_movements(datetime(2024, 1, 2))
+    result = flask_app.test_cli_runner().invoke(args=['archive-movements', '--before', '2024-01-04'])
+    assert result.exit_code == 1
+    assert 'already archived' in result.output
+    assert ArchivedMovement.query.count() == 3
+
+
+@pytest.mark.parametrize('url', ['/movements', '/products/view/P1', '/locations/view/L1'])
+def test_movement_lists_say_older_movements_are_archived(client, archived, url):
+    assert b'Movements before 2024-01-04 00:00 are archived' in client.get(url).data
+
+
+def test_api_movement_list_gives_the_archive_cutoff(client, archived):
+    assert client.get('/api/v1/movements').get_json()['archived_before'] == '2024-01-04T00:00:00'
+
+
+def test_no_archive_notice_without_an_archive(client, catalog):
+    assert b'are archived' not in client.get('/movements').data
+    assert client.get('/api/v1/movements').get_json()['archived_before'] is None
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import update
+
+from app import app as flask_app
+from balances import get_balance, verify_balances
+from models import db, ProductMovement, StockBalance
+
+
+@pytest.fixture
+def moved(client, catalog):
+    """10 units of P1 into L1, 8 of them transferred on to L2; returns the two movement IDs"""
+    for data in ({'product_id': 'P1', 'to_location': 'L1', 'qty': '10', 'notes': 'in'},
+                 {'product_id': 'P1', 'from_location': 'L1', 'to_location': 'L2', 'qty': '8', 'notes': 'on'}):
+        assert client.post('/movements/add', data=data).status_code == 302
+    return {m.notes: m.movement_id for m in ProductMovement.query}
+
+
+def balances() -> tuple:
+    return get_balance('P1', 'L1'), get_balance('P1', 'L2')
+
+
+def test_add_checks_stock_at_the_source(client, moved):
+    response = client.post('/movements/add', data={'product_id': 'P1', 'from_location': 'L1', 'qty': '3'})
+    assert b'Insufficient stock at source location. Available: 2, Requested: 3' in response.data
+    assert client.post('/movements/add', data={'product_id': 'P1', 'from_location': 'L1', 'qty': '2'}) \
+        .status_code == 302
+    assert balances() == (0, 8)
+    assert ProductMovement.query.count() == 3
+
+
+def test_edit_checks_stock_already_moved_on(client, moved):
+    response = client.post(f"/movements/edit/{moved['in']}", data={'product_id': 'P1', 'to_location': 'L1', 'qty': '5'})
+    assert b'Stock of P1 at L1 would become negative (short by 3)' in response.data
+    db.session.rollback()
+    assert balances() == (2, 8)
+    assert db.session.get(ProductMovement, moved['in']).qty == 10
+
+
+def test_delete_checks_stock_already_moved_on(client, moved):
+    assert client.post(f"/movements/delete/{moved['in']}").status_code == 302
+    assert db.session.get(ProductMovement, moved['in']) is not None
+    assert client.post(f"/movements/delete/{moved['on']}").status_code == 302
+    assert balances() == (10, 0)
+    assert client.post(f"/movements/delete/{moved['in']}").status_code == 302
+    assert balances() == (0, 0)
+    assert verify_balances() == []
+
+
+def test_verify_and_rebuild_balances(app, moved):
+    runner = flask_app.test_cli_runner()
+    assert runner.invoke(args=['verify-balances']).exit_code == 0
+    db.session.execute(update(StockBalance.__table__).where(StockBalance.location_id == 'L2').values(qty=5))
+    db.session.commit()
+
+    result = runner.invoke(args=['verify-balances'])
+    assert result.exit_code == 1
+    assert 'P1 @ L2: expected 8, found 5' in result.output
+    assert verify_balances() == [{'product_id': 'P1', 'location_id': 'L2', 'expected': 8, 'actual': 5}]
+
+    result = runner.invoke(args=['rebuild-balances'])
+    assert 'Rebuilt 2 balance rows.' in result.output
+    assert balances() == (2, 8)
+    assert runner.invoke(args=['verify-balances']).exit_code == 0
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from bulk import ingest_movements
+from models import db, ProductMovement
+
+
+def test_offset_timestamps_are_stored_as_utc(catalog):
+    result = ingest_movements([
+        {'movement_id': 'AWARE', 'product_id': 'P1', 'to_location': 'L1', 'qty': 5,
+         'timestamp': '2024-03-01T12:00:00+05:00'},
+        {'movement_id': 'NAIVE', 'product_id': 'P1', 'to_location': 'L1', 'qty': 5,
+         'timestamp': '2024-03-01T12:00:00'},
+    ])
+    db.session.commit()
+    assert result['errors'] == []
+    assert db.session.get(ProductMovement, 'AWARE').timestamp == datetime(2024, 3, 1, 7, 0)
+    assert db.session.get(ProductMovement, 'NAIVE').timestamp == datetime(2024, 3, 1, 12, 0)
+
+
+def test_non_integral_qty_is_rejected(catalog):
+    result = ingest_movements([
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1.7},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': '2.5'},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': True},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 3.0},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': '4'},
+    ])
+    db.session.commit()
+    assert result['inserted'] == 2
+    assert result['errors'] == [{'row': row, 'error': 'qty must be an integer'} for row in (0, 1, 2)]
+    assert sorted(m.qty for m in ProductMovement.query) == [3, 4]
+
+
+def test_notes_must_be_text(catalog):
+    result = ingest_movements([
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'notes': {'po': 7}},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'notes': ['a']},
+        {'movement_id': 'NUMBER', 'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'notes': 42},
+        {'movement_id': 'MISSING', 'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'notes': None},
+    ])
+    db.session.commit()
+    assert result['errors'] == [{'row': row, 'error': 'notes must be a string'} for row in (0, 1)]
+    assert db.session.get(ProductMovement, 'NUMBER').notes == '42'
+    assert db.session.get(ProductMovement, 'MISSING').notes == ''
+
+
+def test_bulk_endpoint_reports_bad_rows(client, catalog):
+    response = client.post('/api/movements/bulk', json=[
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 2, 'timestamp': '2024-03-01T00:00:00-04:00'},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1.5},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'notes': {'x': 1}},
+    ])
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 1
+    assert [e['row'] for e in response.get_json()['errors']] == [1, 2]
+
+
+def test_balances_are_written_in_key_order(catalog):
+    ingest_movements([{'product_id': p, 'to_location': l, 'qty': 10} for p in ('P1', 'P2') for l in ('L1', 'L2')])
+    db.session.commit()
+    written = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(('INSERT INTO stock_balances', 'UPDATE stock_balances')):
+            written.extend(tuple(value for value in params if isinstance(value, str))
+                           for params in (parameters if executemany else [parameters]))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        result = ingest_movements([
+            {'product_id': 'P2', 'from_location': 'L1', 'to_location': 'L2', 'qty': 1},
+            {'product_id': 'P1', 'from_location': 'L1', 'to_location': 'L2', 'qty': 1},
+        ])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    db.session.commit()
+    assert result['inserted'] == 2
+    # Debits and credits interleaved by (product, location), not credits first
+    assert written == [('P1', 'L1'), ('P1', 'L2'), ('P2', 'L1'), ('P2', 'L2')]
+
+
+def test_qty_beyond_the_column_range_is_rejected(client, catalog):
+    response = client.post('/api/movements/bulk', json=[
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 99999999999999999999},
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 2 ** 31 - 1},
+    ])
+    assert response.get_json()['errors'] == [{'row': 0, 'error': 'qty is too large'}]
+    assert response.get_json()['inserted'] == 1
@@ -0,0 +1,18 @@
+from cache import Cache, MemoryBackend
+
+
+def test_recomputed_value_moves_last_modified():
+    cache = Cache(MemoryBackend(), ttl=60)
+    values = iter([1, 1, 2])
+    cache.get_or_set('count', lambda: next(values))
+    first = cache.last_modified('count')
+
+    # Expired by TTL rather than invalidated, e.g. after a write from another process
+    cache.backend.clear()
+    cache._changed['count'] = first.replace(year=first.year - 1)
+    cache.get_or_set('count', lambda: next(values))
+    assert cache.last_modified('count').year == first.year - 1  # same value: unchanged
+
+    cache.backend.clear()
+    assert cache.get_or_set('count', lambda: next(values)) == 2
+    assert cache.last_modified('count') >= first
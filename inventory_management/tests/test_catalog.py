@@ -0,0 +1,54 @@
+from app import app as flask_app
+from models import db, Location, Product
+
+
+def test_invalid_utf8_is_a_bad_request(client):
+    response = client.post('/api/products/import?format=csv', data=b'product_id,name\nP9,Caf\xe9\n')
+    assert response.status_code == 400
+    assert 'UTF-8' in response.get_json()['error']
+    assert db.session.get(Product, 'P9') is None
+
+
+def test_cli_import_keeps_multiline_csv_fields(app, tmp_path):
+    source = tmp_path / 'products.csv'
+    source.write_bytes('﻿product_id,name,description\r\nP9,Café,"line one\r\nline two"\r\n'.encode())
+    result = flask_app.test_cli_runner().invoke(args=['import-catalog', 'products', str(source)])
+    assert 'Inserted 1, updated 0 products, 0 failed' in result.output
+    product = db.session.get(Product, 'P9')
+    assert (product.name, product.description) == ('Café', 'line one\r\nline two')
+
+
+def test_cli_import_rejects_invalid_utf8(app, tmp_path):
+    source = tmp_path / 'products.csv'
+    source.write_bytes(b'product_id,name\nP9,Caf\xe9\n')
+    result = flask_app.test_cli_runner().invoke(args=['import-catalog', 'products', str(source)])
+    assert result.exit_code == 1
+    assert 'not valid UTF-8' in result.output
+
+
+def test_import_updates_only_the_columns_present(client):
+    db.session.add_all([
+        Product(product_id='P1', name='Widget', description='Blue', unit_price=2.5),
+        Location(location_id='L1', name='Warehouse', address='1 Dock Road', manager='Ann'),
+    ])
+    db.session.commit()
+
+    response = client.post('/api/products/import?format=csv', data=b'product_id,name\nP1,Widget v2\nP2,Gadget\n')
+    assert response.get_json()['inserted'] == 1 and response.get_json()['updated'] == 1
+    response = client.post('/api/locations/import?format=csv', data=b'location_id,name,manager\nL1,Main,\n')
+    assert response.get_json()['updated'] == 1
+
+    db.session.expire_all()
+    p1, p2 = db.session.get(Product, 'P1'), db.session.get(Product, 'P2')
+    assert (p1.name, p1.description, p1.unit_price) == ('Widget v2', 'Blue', 2.5)
+    assert (p2.name, p2.description, p2.unit_price) == ('Gadget', '', 0.0)
+    # An empty cell clears the column; a missing column leaves it alone
+    l1 = db.session.get(Location, 'L1')
+    assert (l1.name, l1.address, l1.manager) == ('Main', '1 Dock Road', '')
+
+
+def test_non_finite_prices_are_rejected(client):
+    response = client.post('/api/products/import?format=csv',
+                           data=b'product_id,name,unit_price\nP1,A,nan\nP2,B,inf\nP3,C,-inf\nP4,D,1.5\n')
+    assert response.get_json()['inserted'] == 1
+    assert response.get_json()['errors'] == [{'row': row, 'error': 'unit_price must be a number'} for row in (0, 1, 2)]
@@ -0,0 +1,61 @@
+from flask import Flask, request
+from sqlalchemy import create_engine, select, text
+
+from database import REPLICA, configure_database, engine_options, init_database
+from models import db, Product
+
+
+def make_app(tmp_path, monkeypatch):
+    """An app with a primary and a replica database, each holding one product named after it"""
+    for name in ('primary', 'replica'):
+        engine = create_engine(f"sqlite:///{tmp_path / name}.db")
+        Product.__table__.create(engine)
+        with engine.begin() as conn:
+            conn.execute(Product.__table__.insert().values(product_id=name, name=name))
+        engine.dispose()
+    monkeypatch.setenv('DATABASE_REPLICA_URL', f"sqlite:///{tmp_path / 'replica'}.db")
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary'}.db",
+                      READ_ONLY_ENDPOINTS={'read'})
+    configure_database(app)
+    db.init_app(app)
+    init_database(app, db)
+
+    @app.route('/read', endpoint='read', methods=['GET', 'POST'])
+    @app.route('/write', endpoint='write', methods=['GET', 'POST'])
+    def handler():
+        if request.method == 'POST':
+            db.session.add(Product(product_id='NEW', name='new'))
+            db.session.flush()
+        names = db.session.execute(select(Product.product_id).order_by(Product.product_id)).scalars().all()
+        db.session.commit()
+        return ','.join(names)
+
+    return app
+
+
+def test_read_only_endpoints_read_from_the_replica(tmp_path, monkeypatch):
+    client = make_app(tmp_path, monkeypatch).test_client()
+    assert client.get('/read').data == b'replica'
+    assert client.get('/write').data == b'primary'
+
+
+def test_flushes_go_to_the_primary(tmp_path, monkeypatch):
+    app = make_app(tmp_path, monkeypatch)
+    client = app.test_client()
+    # The insert is flushed to the primary; the read after it is still served by the replica
+    assert client.post('/read').data == b'replica'
+    with app.app_context():
+        assert db.session.execute(select(Product.product_id).order_by(Product.product_id)).scalars().all() \
+            == ['NEW', 'primary']
+        with db.engines[REPLICA].connect() as conn:
+            assert conn.execute(text('PRAGMA query_only')).scalar() == 1
+
+
+def test_server_databases_get_a_pool():
+    config = {'DB_POOL_SIZE': 5, 'DB_MAX_OVERFLOW': 2, 'DB_POOL_TIMEOUT': 3, 'DB_POOL_RECYCLE': 60}
+    assert engine_options('sqlite:///inventory.db', config) == {}
+    options = engine_options('postgresql://app@db/inventory', config)
+    assert options == {'pool_size': 5, 'max_overflow': 2, 'pool_timeout': 3, 'pool_recycle': 60, 'pool_pre_ping': True}
+    replica = engine_options('postgresql://app@replica/inventory', config, read_only=True)
+    assert replica['connect_args'] == {'options': '-c default_transaction_read_only=on'}
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import exports
+from bulk import ingest_movements
+from models import db, Product
+
+
+@pytest.fixture
+def stocked(catalog):
+    db.session.get(Product, 'P1').unit_price = 2.5
+    result = ingest_movements([
+        {'product_id': 'P1', 'to_location': 'L1', 'qty': 10, 'timestamp': '2024-01-01T09:00:00'},
+        {'product_id': 'P2', 'to_location': 'L2', 'qty': 4, 'timestamp': '2024-01-03T09:00:00'},
+        {'product_id': 'P1', 'from_location': 'L1', 'to_location': 'L2', 'qty': 10, 'timestamp': '2024-01-04T09:00:00'},
+    ])
+    assert result['errors'] == []
+
+
+def test_csv_export(client, stocked):
+    response = client.get('/reports/balance.csv')
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=balance_report.csv'
+    # Zero balances (P1 at L1) are left out; rows are in product and location name order
+    assert response.get_data(as_text=True).splitlines() == [
+        'product_id,product_name,location_id,location_name,qty,unit_price,value',
+        'P2,Gadget,L2,Shop,4,0.0,0.0',
+        'P1,Widget,L2,Shop,10,2.5,25.0',
+    ]
+
+
+def test_ndjson_export_as_of(client, stocked):
+    response = client.get('/reports/balance.ndjson?as_of=2024-01-03')
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in response.data.splitlines()] == [
+        {'product_id': 'P2', 'product_name': 'Gadget', 'location_id': 'L2', 'location_name': 'Shop',
+         'qty': 4, 'unit_price': 0.0, 'value': 0.0},
+        {'product_id': 'P1', 'product_name': 'Widget', 'location_id': 'L1', 'location_name': 'Warehouse',
+         'qty': 10, 'unit_price': 2.5, 'value': 25.0},
+    ]
+
+
+def test_export_rejects_unknown_formats_and_dates(client, stocked):
+    assert client.get('/reports/balance.xlsx').status_code == 404
+    assert client.get('/reports/balance.csv?as_of=yesterday').status_code == 400
+
+
+def test_rows_are_sent_in_chunks(monkeypatch):
+    monkeypatch.setattr(exports, 'CHUNK_ROWS', 2)
+    rows = [(i, f'name {i}') for i in range(5)]
+    chunks = list(exports.iter_csv(['id', 'name'], rows))
+    assert len(chunks) == 3
+    assert ''.join(chunks).splitlines() == ['id,name'] + [f'{i},name {i}' for i in range(5)]
+    chunks = list(exports.iter_ndjson(['id', 'name'], rows))
+    assert [len(chunk.splitlines()) for chunk in chunks] == [2, 2, 1]
+    assert json.loads(chunks[-1]) == {'id': 4, 'name': 'name 4'}
@@ -0,0 +1,58 @@
+import pytest
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from instrumentation import init_metrics
+from models import db
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', **config)
+    db.init_app(app)
+    init_metrics(app, db)
+    return app
+
+
+def test_metrics_are_off_by_default(monkeypatch):
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    client = make_app().test_client()
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics/profile').status_code == 404
+
+
+def test_metrics_can_be_enabled_from_the_environment(monkeypatch):
+    monkeypatch.setenv('METRICS_ENABLED', '1')
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    assert make_app().test_client().get('/metrics').status_code == 200
+
+
+def test_metrics_token_is_required_when_set():
+    client = make_app(METRICS_ENABLED=True, METRICS_TOKEN='s3cret').test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert b'app_requests_total' in response.data
+    assert client.post('/metrics/profile').status_code == 401
+
+
+def test_profile_is_reset_by_post_only():
+    app = make_app(METRICS_ENABLED=True, PROFILE_SAMPLE_RATE=1)
+    client = app.test_client()
+    client.get('/metrics')
+    assert b'profiled requests' in client.get('/metrics/profile?reset=1').data
+    assert b'profiled requests' in client.get('/metrics/profile').data
+    response = client.post('/metrics/profile')
+    assert response.status_code == 200
+    assert b'No requests profiled' in response.data
+
+
+def test_failed_statements_do_not_leak_timers():
+    app = make_app()
+    with app.app_context(), db.engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql('SELECT * FROM missing_table')
+        assert not conn.info.get('query_started')
+        conn.exec_driver_sql('SELECT 1')
+        assert not conn.info.get('query_started')
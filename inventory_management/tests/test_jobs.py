@@ -0,0 +1,81 @@
+import time
+
+import pytest
+from sqlalchemy import select
+
+from jobs import TASKS, submit_job, task
+from models import db, Job
+
+
+@pytest.mark.parametrize('body', [
+    {'kind': 'verify_balances', 'params': [1]},
+    {'kind': 'verify_balances', 'params': 'x'},
+    {'kind': 'balance_summary', 'params': {'as_of': 'soon'}},
+    {'kind': 'nonexistent'},
+    ['verify_balances'],
+])
+def test_invalid_submissions_are_rejected(client, body):
+    response = client.post('/api/jobs', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_job_runs_and_is_reused(app, client):
+    runner = app.extensions['jobs']
+    app.extensions['jobs'] = None
+    try:
+        first = client.post('/api/jobs', json={'kind': 'verify_balances'})
+        second = client.post('/api/jobs', json={'kind': 'verify_balances'})
+    finally:
+        app.extensions['jobs'] = runner
+    assert first.status_code == 202
+    assert first.get_json()['status'] == 'done'
+    assert second.status_code == 200
+    assert second.get_json()['job_id'] == first.get_json()['job_id']
+
+
+def test_silent_job_is_not_taken_over(app):
+    app.config['JOB_STALE_SECONDS'] = 0.2
+    runner = app.extensions['jobs']
+    app.extensions['jobs'] = None
+    seen = {}
+
+    @task('test_sleep')
+    def sleep_job(job):
+        time.sleep(0.3)
+        # Longer than JOB_STALE_SECONDS without progress reports, yet still alive
+        resubmitted, seen['created'] = submit_job('test_sleep')
+        seen['job_id'] = resubmitted.job_id
+        row = db.session.execute(select(Job.__table__).where(Job.job_id == job.job_id)).one()
+        seen['beat'] = row.updated_at > row.started_at
+        return {}
+
+    try:
+        job, created = submit_job('test_sleep')
+    finally:
+        app.extensions['jobs'] = runner
+        app.config['JOB_STALE_SECONDS'] = 600
+        TASKS.pop('test_sleep')
+    assert created and job.status == 'done'
+    assert seen['job_id'] == job.job_id and not seen['created']
+    assert seen['beat']
+
+
+@pytest.mark.parametrize('change', ['edit', 'import'])
+def test_catalog_changes_expire_export_results(app, client, catalog, change):
+    client.post('/movements/add', data={'product_id': 'P1', 'to_location': 'L1', 'qty': '4'})
+    runner = app.extensions['jobs']
+    app.extensions['jobs'] = None
+    try:
+        first = client.post('/api/jobs', json={'kind': 'balance_export'}).get_json()
+        if change == 'edit':
+            client.post('/products/edit/P1', data={'name': 'Widget', 'unit_price': '2.5'})
+        else:
+            client.post('/api/products/import?format=csv', data=b'product_id,name,unit_price\nP1,Widget,2.5\n')
+        second = client.post('/api/jobs', json={'kind': 'balance_export'})
+    finally:
+        app.extensions['jobs'] = runner
+    assert second.status_code == 202
+    assert second.get_json()['job_id'] != first['job_id']
+    with open(db.session.get(Job, second.get_json()['job_id']).result_path) as f:
+        assert 'P1,Widget,L1,Warehouse,4,2.5,10.0' in f.read()
@@ -0,0 +1,75 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+
+from app import app as flask_app
+from balances import rebuild_balances
+from ledgercheck import ISSUE_KINDS, check_ledger
+from models import db, ProductMovement, StockBalance
+
+
+def url() -> str:
+    return db.engine.url.render_as_string(hide_password=False)
+
+
+@pytest.fixture
+def broken(catalog):
+    """One of each kind of issue, written behind the validation of the app"""
+    rows = [
+        ('B1', 'P2', None, 'L2', 4),
+        ('A1', 'P1', None, 'L1', 5),
+        ('A2', 'P1', 'L1', None, 8),  # takes P1@L1 to -3, where it stays
+        ('X1', 'P2', None, None, 1),
+        ('X2', 'P2', 'L2', 'L2', 1),
+        ('X3', 'P2', None, 'L2', 0),
+        ('X4', 'GHOST', None, 'L1', 1),
+        ('X5', 'P2', None, 'NOWHERE', 1),
+    ]
+    db.session.execute(ProductMovement.__table__.insert(), [
+        {'movement_id': movement_id, 'product_id': product_id, 'from_location': source, 'to_location': destination,
+         'qty': qty, 'timestamp': datetime(2024, 1, day)}
+        for day, (movement_id, product_id, source, destination, qty) in enumerate(rows, 1)
+    ])
+    db.session.commit()
+    rebuild_balances()
+    db.session.execute(update(StockBalance.__table__)
+                       .where(StockBalance.product_id == 'P2', StockBalance.location_id == 'L2').values(qty=7))
+    db.session.commit()
+
+
+def test_each_kind_of_issue_is_reported(broken):
+    result = check_ledger(url(), workers=1, ranges=3)
+    assert result['movements'] == 8
+    assert result['counts'] == {kind: 1 for kind in ISSUE_KINDS}
+    issues = {issue['issue']: issue for issue in result['issues']}
+    assert issues['no_locations']['movement_id'] == 'X1'
+    assert issues['same_location']['movement_id'] == 'X2'
+    assert issues['non_positive_qty']['movement_id'] == 'X3'
+    assert issues['unknown_product']['movement_id'] == 'X4'
+    assert (issues['unknown_location']['movement_id'], issues['unknown_location']['location_id']) == ('X5', 'NOWHERE')
+    assert (issues['went_negative']['movement_id'], issues['went_negative']['qty']) == ('A2', -3)
+    assert (issues['negative_balance']['product_id'], issues['negative_balance']['qty']) == ('P1', -3)
+    mismatch = issues['balance_mismatch']
+    assert (mismatch['product_id'], mismatch['location_id'], mismatch['expected'], mismatch['actual']) \
+        == ('P2', 'L2', 4, 7)
+
+
+def test_workers_agree(broken):
+    assert check_ledger(url(), workers=2)['issues'] == check_ledger(url(), workers=1)['issues']
+
+
+def test_command_exit_code_and_report(broken, tmp_path):
+    report = tmp_path / 'issues.ndjson'
+    result = flask_app.test_cli_runner().invoke(args=['check-ledger', '--workers', '1', '--report', str(report)])
+    assert result.exit_code == 1
+    assert 'Checked 8 movements' in result.output
+    assert [json.loads(line)['issue'] for line in report.read_text().splitlines()] == ISSUE_KINDS
+
+
+def test_consistent_ledger_passes(client, catalog):
+    assert client.post('/movements/add', data={'product_id': 'P1', 'to_location': 'L1', 'qty': '3'}).status_code == 302
+    result = flask_app.test_cli_runner().invoke(args=['check-ledger', '--workers', '1'])
+    assert result.exit_code == 0
+    assert 'The ledger and balances are consistent.' in result.output
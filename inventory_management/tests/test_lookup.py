@@ -0,0 +1,29 @@
+from cache import PRODUCT_CHOICES, get_cache
+from lookup import ChoiceIndex, product_index
+
+
+def test_search():
+    index = ChoiceIndex([('B2', 'Blue Widget'), ('A1', 'Red widget'), ('C3', None)])
+    assert [c['id'] for c in index.search('')] == ['A1', 'B2', 'C3']
+    assert [c['id'] for c in index.search('', limit=2)] == ['A1', 'B2']
+    assert [c['id'] for c in index.search('wid')] == ['A1', 'B2']
+    assert [c['id'] for c in index.search('wid bl')] == ['B2']
+    assert index.search('c3') == [{'id': 'C3', 'name': ''}]
+
+
+def test_recomputing_unchanged_choices_keeps_the_index_and_last_modified(client, catalog):
+    cache = get_cache()
+    index = product_index()
+    assert isinstance(cache.backend.get(PRODUCT_CHOICES)[0]['rows'], list)
+    fingerprint = cache._fingerprints[PRODUCT_CHOICES]
+    last_modified = cache.last_modified(PRODUCT_CHOICES)
+
+    # An expired entry recomputes the same rows: same fingerprint, same index
+    cache.backend.delete(PRODUCT_CHOICES)
+    assert product_index() is index
+    assert cache._fingerprints[PRODUCT_CHOICES] == fingerprint
+    assert cache.last_modified(PRODUCT_CHOICES) == last_modified
+
+    client.post('/products/add', data={'product_id': 'P3', 'name': 'Gizmo', 'unit_price': '1'})
+    assert [c['id'] for c in client.get('/api/products/lookup?q=giz').get_json()] == ['P3']
+    assert product_index() is not index
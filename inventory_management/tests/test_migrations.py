@@ -0,0 +1,21 @@
+from migrations import migrate, pending_migrations
+from models import db
+
+
+def test_migrate_drops_only_replaced_indexes(app):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('CREATE INDEX ix_product_movements_product_to '
+                             'ON product_movements (product_id, to_location)')
+        conn.exec_driver_sql('CREATE INDEX ix_product_movements_notes ON product_movements (notes)')
+    try:
+        assert pending_migrations(db.engine) == ['drop index ix_product_movements_product_to on product_movements']
+        assert migrate(db.engine) == ['drop index ix_product_movements_product_to on product_movements']
+        assert pending_migrations(db.engine) == []
+        with db.engine.connect() as conn:
+            names = {row[0] for row in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'product_movements'")}
+        assert 'ix_product_movements_notes' in names
+        assert 'ix_product_movements_product_to' not in names
+    finally:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('DROP INDEX IF EXISTS ix_product_movements_notes')
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import update
+
+import app as app_module
+from balances import get_balance, verify_balances
+from models import db, ProductMovement, StockBalance
+
+
+@pytest.fixture
+def stocked(client, catalog):
+    response = client.post('/movements/add', data={'product_id': 'P1', 'to_location': 'L1', 'qty': '10'})
+    assert response.status_code == 302
+    return ProductMovement.query.one()
+
+
+@pytest.mark.parametrize('form, message', [
+    ({'qty': '0', 'to_location': 'L1'}, b'Quantity must be a positive whole number'),
+    ({'qty': '-4', 'to_location': 'L1'}, b'Quantity must be a positive whole number'),
+    ({'qty': 'many', 'to_location': 'L1'}, b'Quantity must be a positive whole number'),
+    ({'qty': '99999999999999999999', 'to_location': 'L1'}, b'Quantity is too large'),
+    ({'qty': '1', 'from_location': 'L1', 'to_location': 'L1'}, b'From and to locations must be different'),
+])
+def test_add_rejects_invalid_movements(client, stocked, form, message):
+    response = client.post('/movements/add', data=dict(form, product_id='P1'))
+    assert response.status_code == 200
+    assert message in response.data
+    assert ProductMovement.query.count() == 1
+    assert get_balance('P1', 'L1') == 10
+
+
+@pytest.mark.parametrize('form, message', [
+    ({'from_location': 'L1', 'to_location': 'L1', 'qty': '3'}, b'From and to locations must be different'),
+    ({'to_location': 'L1', 'qty': '-3'}, b'Quantity must be a positive whole number'),
+    ({'to_location': 'L1', 'qty': str(2 ** 31)}, b'Quantity is too large'),
+])
+def test_edit_rejects_invalid_movements(client, stocked, form, message):
+    response = client.post(f'/movements/edit/{stocked.movement_id}', data=dict(form, product_id='P1'))
+    assert message in response.data
+    # The test client shares the test's app context, so end the request's transaction here
+    db.session.rollback()
+    assert db.session.get(ProductMovement, stocked.movement_id).qty == 10
+    assert get_balance('P1', 'L1') == 10
+
+
+def test_edit_moves_the_balance(client, stocked):
+    response = client.post(f'/movements/edit/{stocked.movement_id}',
+                           data={'product_id': 'P1', 'to_location': 'L2', 'qty': '4'})
+    assert response.status_code == 302
+    assert (get_balance('P1', 'L1'), get_balance('P1', 'L2')) == (0, 4)
+
+
+@pytest.fixture
+def edited_meanwhile(monkeypatch, stocked):
+    """Commit another writer's edit of the movement (10 -> 15 at L1) right after a route has read it"""
+    check = app_module.is_closed
+
+    def is_closed(timestamp):
+        with db.engine.begin() as conn:
+            conn.execute(update(ProductMovement.__table__).values(qty=15))
+            conn.execute(update(StockBalance.__table__).values(qty=15))
+        return check(timestamp)
+
+    monkeypatch.setattr(app_module, 'is_closed', is_closed)
+    return stocked
+
+
+@pytest.mark.parametrize('action', ['edit', 'delete'])
+def test_concurrent_change_is_a_conflict(client, edited_meanwhile, action):
+    data = {'product_id': 'P1', 'to_location': 'L2', 'qty': '4'} if action == 'edit' else None
+    response = client.post(f'/movements/{action}/{edited_meanwhile.movement_id}', data=data)
+    assert response.status_code == 302
+    db.session.rollback()
+    # Neither reverses the 10 it read: the other writer's edit stands and the ledger still balances
+    assert db.session.get(ProductMovement, edited_meanwhile.movement_id).qty == 15
+    assert (get_balance('P1', 'L1'), get_balance('P1', 'L2')) == (15, 0)
+    assert verify_balances() == []
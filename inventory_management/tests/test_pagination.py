@@ -0,0 +1,72 @@
+import html
+import re
+
+import pytest
+
+from bulk import ingest_movements
+from models import ProductMovement
+from pagination import InvalidCursor, keyset_paginate
+
+ORDER = (ProductMovement.timestamp, ProductMovement.movement_id)
+
+
+@pytest.fixture
+def ledger(catalog):
+    """Nine movements, seven of them sharing one timestamp"""
+    rows = [{'movement_id': f'M{i}', 'product_id': 'P1', 'to_location': 'L1', 'qty': 1,
+             'timestamp': '2024-01-02T00:00:00'} for i in range(7)]
+    rows += [{'movement_id': movement_id, 'product_id': 'P1', 'to_location': 'L1', 'qty': 1, 'timestamp': timestamp}
+             for movement_id, timestamp in (('OLD', '2024-01-01T00:00:00'), ('NEW', '2024-01-03T00:00:00'))]
+    assert ingest_movements(rows)['inserted'] == 9
+    return ['NEW'] + [f'M{i}' for i in reversed(range(7))] + ['OLD']
+
+
+def ids(page) -> list:
+    return [m.movement_id for m in page.items]
+
+
+def test_cursors_walk_ties_in_both_directions(ledger):
+    pages = [keyset_paginate(ProductMovement.query, ORDER, per_page=4)]
+    while pages[-1].has_next:
+        pages.append(keyset_paginate(ProductMovement.query, ORDER, cursor=pages[-1].next_cursor, per_page=4))
+    assert [ids(page) for page in pages] == [ledger[0:4], ledger[4:8], ledger[8:]]
+    assert not pages[0].has_prev
+
+    # Back from the last page, one page at a time
+    back = keyset_paginate(ProductMovement.query, ORDER, cursor=pages[-1].prev_cursor, per_page=4)
+    assert ids(back) == ledger[4:8]
+    back = keyset_paginate(ProductMovement.query, ORDER, cursor=back.prev_cursor, per_page=4)
+    assert ids(back) == ledger[0:4]
+    assert not back.has_prev and back.has_next
+
+
+def test_bad_cursor_is_rejected(client, ledger):
+    with pytest.raises(InvalidCursor):
+        keyset_paginate(ProductMovement.query, ORDER, cursor='not-a-cursor')
+    assert client.get('/movements?cursor=not-a-cursor').status_code == 400
+    assert client.get('/movements?paging=cursor&count=some').status_code == 400
+
+
+def pager(response) -> dict:
+    """The Previous/Next hrefs and total of a cursor-mode list page"""
+    text = response.get_data(as_text=True)
+    links = {label: html.unescape(href) for href, label in re.findall(r'href="([^"]+)">(Previous|Next)</a>', text)}
+    total = re.search(r'class="page-link">(~?\d+) total<', text)
+    return dict(links, total=total.group(1) if total else None)
+
+
+@pytest.mark.parametrize('count, total', [('none', None), ('exact', '9'), ('approx', '~9')])
+def test_list_pages_by_cursor_with_totals(client, ledger, count, total):
+    response = client.get(f'/movements?paging=cursor&per_page=4&count={count}')
+    assert pager(response)['total'] == total
+    seen = re.findall(r'<td><strong>(\w+)</strong></td>', response.get_data(as_text=True))
+    response = client.get(pager(response)['Next'])
+    seen += re.findall(r'<td><strong>(\w+)</strong></td>', response.get_data(as_text=True))
+    assert seen == ledger[:8]
+    assert pager(response)['total'] == total
+    assert 'cursor=' in pager(response)['Previous']
+
+
+def test_approximate_total_is_skipped_for_searches(client, ledger):
+    assert pager(client.get('/movements?paging=cursor&count=approx&q=M1'))['total'] is None
+    assert pager(client.get('/movements?paging=cursor&count=exact&q=P1'))['total'] == '9'
@@ -0,0 +1,35 @@
+import pytest
+
+import search
+from cache import get_cache
+from models import db, ProductMovement
+
+
+@pytest.fixture
+def ledger(client, catalog):
+    for data in ({'product_id': 'P1', 'to_location': 'L1', 'qty': '10', 'notes': 'delivery'},
+                 {'product_id': 'P1', 'from_location': 'L1', 'to_location': 'L2', 'qty': '4'},
+                 {'product_id': 'P2', 'to_location': 'L2', 'qty': '7', 'notes': 'delivery'}):
+        assert client.post('/movements/add', data=data).status_code == 302
+    # Start from the state of a freshly started process
+    get_cache().clear()
+    search._enabled.clear()
+    search.init_search(client.application, db)
+    movement_id = ProductMovement.query.order_by(ProductMovement.timestamp).first().movement_id
+    # The test client shares the test's app context; give the requests an empty session
+    db.session.remove()
+    return movement_id
+
+
+@pytest.mark.parametrize('url', [
+    '/',
+    '/movements',
+    '/movements?q=deliv',
+    '/movements/view/{movement_id}',
+    '/products/view/P1',
+    '/locations/view/L1',
+])
+def test_pages_stay_within_their_query_budget(client, ledger, url):
+    # A request over its budget raises QueryBudgetExceeded under app.testing
+    response = client.get(url.format(movement_id=ledger))
+    assert response.status_code == 200
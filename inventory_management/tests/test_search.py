@@ -0,0 +1,15 @@
+import search
+from models import db, ProductMovement
+
+
+def test_search_detection_happens_at_startup(app, client, catalog):
+    db.session.add(ProductMovement(movement_id='M1', product_id='P1', to_location='L1', qty=3, notes='pallet'))
+    db.session.commit()
+    # As in a freshly started process whose database already has the index
+    search._enabled.clear()
+    search.init_search(app, db)
+    assert search._enabled[db.engine.url]
+
+    response = client.get('/movements?q=pall')  # within its query budget under app.testing
+    assert response.status_code == 200
+    assert b'M1' in response.data
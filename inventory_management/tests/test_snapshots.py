@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app import app as flask_app, get_stock
+from bulk import ingest_movements
+from models import db, BalanceCheckpoint, ProductMovement
+from snapshots import parse_as_of, take_snapshot
+
+
+@pytest.fixture
+def ledger(catalog):
+    """P1 at L1: +10 on Jan 1st, -3 on Jan 3rd, +4 on Jan 5th 2024"""
+    result = ingest_movements([
+        {'movement_id': 'IN1', 'product_id': 'P1', 'to_location': 'L1', 'qty': 10, 'timestamp': '2024-01-01T09:00:00'},
+        {'movement_id': 'OUT', 'product_id': 'P1', 'from_location': 'L1', 'to_location': 'L2', 'qty': 3,
+         'timestamp': '2024-01-03T09:00:00'},
+        {'movement_id': 'IN2', 'product_id': 'P1', 'to_location': 'L1', 'qty': 4, 'timestamp': '2024-01-05T09:00:00'},
+    ])
+    assert result['errors'] == []
+
+
+def checkpoints() -> list:
+    return [c.as_of.day for c in BalanceCheckpoint.query.order_by(BalanceCheckpoint.as_of)]
+
+
+def test_offsets_are_converted_to_utc():
+    assert parse_as_of('2024-01-03T05:00:00+05:00') == datetime(2024, 1, 3)
+    assert parse_as_of('2024-01-03T00:00:00') == datetime(2024, 1, 3)
+    assert parse_as_of('2024-01-03') == datetime(2024, 1, 4)
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+def test_stock_as_of(ledger, snapshot):
+    if snapshot:
+        take_snapshot(datetime(2024, 1, 2))
+        take_snapshot(datetime(2024, 1, 4))
+        assert checkpoints() == [2, 4]
+    expected = {'2024-01-01': 10, '2024-01-02': 10, '2024-01-03': 7, '2024-01-04': 7, '2024-01-05': 11}
+    for day, qty in expected.items():
+        assert get_stock('P1', 'L1', parse_as_of(day)) == qty
+    assert get_stock('P1', 'L2', parse_as_of('2024-01-04T12:00:00+05:00')) == 3
+    assert get_stock('P1', 'L1', parse_as_of('2024-01-03T12:00:00+05:00')) == 10
+    assert get_stock('P1', 'L1', datetime(2023, 12, 31)) == 0
+
+
+def test_report_as_of_with_an_offset(client, ledger):
+    take_snapshot(datetime(2024, 1, 2))
+    # 09:30 at UTC+5 is 04:30 UTC, before the outgoing movement
+    response = client.get('/reports/balance.ndjson', query_string={'as_of': '2024-01-03T09:30:00+05:00'})
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [(row['location_id'], row['qty']) for row in rows] == [('L1', 10)]
+
+
+def test_edit_and_delete_discard_later_checkpoints(client, ledger):
+    for day in (2, 4, 6):
+        take_snapshot(datetime(2024, 1, day))
+
+    response = client.post('/movements/edit/OUT', data={'product_id': 'P1', 'from_location': 'L1',
+                                                        'to_location': 'L2', 'qty': '1'})
+    assert response.status_code == 302
+    assert checkpoints() == [2]
+    assert get_stock('P1', 'L1', datetime(2024, 1, 4)) == 9
+
+    take_snapshot(datetime(2024, 1, 6))
+    assert client.post('/movements/delete/IN2').status_code == 302
+    assert checkpoints() == [2]
+    assert get_stock('P1', 'L1', datetime(2024, 1, 6)) == 9
+    assert db.session.get(ProductMovement, 'IN2') is None
+
+
+def test_cli_snapshot_accepts_offsets(app):
+    runner = flask_app.test_cli_runner()
+    result = runner.invoke(args=['snapshot-balances', '--as-of', '2030-01-01T00:00:00+00:00'])
+    assert result.exit_code == 1
+    assert 'future' in result.output
+    result = runner.invoke(args=['snapshot-balances', '--as-of', '2024-01-02T05:00:00+05:00'])
+    assert result.exit_code == 0
+    assert checkpoints() == [2]
@@ -0,0 +1,26 @@
+import pytest
+
+from models import db, Product, StockBalance
+from writes import add, replace, upsert
+
+
+@pytest.fixture(params=['on_conflict', 'fallback'])
+def dialect(request, app, monkeypatch):
+    if request.param == 'fallback':
+        monkeypatch.setattr(db.engine.dialect, 'name', 'generic')
+    return request.param
+
+
+def test_upsert_adds_and_replaces(catalog, dialect):
+    balances = StockBalance.__table__
+    key = ['product_id', 'location_id']
+    upsert(balances, key, {'qty': add}, [{'product_id': 'P1', 'location_id': 'L1', 'qty': 5}])
+    upsert(balances, key, {'qty': add}, [{'product_id': 'P1', 'location_id': 'L1', 'qty': 3},
+                                         {'product_id': 'P2', 'location_id': 'L1', 'qty': 1}])
+    upsert(Product.__table__, ['product_id'], {'name': replace},
+           [{'product_id': 'P1', 'name': 'Renamed', 'description': 'ignored on update'}])
+    db.session.commit()
+    assert db.session.get(StockBalance, ('P1', 'L1')).qty == 8
+    assert db.session.get(StockBalance, ('P2', 'L1')).qty == 1
+    product = db.session.get(Product, 'P1')
+    assert (product.name, product.description) == ('Renamed', None)
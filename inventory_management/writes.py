@@ -0,0 +1,52 @@
+"""Dialect-aware write helpers shared by the balance, alert, rollup and catalog code.
+
+``upsert`` writes a batch of rows keyed by a unique constraint, merging into
+rows that already exist. SQLite and PostgreSQL do it with one executemany of
+INSERT ... ON CONFLICT DO UPDATE; other databases fall back to an UPDATE per
+row followed by an INSERT when no row matched.
+"""
+from typing import Callable, Dict, List
+
+from models import db
+
+# Keep IN (...) lists under SQLite's bound-parameter limit
+LOOKUP_CHUNK = 400
+
+
+def replace(current, new):
+    """Merge rule of ``upsert``: the written value replaces the stored one"""
+    return new
+
+
+def add(current, new):
+    """Merge rule of ``upsert``: the written value is added to the stored one"""
+    return current + new
+
+
+def upsert(table, key: List[str], set_: Dict[str, Callable], rows: List[dict]) -> None:
+    """Insert rows into table, merging those whose key columns match an existing row.
+    set_ maps each column to update on a match to its merge rule (``replace``,
+    ``add``); columns not in set_ keep their stored values. Runs in the session's
+    transaction.
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=key,
+            set_={name: merge(table.c[name], stmt.excluded[name]) for name, merge in set_.items()},
+        ), rows)
+        return
+    for row in rows:
+        result = db.session.execute(
+            table.update().where(*[table.c[name] == row[name] for name in key])
+            .values({name: merge(table.c[name], row[name]) for name, merge in set_.items()})
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(**row))